@@ -0,0 +1,163 @@
+"""
+Benchmarks loading and solving synthetic compartment cases of increasing size.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.run_benchmarks --sizes 2x2 10x10 50x40 -o results.json
+
+Each case is generated in a temporary directory and benchmarked in a fresh
+process, so that the peak memory of each size is measured separately. The
+results are written as JSON, one record per case, along with the versions and
+commit they were measured at, so runs can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import scipy
+from of_compartments import CompartmentModel
+from of_compartments.cellgrowth.growth_models import (
+    growthJacobian_xing_simplified, growthModel_xing_simplified,
+    params_xing_simplified)
+from of_compartments.cellgrowth.solver_stats import peak_memory
+
+from .synthetic_case import write_synthetic_case
+
+DEFAULT_SIZES = ["2x2", "5x4", "10x10", "20x25", "50x40"]
+
+INITIAL_CONCENTRATIONS = [100, 10, 0, 0, 1.07 / 5, 0.2e9]
+
+
+def run_benchmark(num_heights, num_radii, time, method, use_jacobian):
+    """Generates a case and returns the timings of loading and solving it."""
+    with tempfile.TemporaryDirectory() as case_dir:
+        start = perf_counter()
+        write_synthetic_case(case_dir, num_heights, num_radii)
+        write_time = perf_counter() - start
+
+        start = perf_counter()
+        cm = CompartmentModel(case_dir, damage_models=[])
+        init_time = perf_counter() - start
+        init_peak_memory = peak_memory()
+
+        sol = cm.run_sim(
+            time=time,
+            growth_model=growthModel_xing_simplified,
+            params=params_xing_simplified,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            growth_jacobian=growthJacobian_xing_simplified if use_jacobian else None,
+            t_eval=np.array([0, time]),
+            method=method,
+        )
+
+    stats = sol.stats
+    return {
+        "case": f"{num_heights}x{num_radii}",
+        "num_compartments": num_heights * num_radii,
+        "time": time,
+        "method": method,
+        "growth_jacobian": use_jacobian,
+        "success": bool(sol.success),
+        "write_time": write_time,
+        "init_time": init_time,
+        "init_peak_memory": init_peak_memory,
+        "wall_time": stats.wall_time,
+        "growth_time": stats.growth_time,
+        "transport_time": stats.transport_time,
+        "overhead_time": stats.overhead_time,
+        "nfev": stats.nfev,
+        "njev": stats.njev,
+        "nlu": stats.nlu,
+        "n_accepted": stats.n_accepted,
+        "n_rejected": stats.n_rejected,
+        "peak_memory": stats.peak_memory,
+    }
+
+
+def _environment():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "pandas": pd.__version__,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the compartment model on synthetic cases."
+    )
+    parser.add_argument(
+        "--sizes",
+        "-s",
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="grid sizes as <heights>x<radii>",
+    )
+    parser.add_argument(
+        "--time", "-t", type=float, default=48, help="time to simulate in hours"
+    )
+    parser.add_argument(
+        "--method", "-m", default="BDF", help="solver method passed to run_sim"
+    )
+    parser.add_argument(
+        "--no_jacobian",
+        action="store_true",
+        help="let the solver estimate the Jacobian by finite differences",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        default="benchmark_results.json",
+        help="file in which to write the results",
+    )
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        num_heights, num_radii = map(int, size.lower().split("x"))
+        print(f"{size}: {num_heights * num_radii} compartments", flush=True)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(
+                run_benchmark,
+                num_heights,
+                num_radii,
+                args.time,
+                args.method,
+                not args.no_jacobian,
+            ).result()
+        print(
+            f"\tinit {result['init_time']:.3g} s, run {result['wall_time']:.3g} s, "
+            f"{result['nfev']} RHS calls, "
+            f"peak memory {result['peak_memory'] / 2**20:.0f} MiB",
+            flush=True,
+        )
+        results.append(result)
+
+    with open(args.output, "w") as f:
+        json.dump({"environment": _environment(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Generates synthetic compartment cases on height x radius grids"""
+import os
+
+import numpy as np
+import pandas as pd
+from of_compartments import utils
+
+
+def write_synthetic_case(
+    case_dir: str,
+    num_heights: int,
+    num_radii: int,
+    height: float = 0.86,
+    radius: float = 0.28,
+    circulation_time: float = 10.0,
+    impeller_height_fraction: float = 0.3,
+    exchange_fraction: float = 0.2,
+    gas_flow: float = 5e-4,
+    seed: int = 0,
+) -> None:
+    """
+    Writes compartment_config, compartment_values.csv and interface_values.csv
+    for a cylindrical vessel divided into num_heights x num_radii compartments.
+
+    The defaults resemble the 200 L case. The flow is an axisymmetric
+    circulation with two loops, driven outward at the impeller height (as for a
+    radial impeller), given by a stream function psi on the compartment
+    corners: the flow through each face is the difference of psi at its ends,
+    so the net flow of every compartment is exactly zero. circulation_time
+    (seconds) sets the largest circulated flow relative to the vessel volume,
+    and turbulent exchange adds about exchange_fraction of the flow through
+    each face in both of its directions. Gas rises near the axis, so kLa and
+    gas holdup decrease with radius, and energy dissipation peaks near the
+    impeller.
+    Only nonzero interface flows are written, in m^3/s.
+    """
+    rng = np.random.default_rng(seed)
+    heights = height * np.arange(1, num_heights + 1) / num_heights
+    radii = radius * np.arange(1, num_radii + 1) / num_radii
+    ids = [utils.get_zone_id(h, r) for h in range(num_heights) for r in range(num_radii)]
+
+    # Cell centers and volumes
+    z_edges = np.concatenate([[0], heights])
+    r_edges = np.concatenate([[0], radii])
+    z_c = (z_edges[:-1] + z_edges[1:]) / 2
+    r_c = (r_edges[:-1] + r_edges[1:]) / 2
+    Z, R = np.meshgrid(z_c / height, r_c / radius, indexing="ij")
+    volumes = np.outer(np.diff(z_edges), np.pi * np.diff(r_edges**2))
+
+    # Stream function on the corners, zero on the axis and the walls; two
+    # counter-rotating loops above and below the impeller
+    z_n, r_n = np.meshgrid(z_edges / height, r_edges / radius, indexing="ij")
+    impeller = impeller_height_fraction
+    loops = np.where(
+        z_n < impeller,
+        np.sin(np.pi * z_n / impeller),
+        -np.sin(np.pi * (z_n - impeller) / (1 - impeller)),
+    )
+    psi = np.sin(np.pi * r_n) * loops
+    vessel_volume = np.pi * radius**2 * height
+    circulation = vessel_volume / circulation_time
+    psi *= circulation / max(np.max(np.abs(np.diff(psi, axis=0))), 1e-30)
+
+    # Upward flow through the top of each compartment, and outward flow
+    # through its outer side
+    up = psi[1:, 1:] - psi[1:, :-1]
+    out = -(psi[1:, 1:] - psi[:-1, 1:])
+
+    index = np.arange(num_heights * num_radii).reshape(num_heights, num_radii)
+    pairs = [
+        (index[:-1, :], index[1:, :], up[:-1, :]),
+        (index[:, :-1], index[:, 1:], out[:, :-1]),
+    ]
+    src, dest, flow = [], [], []
+    for lower, upper, q in pairs:
+        lower, upper, q = lower.ravel(), upper.ravel(), q.ravel()
+        # Exchange scales with the face's flow, with a floor so that regions
+        # without circulation (e.g., the loop centers) stay connected
+        face_flow = np.abs(q) + circulation / max(num_heights, num_radii)
+        exchange = exchange_fraction * face_flow * (0.5 + rng.random(len(q)))
+        src += [lower, upper]
+        dest += [upper, lower]
+        flow += [np.maximum(q, 0) + exchange, np.maximum(-q, 0) + exchange]
+    src, dest, flow = np.concatenate(src), np.concatenate(dest), np.concatenate(flow)
+    nonzero = flow > 0
+    interface_df = pd.DataFrame(
+        {
+            "compartment_src": np.array(ids)[src[nonzero]],
+            "compartment_dest": np.array(ids)[dest[nonzero]],
+            "corrected_flow": flow[nonzero],
+        }
+    )
+
+    noise = np.exp(0.1 * rng.standard_normal(Z.shape))
+    kLa = 30 * np.exp(-4 * R) * noise
+    gas_holdup = 2e-4 * kLa
+    epsilon = (0.005 + 0.2 * np.exp(-(((Z - impeller) / 0.1) ** 2) - R)) * noise
+    column_gas = np.exp(-4 * r_c / radius) * np.diff(r_edges**2)
+    top_gas_flux = np.broadcast_to(gas_flow * column_gas / np.sum(column_gas), Z.shape)
+    compartment_df = pd.DataFrame(
+        {
+            "compartment": ids,
+            "gas_holdup": gas_holdup.ravel(),
+            "kLa": kLa.ravel(),
+            "epsilon": epsilon.ravel(),
+            "volume": volumes.ravel(),
+            "top_gas_flux": top_gas_flux.ravel(),
+            "tau": (0.05 + 0.8 * np.sqrt(epsilon)).ravel(),
+            "high_tau_fraction": np.zeros(len(ids)),
+            "is_top": np.repeat(np.arange(num_heights) == num_heights - 1, num_radii),
+        }
+    )
+
+    os.makedirs(case_dir, exist_ok=True)
+    with open(os.path.join(case_dir, "compartment_config"), "w") as f:
+        f.write("heights: " + " ".join(f"{h:.10g}" for h in heights) + "\n")
+        f.write("radii: " + " ".join(f"{r:.10g}" for r in radii) + "\n")
+    compartment_df.to_csv(os.path.join(case_dir, "compartment_values.csv"), index=False)
+    interface_df.to_csv(os.path.join(case_dir, "interface_values.csv"), index=False)
@@ -8,42 +8,43 @@ from of_compartments.cellgrowth.growth_models import \
     growthModel_xing_simplified as growthModel
 from of_compartments.cellgrowth.growth_models import \
     params_xing_simplified as params
+from of_compartments.cellgrowth.observables import VolumeWeightedMean
+
+
+# Reactor-level curves, computed as the simulation runs
+OBSERVABLES = {
+    # 10^6 cells / mL
+    "vcd": VolumeWeightedMean(5, scale=1e-9),
+    # mM
+    "glucose": VolumeWeightedMean(0),
+    "glutamine": VolumeWeightedMean(1),
+    "lactate": VolumeWeightedMean(2),
+    "ammonia": VolumeWeightedMean(3),
+    # % of saturation
+    "DO": VolumeWeightedMean(4, scale=100 / 1.07),
+}
 
 
 def plot_results(sols, labels, outfile):
     fig, axs = plt.subplots(2, 3, layout="tight", figsize=(8, 4))
     time = np.max(sols[0].t)
     for i, sol in enumerate(sols):
-        cell_counts = sol.z[:, 5, :] * sol.v
-        vcd = np.sum(cell_counts, axis=1) / (1000 * np.sum(sol.v))
-        vcd /= 1e6
-        axs[0, 0].plot(sol.t, vcd, label=labels[i])
+        axs[0, 0].plot(sol.t, sol.observables["vcd"], label=labels[i])
         axs[0, 0].set_title("Viable Cell Density ($10^6$ cells / mL)", pad=20)
 
-        counts = 1000 * sol.z[:, 0, :] * sol.v
-        glucose = np.sum(counts, axis=1) / (1000 * np.sum(sol.v))
-        axs[0, 1].plot(sol.t, glucose, label=labels[i])
+        axs[0, 1].plot(sol.t, sol.observables["glucose"], label=labels[i])
         axs[0, 1].set_title("Glucose (mM)", pad=20)
 
-        counts = 1000 * sol.z[:, 1, :] * sol.v
-        glutamine = np.sum(counts, axis=1) / (1000 * np.sum(sol.v))
-        axs[0, 2].plot(sol.t, glutamine, label=labels[i])
+        axs[0, 2].plot(sol.t, sol.observables["glutamine"], label=labels[i])
         axs[0, 2].set_title("Glutamine (mM)", pad=20)
 
-        counts = 1000 * sol.z[:, 2, :] * sol.v
-        lactate = np.sum(counts, axis=1) / (1000 * np.sum(sol.v))
-        axs[1, 0].plot(sol.t, lactate, label=labels[i])
+        axs[1, 0].plot(sol.t, sol.observables["lactate"], label=labels[i])
         axs[1, 0].set_title("Lactate (mM)", pad=20)
 
-        counts = 1000 * sol.z[:, 3, :] * sol.v
-        ammonia = np.sum(counts, axis=1) / (1000 * np.sum(sol.v))
-        axs[1, 1].plot(sol.t, ammonia, label=labels[i])
+        axs[1, 1].plot(sol.t, sol.observables["ammonia"], label=labels[i])
         axs[1, 1].set_title("Ammonia (mM)", pad=20)
 
-        counts = 1000 * sol.z[:, 4, :] * sol.v
-        DO = np.sum(counts, axis=1) / (1000 * np.sum(sol.v))
-        DO *= 100 / 1.07
-        axs[1, 2].plot(sol.t, DO, label=labels[i])
+        axs[1, 2].plot(sol.t, sol.observables["DO"], label=labels[i])
         axs[1, 2].set_title("DO (%)", pad=20)
         axs[1, 2].set_ylim([0, 100])
 
@@ -111,6 +112,8 @@ if __name__ == "__main__":
             growth_model=growthModel,
             params=params,
             initial_concentrations=initial_concentrations,
+            observables=OBSERVABLES,
+            store_states=False,
         )
         sols.append(sol)
 
@@ -11,9 +11,13 @@ from of_compartments.cellgrowth.growth_models import \
     growthModel_xing_simplified as growthModel
 from of_compartments.cellgrowth.growth_models import \
     params_xing_simplified as params
+from of_compartments.cellgrowth.observables import VolumeWeightedMean
 
 plt.rcParams.update({"font.size": 14})
 
+# Viable cell density (10^6 cells / mL), computed as the simulation runs
+OBSERVABLES = {"vcd": VolumeWeightedMean(5, scale=1e-9)}
+
 
 def plot_comparison(
     baseline_sol,
@@ -26,16 +30,12 @@ def plot_comparison(
         1, len(other_sols), layout="tight", figsize=(6 * len(other_sols), 5)
     )
 
-    cell_counts = baseline_sol.z[:, 5, :] * baseline_sol.v
-    vcd_baseline = np.sum(cell_counts, axis=1) / (1000 * np.sum(baseline_sol.v))
-    vcd_baseline /= 1e6
+    vcd_baseline = baseline_sol.observables["vcd"]
     time = np.max(baseline_sol.t)
     for j in range(len(other_sols)):
         axs[j].plot(baseline_sol.t, vcd_baseline, "k:", label="no damage")
         for i in range(len(other_sols[j])):
-            cell_counts = other_sols[j][i].z[:, 5, :] * other_sols[j][i].v
-            vcd = np.sum(cell_counts, axis=1) / (1000 * np.sum(other_sols[j][i].v))
-            vcd /= 1e6
+            vcd = other_sols[j][i].observables["vcd"]
             axs[j].plot(other_sols[j][i].t, vcd, label=labels[i])
             axs[j].set_ylabel("Viable Cell Density ($10^6$ cells / mL)")
             axs[j].set_title(titles[j], pad=20)
@@ -113,6 +113,8 @@ if __name__ == "__main__":
             growth_model=growthModel,
             params=params,
             initial_concentrations=initial_concentrations,
+            observables=OBSERVABLES,
+            store_states=False,
         )
         eddy_sols.append(sol_eddy)
 
@@ -129,6 +131,8 @@ if __name__ == "__main__":
             growth_model=growthModel,
             params=params,
             initial_concentrations=initial_concentrations,
+            observables=OBSERVABLES,
+            store_states=False,
         )
         bubble_walls_sols.append(sol_bubble_walls)
 
@@ -141,6 +145,8 @@ if __name__ == "__main__":
             growth_model=growthModel,
             params=params,
             initial_concentrations=initial_concentrations,
+            observables=OBSERVABLES,
+            store_states=False,
         )
         bubble_cherry_sols.append(sol_bubble_cherry)
 
@@ -153,6 +159,8 @@ if __name__ == "__main__":
             growth_model=growthModel,
             params=params,
             initial_concentrations=initial_concentrations,
+            observables=OBSERVABLES,
+            store_states=False,
         )
 
     if case_labels is None:
@@ -15,10 +15,12 @@ calculate flux between compartments.
 
 The results are combined and written under the specified output_dir
 in a subfolder with the same name as the case. The output is
-two .csv files, one ('compartment_values.csv') with average values
-for each compartment and one with interface values between pairs of
-compartments ('interface_values.csv'). The 'compartment_config' is
-also copied to the output directory for later use.
+three .csv files, one ('compartment_values.csv') with average values
+for each compartment, one with interface values between pairs of
+compartments ('interface_values.csv'), and one
+('field_distributions.csv') with the volume-weighted quantiles of the
+fields in each compartment. The 'compartment_config' is also copied
+to the output directory for later use.
 """
 import argparse
 import os
@@ -153,6 +155,7 @@ def _write_compartment_values(case_dir, compartment_config, output_path, time, a
         output_path,
         time,
         args.high_shear_threshold,
+        args.max_workers,
     )
     # Copy compartment_config to output directory
     subprocess.check_call(
@@ -201,6 +204,12 @@ def _parse_args():
         help="threshold of shear for cell damage (Pa)",
         default=5,
     )
+    parser.add_argument(
+        "--max_workers",
+        help="number of compartments whose data files are read at a time "
+        "(default depends on the number of CPUs)",
+        type=int,
+    )
     parser.add_argument(
         "--pvpython_path",
         "-p",
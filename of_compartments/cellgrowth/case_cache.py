@@ -0,0 +1,254 @@
+"""Binary cache of the case data parsed from a compartment data directory"""
+import hashlib
+import json
+import os
+import types
+import warnings
+from dataclasses import fields
+from typing import Callable, List, Optional, Union
+
+import numpy as np
+import scipy.sparse as sp
+
+# Bump when the cached data (or how it's parsed) changes
+CACHE_VERSION = 2
+
+# Files the case is parsed from
+SOURCE_FILES = ["compartment_values.csv", "interface_values.csv"]
+
+DEFAULT_CACHE_DIR = ".case_cache"
+
+_META_FILE = "meta.json"
+
+
+class CaseCache:
+    """
+    Cache of the compartment data, flow matrix and damage rates of a case.
+
+    Arrays are stored as .npy files, which load without parsing; a sparse
+    flow matrix is stored as its CSR arrays. The cache is valid while the
+    source files are unchanged: each is recorded with its size, modification
+    time and SHA-256 hash, and only hashed again if its size or modification
+    time differs (e.g., after a copy), so checking the cache doesn't read the
+    files. Damage rates are stored per key of the damage models (see
+    damage_model_key).
+    """
+
+    def __init__(self, case_dir: str, cache_dir: Optional[str] = None):
+        self.case_dir = case_dir
+        if cache_dir is None:
+            cache_dir = os.path.join(case_dir, DEFAULT_CACHE_DIR)
+        self.cache_dir = cache_dir
+
+    def load(self):
+        """Returns the cached (CompartmentData, F), or None if not valid."""
+        from .compartment_model import CompartmentData
+
+        meta = self._read_meta()
+        if meta is None:
+            return None
+        arrays = {
+            field.name: self._load_array(field.name)
+            for field in fields(CompartmentData)
+            if field.name != "ids"
+        }
+        compartment_data = CompartmentData(ids=meta["ids"], **arrays)
+        if meta["F_format"] == "csr":
+            num_compartments = len(meta["ids"])
+            F = sp.csr_matrix(
+                (
+                    self._load_array("F_data"),
+                    self._load_array("F_indices"),
+                    self._load_array("F_indptr"),
+                ),
+                shape=(num_compartments, num_compartments),
+            )
+        else:
+            F = self._load_array("F")
+        return compartment_data, F
+
+    def save(self, compartment_data, F: Union[np.ndarray, sp.spmatrix]) -> None:
+        """Stores the compartment data and flow matrix, replacing any cache."""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Invalidate while writing, in case another process reads it
+            meta_path = os.path.join(self.cache_dir, _META_FILE)
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".npy"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+            for field in fields(compartment_data):
+                if field.name != "ids":
+                    self._save_array(
+                        field.name, getattr(compartment_data, field.name)
+                    )
+            if sp.issparse(F):
+                F = sp.csr_matrix(F)
+                self._save_array("F_data", F.data)
+                self._save_array("F_indices", F.indices)
+                self._save_array("F_indptr", F.indptr)
+            else:
+                self._save_array("F", F)
+            self._write_meta(
+                {
+                    "version": CACHE_VERSION,
+                    "sources": {
+                        name: _file_signature(os.path.join(self.case_dir, name))
+                        for name in SOURCE_FILES
+                    },
+                    "ids": [str(id) for id in compartment_data.ids],
+                    "F_format": "csr" if sp.issparse(F) else "dense",
+                }
+            )
+        except OSError as e:
+            warnings.warn(f"could not write case cache in {self.cache_dir}: {e}")
+
+    def load_k_d(self, key: str) -> Optional[np.ndarray]:
+        """Returns the damage rates stored under key, if any."""
+        path = os.path.join(self.cache_dir, f"k_d_{key}.npy")
+        if not os.path.exists(path):
+            return None
+        return np.load(path)
+
+    def save_k_d(self, key: str, k_d: np.ndarray) -> None:
+        try:
+            self._save_array(f"k_d_{key}", k_d)
+        except OSError as e:
+            warnings.warn(f"could not write case cache in {self.cache_dir}: {e}")
+
+    def _read_meta(self) -> Optional[dict]:
+        """Returns the cache metadata if the cache matches the source files."""
+        meta_path = os.path.join(self.cache_dir, _META_FILE)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != CACHE_VERSION:
+            return None
+
+        updated = False
+        for name in SOURCE_FILES:
+            path = os.path.join(self.case_dir, name)
+            cached = meta["sources"].get(name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            if cached is None:
+                return None
+            if cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime_ns:
+                continue
+            # Possibly touched or copied; compare the contents
+            signature = _file_signature(path)
+            if signature["hash"] != cached["hash"]:
+                return None
+            meta["sources"][name] = signature
+            updated = True
+        if updated:
+            try:
+                self._write_meta(meta)
+            except OSError:
+                pass
+        return meta
+
+    def _write_meta(self, meta: dict) -> None:
+        tmp_path = os.path.join(self.cache_dir, _META_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.cache_dir, _META_FILE))
+
+    def _save_array(self, name: str, array: np.ndarray) -> None:
+        np.save(os.path.join(self.cache_dir, f"{name}.npy"), np.asarray(array))
+
+    def _load_array(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.cache_dir, f"{name}.npy"))
+
+
+def _file_signature(path: str) -> dict:
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+
+def damage_models_key(damage_models: List[Callable]) -> Optional[str]:
+    """
+    Returns the key of the damage rates of a list of damage models, or None if
+    any of them has no key (see damage_model_key).
+    """
+    digest = hashlib.sha256()
+    for model in damage_models:
+        key = damage_model_key(model)
+        if key is None:
+            return None
+        digest.update(key.encode())
+    return digest.hexdigest()
+
+
+def compartment_data_fingerprint(compartment_data) -> str:
+    """Returns a fingerprint of the values of a CompartmentData."""
+    digest = hashlib.sha256()
+    for field in fields(compartment_data):
+        digest.update(field.name.encode())
+        value = getattr(compartment_data, field.name)
+        if field.name == "ids":
+            _update_digest(digest, [str(id) for id in value])
+        else:
+            _update_digest(digest, np.asarray(value))
+    return digest.hexdigest()
+
+
+def damage_model_key(model: Callable) -> Optional[str]:
+    """
+    Returns a key of a damage model from its name and parameters: the values it
+    closes over (e.g., the parameters given to the damage model factories) and
+    its defaults. None for lambdas, which have no name, and models with
+    parameters other than numbers, strings, arrays, functions (by name) and
+    containers of those.
+
+    The code of the model isn't part of the key, so the cache must be removed
+    after changing a damage model.
+    """
+    if not isinstance(model, types.FunctionType) or "<lambda>" in model.__qualname__:
+        return None
+    digest = hashlib.sha256()
+    digest.update(f"{model.__module__}.{model.__qualname__}".encode())
+    cells = model.__closure__ or ()
+    try:
+        for value in [
+            model.__defaults__,
+            model.__kwdefaults__,
+            tuple(cell.cell_contents for cell in cells),
+        ]:
+            _update_digest(digest, value)
+    except (TypeError, RecursionError):
+        return None
+    return digest.hexdigest()
+
+
+def _update_digest(digest, value) -> None:
+    if isinstance(value, (types.FunctionType, types.BuiltinFunctionType)):
+        digest.update(f"function {value.__module__}.{value.__qualname__}".encode())
+    elif isinstance(value, np.ndarray):
+        digest.update(f"array {value.dtype} {value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (tuple, list)):
+        digest.update(f"{type(value).__name__} {len(value)}".encode())
+        for item in value:
+            _update_digest(digest, item)
+    elif isinstance(value, dict):
+        digest.update(f"dict {len(value)}".encode())
+        for key in sorted(value, key=repr):
+            _update_digest(digest, key)
+            _update_digest(digest, value[key])
+    elif value is None or isinstance(
+        value, (bool, int, float, complex, str, bytes, np.generic)
+    ):
+        digest.update(f"{type(value).__name__} {value!r}".encode())
+    else:
+        raise TypeError(f"can't fingerprint {type(value).__name__}")
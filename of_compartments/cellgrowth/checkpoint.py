@@ -0,0 +1,196 @@
+"""Checkpoints of the solver state for resuming long simulations"""
+import hashlib
+import json
+import os
+import time as wall_time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import scipy.sparse as sp
+
+from .compartment_model import Case
+from .observables import ObservableRecorder
+from .output_store import MemoryOutput
+
+
+@dataclass
+class Checkpoint:
+    # Simulation time of the checkpoint (hours)
+    t: float
+    # Solver state (of the reduced system, if fast species are eliminated)
+    y: np.ndarray
+    # Solver step size at the checkpoint (hours)
+    h_abs: float
+    # Output so far, if it was kept in memory (otherwise empty)
+    history_t: np.ndarray
+    history_y: np.ndarray
+    # State of the observables recorded so far, if any (see
+    # ObservableRecorder.state)
+    observables: Optional[dict]
+    # Parameters, initial concentrations, fast species and case fingerprint
+    config: dict
+
+
+class Checkpointer:
+    """
+    Writes the solver state to a checkpoint file during the integration.
+
+    Called with the solver after every accepted step; a checkpoint is written
+    when interval seconds (of wall time) have passed since the last one, and at
+    the end of the integration. If output keeps the states in memory, they are
+    saved too, as are any observables recorded by output, so a resumed run
+    returns the whole solution.
+    """
+
+    def __init__(self, path: str, interval: float, config: dict, output):
+        self.path = path
+        self.interval = interval
+        self.config = config
+        self.output = output
+        self._last_save = wall_time.monotonic()
+
+    def __call__(self, solver, final: bool = False) -> None:
+        if final or wall_time.monotonic() - self._last_save >= self.interval:
+            save_checkpoint(self.path, solver, self.output, self.config)
+            self._last_save = wall_time.monotonic()
+
+
+def save_checkpoint(path: str, solver, output, config: dict) -> None:
+    """Writes a checkpoint of the solver (and in-memory output) to path."""
+    observables = {}
+    if isinstance(output, ObservableRecorder):
+        observables = _observable_arrays(output.state())
+        output = output.output
+    if isinstance(output, MemoryOutput) and len(output.t):
+        history_t = output.t
+        history_y = output.y.T
+    else:
+        history_t = np.zeros(0)
+        history_y = np.zeros((0, len(solver.y)))
+
+    # Write to a temporary file first so a crash can't corrupt the checkpoint
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            t=solver.t,
+            y=solver.y,
+            h_abs=solver.h_abs,
+            history_t=history_t,
+            history_y=history_y,
+            config=json.dumps(config, default=float),
+            **observables,
+        )
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str) -> Checkpoint:
+    with np.load(path) as data:
+        return Checkpoint(
+            t=float(data["t"]),
+            y=data["y"],
+            h_abs=float(data["h_abs"]),
+            history_t=data["history_t"],
+            history_y=data["history_y"],
+            observables=_observable_state(data),
+            config=json.loads(str(data["config"])),
+        )
+
+
+def _observable_arrays(state: dict) -> dict:
+    """Returns the arrays to save for an ObservableRecorder state."""
+    names = list(state["values"])
+    arrays = {
+        "observables": json.dumps(
+            {
+                "names": names,
+                "last_t": state["last_t"],
+                "cumulative": [name in state["integrals"] for name in names],
+            },
+            default=float,
+        ),
+        "observables_t": state["t"],
+    }
+    for i, name in enumerate(names):
+        arrays[f"observables_values_{i}"] = state["values"][name]
+        if name in state["integrals"]:
+            arrays[f"observables_integral_{i}"] = state["integrals"][name]
+            arrays[f"observables_last_integrand_{i}"] = state["last_integrand"][name]
+    return arrays
+
+
+def _observable_state(data) -> Optional[dict]:
+    """Returns the ObservableRecorder state saved in a checkpoint, if any."""
+    if "observables" not in data:
+        return None
+    saved = json.loads(str(data["observables"]))
+    state = {
+        "t": data["observables_t"],
+        "values": {},
+        "last_t": saved["last_t"],
+        "last_integrand": {},
+        "integrals": {},
+    }
+    for i, (name, cumulative) in enumerate(zip(saved["names"], saved["cumulative"])):
+        state["values"][name] = data[f"observables_values_{i}"]
+        if cumulative:
+            state["integrals"][name] = data[f"observables_integral_{i}"]
+            state["last_integrand"][name] = data[f"observables_last_integrand_{i}"]
+    return state
+
+
+def create_config(
+    case: Case,
+    params: dict,
+    initial_concentrations,
+    fast_species: Optional[list],
+) -> dict:
+    """Returns the configuration a checkpoint must match to be resumed."""
+    return json.loads(
+        json.dumps(
+            {
+                "params": params,
+                "initial_concentrations": list(initial_concentrations),
+                "fast_species": None if not fast_species else list(fast_species),
+                "case": case_fingerprint(case),
+            },
+            default=float,
+        )
+    )
+
+
+def check_config(checkpoint: Checkpoint, config: dict) -> None:
+    """Raises a ValueError if the checkpoint was made with another configuration."""
+    for key, description in [
+        ("case", "case (flow, volumes or damage rates)"),
+        ("params", "parameters"),
+        ("initial_concentrations", "initial concentrations"),
+        ("fast_species", "fast species"),
+    ]:
+        if checkpoint.config[key] != config[key]:
+            raise ValueError(f"checkpoint was made with different {description}")
+
+
+def case_fingerprint(case: Case) -> str:
+    """Returns a hash of the case arrays that determine the solution."""
+    digest = hashlib.sha256()
+    F = case.F
+    if sp.issparse(F):
+        F = sp.csr_matrix(F)
+        arrays = [F.data, F.indices, F.indptr]
+    else:
+        arrays = [F]
+    arrays += [
+        case.k_d,
+        case.compartment_data.volumes,
+        case.compartment_data.kLa,
+    ]
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    if case.snapshots is not None:
+        digest.update(case.snapshots.interpolation.encode())
+        digest.update(case.snapshots.times.tobytes())
+        for snapshot in case.snapshots.cases:
+            digest.update(case_fingerprint(snapshot).encode())
+    return digest.hexdigest()
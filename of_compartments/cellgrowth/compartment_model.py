@@ -1,11 +1,30 @@
+import dataclasses
 import os
 from collections.abc import Callable
 from dataclasses import dataclass
-from typing import List
+from functools import partial
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
-from scipy.integrate import solve_ivp
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+from scipy.integrate import BDF
+from scipy.linalg import expm
+from scipy.optimize import OptimizeResult
+
+from .case_cache import CaseCache, damage_models_key
+from .growth_protocol import GrowthModel, LegacyGrowthModel, as_growth_model
+from .observables import Observable, ObservableRecorder
+from .output_store import MemoryOutput, SimulationStore
+from .snapshots import CaseSnapshots
+from .solver_stats import ProgressReporter, SolverStats, peak_memory, timed
+
+# Number of compartments above which the flow matrix and transport operator
+# are stored as sparse matrices
+_SPARSE_TRANSPORT_MIN_COMPARTMENTS = 100
 
 
 @dataclass
@@ -23,9 +42,21 @@ class CompartmentData:
 @dataclass
 class Case:
     volume: float
-    F: np.ndarray
+    # Flow between compartments in m^3/h, F[i, j] from i to j; sparse (CSR) for
+    # large cases
+    F: Union[np.ndarray, sp.csr_matrix]
     k_d: np.ndarray
     compartment_data: CompartmentData
+    # Matrix T such that T @ c is the net flux (per volume) into each
+    # compartment for concentrations c
+    transport: Union[np.ndarray, sp.csr_matrix]
+    # For time-varying cases, the case of each CFD snapshot (the fields above
+    # are those of the first snapshot); use snapshots.at(t) for the case at t
+    snapshots: Optional[CaseSnapshots] = None
+    # Upward gas flow (m^3/h) between compartments, G[i, j] from i into j
+    # above it, for lumped cases (see lumping.py); otherwise it follows from
+    # the compartment ids
+    gas_flow: Optional[sp.csr_matrix] = None
 
 
 class CompartmentModel:
@@ -33,9 +64,32 @@ class CompartmentModel:
         self,
         case_dir: str,
         damage_models: List[Callable[[CompartmentData], np.ndarray]],
+        cache: Union[bool, str] = False,
+        snapshot_interpolation: str = "linear",
     ):
+        """
+        Args:
+            case_dir: Directory with the compartment data of the case. For a
+                flow field that changes over time, it instead has a
+                subdirectory with the compartment data of each CFD snapshot,
+                named by the time (hours) from which the snapshot applies,
+                e.g. 0/ and 48/.
+            damage_models: Functions returning contributions to the cell death
+                rate in each compartment.
+            cache: Whether to cache the parsed case data (and damage rates) in
+                binary form, so later models of the same case load quickly
+                (off by default). True stores the cache in
+                case_dir/.case_cache; a path stores it in that directory. It
+                is rebuilt when the case files change, but not when the code
+                of a damage model does (see case_cache.damage_model_key).
+            snapshot_interpolation: How the case changes between snapshot
+                times: "linear" to interpolate between snapshots, or "previous"
+                to switch to each snapshot at its time.
+        """
         self.case_dir = case_dir
         self.damage_models = damage_models
+        self.cache = cache
+        self.snapshot_interpolation = snapshot_interpolation
 
         self.case = self._create_case()
 
@@ -45,18 +99,215 @@ class CompartmentModel:
         growth_model: Callable[[float, np.ndarray, dict, Case], np.ndarray],
         params: dict,
         initial_concentrations: List[float],
+        growth_jacobian: Optional[
+            Callable[[float, np.ndarray, dict, Case], np.ndarray]
+        ] = None,
+        t_eval: Optional[np.ndarray] = None,
+        output_path: Optional[str] = None,
+        method: str = "BDF",
+        split_step: float = 0.05,
+        fast_species: Optional[List[int]] = None,
+        check_qssa: bool = False,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_interval: float = 600.0,
+        resume_from: Optional[str] = None,
+        progress: Optional[Callable[[float, float, float], None]] = None,
+        observables: Optional[Dict[str, Observable]] = None,
+        store_states: bool = True,
     ) -> None:
         """
         Run the cell growth simulation in the compartment model
 
         Args:
             time: The time to run the simulation for (hours)
-            growthModel: Function describing the cell growth.
+            growthModel: Function describing the cell growth, or a GrowthModel
+                (see growth_protocol), which the BDF method evaluates in place
+                with its parameters bound once.
             params: dict specifying parameters needed by the growth model.
             initial_concentrations: array of initial values for cells and
                 metabolites, in the same order as used in the growthModel.
+            growth_jacobian: Optional function returning the local Jacobian of
+                the growth model, with shape (species, species, compartments).
+                If not given, the solver estimates the Jacobian by finite
+                differences using its sparsity pattern, unless growth_model is
+                a GrowthModel with a jacobian method.
+            t_eval: Times at which to store the solution, within [0, time].
+                By default every solver step is stored (or every hour, when
+                writing to disk).
+            output_path: If given, the solution is written to a SimulationStore
+                in this directory as the integration runs, and sol.z is a
+                memory-mapped view of it rather than an array in memory.
+            method: "BDF" to solve the coupled system with a stiff solver, or
+                "strang" to use Strang splitting, alternating exact transport
+                steps with reaction steps solved in each compartment.
+            split_step: Step size (hours) of the "strang" method.
+            fast_species: Indices of species that relax much faster than the
+                rest (e.g., dissolved oxygen). If given, they are held at their
+                quasi-steady state instead of being integrated, which removes
+                the stiffest directions from the system; their initial values
+                are ignored. sol.qssa_error_estimate holds the estimated error
+                of the fast species (largest over compartments) at each output
+                time.
+            check_qssa: With fast_species, also solve the full model and store
+                the largest error of each species, relative to its largest
+                value, in sol.qssa_error.
+            checkpoint_path: If given, the solver state is saved to this file
+                (see checkpoint.py) every checkpoint_interval seconds of wall
+                time and at the end of the integration.
+            checkpoint_interval: Wall time (seconds) between checkpoints.
+            resume_from: Checkpoint file to continue the integration from, up
+                to time, which may be longer than the time of the run that
+                saved it. The case, params, initial_concentrations and
+                fast_species must be the same as for that run. Output kept in
+                memory includes the states before the checkpoint; when writing
+                to output_path, only the output times after it are written.
+                The solver restarts at order 1 from the saved step size, so the
+                result agrees with an uninterrupted run to the solver
+                tolerances, not step for step.
+            progress: Optional function called as progress(t, time, rate) about
+                once per second of wall time, and at the end, with the current
+                simulation time t and the simulated hours per wall second.
+            observables: Quantities to compute from the states at the output
+                times as the integration runs, by name (see observables.py),
+                returned in sol.observables with one row per time in sol.t.
+            store_states: Whether to keep the states (sol.y and sol.z). If
+                False, only the observables are kept, and sol.y and sol.z are
+                None (as is sol.qssa_error_estimate).
+
+        Returns:
+            The solution, with solver statistics (evaluations, steps, and time
+            spent in the growth model, transport and solver) in sol.stats, and
+            the compartment volumes in sol.v (at each time in sol.t, with shape
+            (times, compartments), for time-varying cases)
+        """
+        if not store_states and output_path is not None:
+            raise ValueError("output_path requires store_states")
+        CompartmentModel._check_t_eval(t_eval, time)
+        resume = None
+        if resume_from is not None:
+            from .checkpoint import load_checkpoint
+
+            resume = load_checkpoint(resume_from)
+
+        output = None
+        if output_path is not None:
+            if t_eval is None:
+                t_eval = CompartmentModel._hourly_times(time)
+            if resume is not None:
+                t_eval = t_eval[t_eval > resume.t]
+            output = SimulationStore.create(
+                output_path,
+                t_eval,
+                len(initial_concentrations),
+                len(self.case.compartment_data.ids),
+                self.case.compartment_data.volumes,
+            )
+
+        sol = CompartmentModel._solve(
+            self.case,
+            time,
+            growth_model,
+            params,
+            initial_concentrations,
+            growth_jacobian=growth_jacobian,
+            t_eval=t_eval,
+            output=output,
+            method=method,
+            split_step=split_step,
+            fast_species=fast_species,
+            check_qssa=check_qssa,
+            checkpoint_path=checkpoint_path,
+            checkpoint_interval=checkpoint_interval,
+            resume=resume,
+            progress=progress,
+            observables=observables,
+            store_states=store_states,
+        )
+
+        self.t = sol.t
+        self.x = sol.y
+        return sol
+
+    def run_ensemble(
+        self,
+        time: float,
+        growth_model: Callable[[float, np.ndarray, dict, Case], np.ndarray],
+        params_list: List[dict],
+        initial_conditions_list: List[List[float]],
+        growth_jacobian: Optional[
+            Callable[[float, np.ndarray, dict, Case], np.ndarray]
+        ] = None,
+        t_eval: Optional[np.ndarray] = None,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Run the simulation for many parameter sets and initial conditions in
+        parallel, reusing this model's case.
+
+        Args:
+            time: The time to run each simulation for (hours)
+            growth_model: Function describing the cell growth. Must be defined
+                at module level so it can be sent to worker processes.
+            params_list: parameter dicts, one per member (or a single one used
+                for all members).
+            initial_conditions_list: initial concentrations, one per member (or
+                a single one used for all members).
+            growth_jacobian: Optional local Jacobian of the growth model.
+            t_eval: Times at which to store the results (default hourly).
+            max_workers: Number of worker processes (default number of CPUs).
+
+        Returns:
+            EnsembleResult with z of shape (members, times, species, compartments)
+        """
+        from .ensemble import run_ensemble
+
+        return run_ensemble(
+            self.case,
+            time,
+            growth_model,
+            params_list,
+            initial_conditions_list,
+            growth_jacobian=growth_jacobian,
+            t_eval=t_eval,
+            max_workers=max_workers,
+        )
+
+    @staticmethod
+    def _solve(
+        case: Case,
+        time: float,
+        growth_model: Callable[[float, np.ndarray, dict, Case], np.ndarray],
+        params: dict,
+        initial_concentrations: List[float],
+        growth_jacobian: Optional[
+            Callable[[float, np.ndarray, dict, Case], np.ndarray]
+        ] = None,
+        t_eval: Optional[np.ndarray] = None,
+        output: Optional[Union[MemoryOutput, SimulationStore]] = None,
+        method: str = "BDF",
+        split_step: float = 0.05,
+        fast_species: Optional[List[int]] = None,
+        check_qssa: bool = False,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_interval: float = 600.0,
+        resume=None,
+        progress: Optional[Callable[[float, float, float], None]] = None,
+        observables: Optional[Dict[str, Observable]] = None,
+        store_states: bool = True,
+    ):
         """
-        num_compartments = len(self.compartment_ids)
+        Solves the growth model in the compartments of the given case.
+
+        See run_sim for a description of the arguments; resume is a loaded
+        Checkpoint. If t_eval is given, the solution is only stored at those
+        times. States are kept in memory unless another output (e.g., a
+        SimulationStore) is given, or store_states is False.
+        """
+        start = perf_counter()
+        stats = SolverStats()
+        compartment_ids = list(case.compartment_data.ids)
+        num_compartments = len(compartment_ids)
+        num_species = len(initial_concentrations)
 
         IV = np.zeros((len(initial_concentrations), num_compartments))
         for i in range(len(initial_concentrations)):
@@ -66,28 +317,667 @@ class CompartmentModel:
             IV.shape[0] * IV.shape[1],
         )
 
-        sol = solve_ivp(
-            CompartmentModel._update_model,
-            [0, time],
-            IV,
-            args=(
+        if (
+            isinstance(growth_model, GrowthModel)
+            and growth_jacobian is None
+            and growth_model.has_jacobian
+        ):
+            # For the methods that take a Jacobian function
+            growth_jacobian = growth_model.local_jacobian
+
+        if output is None and store_states:
+            output = MemoryOutput(len(IV))
+        if check_qssa and not store_states:
+            raise ValueError("check_qssa requires store_states")
+
+        # States are written to sink, which computes any observables (and
+        # records the output times if the states aren't kept)
+        sink = output
+        recorder = None
+        if observables or output is None:
+            recorder = ObservableRecorder(observables or {}, case, num_species, output)
+            sink = recorder
+
+        callbacks = []
+        if checkpoint_path is not None or resume is not None:
+            from .checkpoint import Checkpointer, check_config, create_config
+
+            if method != "BDF":
+                raise ValueError("checkpoints are only supported by the BDF method")
+            config = create_config(case, params, initial_concentrations, fast_species)
+            if resume is not None:
+                check_config(resume, config)
+                if resume.t >= time:
+                    raise ValueError(
+                        f"checkpoint at t={resume.t} is not before time={time}"
+                    )
+                if t_eval is not None:
+                    t_eval = np.asarray(t_eval)[np.asarray(t_eval) > resume.t]
+                if len(resume.history_t) and isinstance(output, MemoryOutput):
+                    output.write(resume.history_t, resume.history_y)
+                if recorder is not None:
+                    CompartmentModel._resume_observables(recorder, resume)
+            if checkpoint_path is not None:
+                callbacks.append(
+                    Checkpointer(checkpoint_path, checkpoint_interval, config, sink)
+                )
+        if progress is not None:
+            t0 = 0 if resume is None else resume.t
+            callbacks.append(ProgressReporter(progress, t0, time))
+
+        if case.snapshots is not None and (method != "BDF" or fast_species):
+            # Both precompute operators of a single transport matrix
+            raise ValueError(
+                "time-varying cases are only supported by the BDF method, "
+                "without fast_species"
+            )
+        if fast_species:
+            if method != "BDF":
+                raise ValueError("fast_species is only supported by the BDF method")
+            sol = CompartmentModel._solve_quasi_steady_state(
+                case,
+                growth_model,
                 params,
-                self.case,
-                self.compartment_ids,
+                growth_jacobian,
+                fast_species,
+                time,
+                IV,
+                sink,
+                t_eval=t_eval,
+                resume=resume,
+                callbacks=callbacks,
+                stats=stats,
+            )
+            CompartmentModel._finish_stats(sol, stats, start)
+            if check_qssa:
+                full_sol = CompartmentModel._solve(
+                    case,
+                    time,
+                    growth_model,
+                    params,
+                    initial_concentrations,
+                    growth_jacobian=growth_jacobian,
+                    t_eval=sol.t,
+                )
+                sol.qssa_error = CompartmentModel._relative_species_error(
+                    sol.z, full_sol.z
+                )
+            CompartmentModel._name_species(sol, growth_model)
+            return sol
+
+        if method == "strang":
+            grow_jacobian = None
+            if growth_jacobian is not None:
+
+                def grow_jacobian(t, z):
+                    return growth_jacobian(t, z, params, case)
+
+            sol = CompartmentModel._integrate_strang(
+                lambda t, z: growth_model(t, z, params, case),
+                grow_jacobian,
+                case.transport,
+                time,
+                IV.reshape(num_species, num_compartments),
+                sink,
+                split_step,
+                t_eval=t_eval,
+                callbacks=callbacks,
+                stats=stats,
+                atol=1e-12,
+                rtol=1e-8,
+            )
+        elif method == "BDF":
+            sol = CompartmentModel._solve_bdf(
+                case,
                 growth_model,
+                params,
+                growth_jacobian,
+                time,
+                IV,
+                sink,
+                t_eval=t_eval,
+                resume=resume,
+                callbacks=callbacks,
+                stats=stats,
+            )
+        else:
+            raise ValueError(f"invalid method {method}")
+
+        CompartmentModel._store_solution(sol, sink, num_species, case)
+        CompartmentModel._finish_stats(sol, stats, start)
+        CompartmentModel._name_species(sol, growth_model)
+        return sol
+
+    @staticmethod
+    def _resume_observables(recorder: ObservableRecorder, resume) -> None:
+        """
+        Continues the observables (and output times) recorded before the
+        checkpoint, from their saved state or else from the saved states.
+        """
+        saved = resume.observables
+        if saved is not None and set(saved["values"]) == set(recorder.observables):
+            recorder.restore(saved)
+        elif len(resume.history_t):
+            recorder.record(resume.history_t, resume.history_y)
+        else:
+            raise ValueError(
+                "checkpoint has neither the states nor these observables, "
+                "so they can't be continued"
+            )
+
+    @staticmethod
+    def _store_solution(
+        sol: OptimizeResult,
+        output: Union[MemoryOutput, SimulationStore, ObservableRecorder],
+        num_species: int,
+        case: Case,
+    ) -> None:
+        """Sets the output times, states and observables of sol from output."""
+        num_compartments = len(case.compartment_data.ids)
+        sol.t = output.t
+        sol.y = output.y
+        sol.z = None
+        if sol.y is not None:
+            sol.z = sol.y.T.reshape(len(sol.t), num_species, num_compartments)
+        if isinstance(output, ObservableRecorder):
+            sol.observables = output.values
+        sol.v = case.compartment_data.volumes
+        if case.snapshots is not None:
+            # Volumes at each output time
+            sol.v = np.array(
+                [case.snapshots.at(t).compartment_data.volumes for t in sol.t]
+            ).reshape(len(sol.t), num_compartments)
+
+    @staticmethod
+    def _name_species(sol: OptimizeResult, growth_model: Callable) -> None:
+        """
+        Sets sol.species to the states of each species by name (times,
+        compartments), if the growth model names its species.
+        """
+        names = getattr(growth_model, "species", None)
+        if names is not None and sol.z is not None:
+            sol.species = {name: sol.z[:, i, :] for i, name in enumerate(names)}
+
+    @staticmethod
+    def _finish_stats(sol: OptimizeResult, stats: SolverStats, start: float) -> None:
+        """Records the wall time since start and the peak memory in sol.stats."""
+        stats.wall_time = perf_counter() - start
+        stats.peak_memory = peak_memory()
+        sol.stats = stats
+
+    @staticmethod
+    def _solve_quasi_steady_state(
+        case: Case,
+        growth_model: Callable[[float, np.ndarray, dict, Case], np.ndarray],
+        params: dict,
+        growth_jacobian: Optional[
+            Callable[[float, np.ndarray, dict, Case], np.ndarray]
+        ],
+        fast_species: List[int],
+        time: float,
+        IV: np.ndarray,
+        output: Union[MemoryOutput, SimulationStore],
+        t_eval: Optional[np.ndarray] = None,
+        resume=None,
+        callbacks: List[Callable] = (),
+        stats: Optional[SolverStats] = None,
+    ) -> OptimizeResult:
+        """
+        Solves the model with fast species eliminated (see QuasiSteadyState).
+
+        The full states, including the fast species, are written to output, and
+        sol.qssa_error_estimate holds the estimated error of the fast species
+        (largest over compartments) at each output time.
+        """
+        from .quasi_steady_state import QuasiSteadyState, QuasiSteadyStateOutput
+
+        num_compartments = len(case.compartment_data.ids)
+        num_species = len(IV) // num_compartments
+        quasi_steady_state = QuasiSteadyState(
+            growth_model, growth_jacobian, fast_species, num_species, case.transport
+        )
+        IV_slow = IV.reshape(num_species, num_compartments)[quasi_steady_state.slow]
+
+        sol = CompartmentModel._solve_bdf(
+            case,
+            quasi_steady_state.growth,
+            params,
+            None if growth_jacobian is None else quasi_steady_state.jacobian,
+            time,
+            IV_slow.ravel(),
+            QuasiSteadyStateOutput(output, quasi_steady_state, params, case),
+            t_eval=t_eval,
+            resume=resume,
+            callbacks=callbacks,
+            stats=stats,
+        )
+
+        CompartmentModel._store_solution(sol, output, num_species, case)
+        sol.qssa_error_estimate = None
+        if sol.z is not None:
+            sol.qssa_error_estimate = quasi_steady_state.error_estimate(
+                sol.t, sol.z, params, case
+            )
+        return sol
+
+    @staticmethod
+    def _relative_species_error(z: np.ndarray, z_ref: np.ndarray) -> np.ndarray:
+        """
+        Returns the largest absolute error of each species, relative to the
+        largest magnitude of the species in the reference solution.
+        """
+        error = np.max(np.abs(z - z_ref), axis=(0, 2))
+        scale = np.max(np.abs(z_ref), axis=(0, 2))
+        return error / np.where(scale > 0, scale, 1)
+
+    @staticmethod
+    def _solve_bdf(
+        case: Case,
+        growth_model: Callable[[float, np.ndarray, dict, Case], np.ndarray],
+        params: dict,
+        growth_jacobian: Optional[
+            Callable[[float, np.ndarray, dict, Case], np.ndarray]
+        ],
+        time: float,
+        IV: np.ndarray,
+        output: Union[MemoryOutput, SimulationStore],
+        t_eval: Optional[np.ndarray] = None,
+        resume=None,
+        callbacks: List[Callable] = (),
+        stats: Optional[SolverStats] = None,
+    ) -> OptimizeResult:
+        """
+        Solves the coupled transport and growth system with BDF.
+
+        If resume (a Checkpoint) is given, the integration starts from its time,
+        state and step size (limited to the time left) instead of from IV at
+        time 0. The BDF order and step history aren't saved, so the solver
+        restarts at order 1 and a resumed run isn't step-for-step identical to
+        an uninterrupted one.
+        """
+        compartment_ids = list(case.compartment_data.ids)
+        num_compartments = len(compartment_ids)
+        num_species = len(IV) // num_compartments
+
+        transport_jacobian = sp.kron(
+            sp.identity(num_species), sp.csr_matrix(case.transport), "csr"
+        )
+        if case.snapshots is not None:
+            # Sparsity pattern of all the snapshots
+            transport_jacobian = sum(
+                abs(J) for J in case.snapshots.transport_jacobians(num_species)
+            )
+        # Parameters are bound once, and the model writes its rates into the
+        # arrays returned by _update_model
+        model = as_growth_model(growth_model, growth_jacobian)
+        bound_params = model.bind(params)
+        jac = None
+        jac_sparsity = None
+        if model.has_jacobian:
+            growth_jacobian = model.jacobian
+            if stats is not None:
+                growth_jacobian = timed(growth_jacobian, stats, "growth_time")
+            jac = partial(
+                CompartmentModel._update_jacobian,
+                p=bound_params,
+                case=case,
+                growth_jacobian=growth_jacobian,
+                transport_jacobian=transport_jacobian,
+                block_indices=CompartmentModel._get_block_indices(
+                    num_species, num_compartments
+                ),
+                J_growth=np.empty((num_species, num_species, num_compartments)),
+            )
+        else:
+            jac_sparsity = CompartmentModel._get_jacobian_sparsity(
+                transport_jacobian, num_species, num_compartments
+            )
+
+        t0, y0, first_step = 0, IV, None
+        if resume is not None:
+            if time <= resume.t:
+                raise ValueError(
+                    f"checkpoint at t={resume.t} is not before time={time}"
+                )
+            t0, y0 = resume.t, resume.y
+            first_step = min(resume.h_abs, time - resume.t)
+
+        return CompartmentModel._integrate(
+            partial(
+                CompartmentModel._update_model,
+                p=bound_params,
+                case=case,
+                compartment_ids=compartment_ids,
+                grow_cells=model,
+                stats=stats,
+                transport_buffer=np.empty((num_species, num_compartments)),
             ),
-            method="BDF",
+            time,
+            y0,
+            output,
+            t_eval=t_eval,
+            t0=t0,
+            callbacks=callbacks,
+            stats=stats,
+            first_step=first_step,
+            jac=jac,
+            jac_sparsity=jac_sparsity,
             atol=1e-12,
             rtol=1e-8,
             # max_step=0.01,
         )
 
-        self.t = sol.t
-        self.x = sol.y
-        z = sol.y.T
-        sol.z = z.reshape(z.shape[0], len(initial_concentrations), num_compartments)
-        sol.v = self.case.compartment_data.volumes
-        return sol
+    @staticmethod
+    def _check_t_eval(t_eval: Optional[np.ndarray], time: float) -> None:
+        """Raises a ValueError if t_eval has times outside [0, time]."""
+        if t_eval is None:
+            return
+        t_eval = np.asarray(t_eval, dtype=float)
+        if np.any(t_eval < 0) or np.any(t_eval > time):
+            raise ValueError(f"t_eval must be within [0, {time}]")
+
+    @staticmethod
+    def _hourly_times(time: float) -> np.ndarray:
+        """Returns output times every hour from 0 to time (inclusive)."""
+        return np.append(np.arange(0, time), time)
+
+    @staticmethod
+    def _integrate(
+        fun: Callable[[float, np.ndarray], np.ndarray],
+        time: float,
+        y0: np.ndarray,
+        output: Union[MemoryOutput, SimulationStore],
+        t_eval: Optional[np.ndarray] = None,
+        t0: float = 0,
+        callbacks: List[Callable] = (),
+        stats: Optional[SolverStats] = None,
+        **options,
+    ) -> OptimizeResult:
+        """
+        Integrates fun from t0 to time with the BDF solver, one step at a time.
+
+        Each accepted step is written to output, or, if t_eval is given, the
+        solution at the times in t_eval covered by the step. Each callback is
+        called with the solver after every accepted step, and with final=True
+        at the end. Step and evaluation counts are added to stats.
+        """
+        if stats is None:
+            stats = SolverStats()
+
+        # Each attempt at a step evaluates fun at its own new time, so steps
+        # evaluated at more than one new time had rejected attempts.
+        trial_times = set()
+
+        def counted_fun(t, y):
+            trial_times.add(t)
+            return fun(t, y)
+
+        solver = BDF(counted_fun, t0, y0, time, **options)
+        if t_eval is None and t0 == 0:
+            output.write(np.array([solver.t]), y0[np.newaxis, :])
+        t_eval_i = 0
+
+        status = None
+        while status is None:
+            trial_times.clear()
+            message = solver.step()
+            stats.n_rejected += max(len(trial_times) - 1, 0)
+            if solver.status == "finished":
+                status = 0
+            elif solver.status == "failed":
+                status = -1
+                break
+            stats.n_accepted += 1
+
+            if t_eval is None:
+                output.write(np.array([solver.t]), solver.y[np.newaxis, :])
+            else:
+                t_eval_i_new = np.searchsorted(t_eval, solver.t, side="right")
+                if t_eval_i_new > t_eval_i:
+                    t_step = t_eval[t_eval_i:t_eval_i_new]
+                    output.write(t_step, solver.dense_output()(t_step).T)
+                    t_eval_i = t_eval_i_new
+            for callback in callbacks:
+                callback(solver)
+        output.flush()
+        for callback in callbacks:
+            callback(solver, final=True)
+
+        stats.nfev += solver.nfev
+        stats.njev += solver.njev
+        stats.nlu += solver.nlu
+        if status == 0:
+            message = "The solver successfully reached the end of the integration interval."
+        return OptimizeResult(
+            nfev=solver.nfev,
+            njev=solver.njev,
+            nlu=solver.nlu,
+            status=status,
+            message=message,
+            success=status >= 0,
+        )
+
+    @staticmethod
+    def _integrate_strang(
+        grow: Callable[[float, np.ndarray], np.ndarray],
+        grow_jacobian: Optional[Callable[[float, np.ndarray], np.ndarray]],
+        transport: Union[np.ndarray, sp.csr_matrix],
+        time: float,
+        z0: np.ndarray,
+        output: Union[MemoryOutput, SimulationStore],
+        split_step: float,
+        t_eval: Optional[np.ndarray] = None,
+        callbacks: List[Callable] = (),
+        stats: Optional[SolverStats] = None,
+        atol: float = 1e-12,
+        rtol: float = 1e-8,
+    ) -> OptimizeResult:
+        """
+        Integrates with Strang splitting of transport and reactions.
+
+        Each step of length dt is a half step of transport, a step of dt of the
+        reactions in grow (which are local to each compartment), and another
+        half step of transport. Transport is linear, so its half steps are
+        exact: the matrix exponential of the transport operator is precomputed
+        for dense operators, and its action is computed for sparse ones. The
+        reaction steps are solved for all compartments at once (see
+        _react_sdirk).
+
+        Splitting is second order in dt for smooth problems, but stiff
+        reactions (e.g., oxygen transfer with large kLa) reduce the order, so
+        check the accuracy of split_step against the BDF method.
+
+        The solution is written to output after every step, or only at the
+        times in t_eval if given (steps are aligned with those times). Each
+        callback is called with an object holding the current time t and
+        state y after every step, and with final=True at the end. Reaction
+        steps split in two because Newton's method didn't converge count as
+        rejected steps in stats.
+        """
+        if stats is None:
+            stats = SolverStats()
+        grow = timed(grow, stats, "growth_time")
+        if grow_jacobian is not None:
+            grow_jacobian = timed(grow_jacobian, stats, "growth_time")
+
+        if t_eval is None:
+            t_eval = np.append(np.arange(0, time, split_step), time)
+        t_eval = np.asarray(t_eval, dtype=float)
+        t_bounds = np.concatenate([[0], t_eval[t_eval > 0]])
+
+        # Exact transport over a half step, for each step size
+        propagators = {}
+
+        @partial(timed, stats=stats, attribute="transport_time")
+        def transport_half_step(z, dt):
+            key = round(dt, 12)
+            if key not in propagators:
+                if sp.issparse(transport):
+                    propagators[key] = CompartmentModel._get_expm_action(
+                        transport * (dt / 2)
+                    )
+                else:
+                    propagators[key] = expm(transport * (dt / 2)).T
+            if callable(propagators[key]):
+                return propagators[key](z)
+            return z @ propagators[key]
+
+        if t_eval[0] == 0:
+            output.write(t_eval[:1], z0.reshape(1, -1))
+
+        z = z0
+        for t_start, t_end in zip(t_bounds[:-1], t_bounds[1:]):
+            num_steps = int(np.ceil((t_end - t_start) / split_step - 1e-9))
+            t_steps = np.linspace(t_start, t_end, num_steps + 1)
+            for t, t_next in zip(t_steps[:-1], t_steps[1:]):
+                dt = t_next - t
+                z = transport_half_step(z, dt)
+                z = CompartmentModel._react_sdirk(
+                    grow, grow_jacobian, t, z, dt, atol, rtol, stats
+                )
+                if z is None:
+                    output.flush()
+                    return OptimizeResult(
+                        nfev=stats.nfev,
+                        njev=stats.njev,
+                        nlu=stats.nlu,
+                        status=-1,
+                        message=f"Reaction step failed at t={t}.",
+                        success=False,
+                    )
+                z = transport_half_step(z, dt)
+                stats.n_accepted += 1
+                state = SimpleNamespace(t=t_next, y=z.ravel())
+                for callback in callbacks:
+                    callback(state)
+            output.write(np.array([t_end]), z.reshape(1, -1))
+        output.flush()
+        for callback in callbacks:
+            callback(SimpleNamespace(t=time, y=z.ravel()), final=True)
+
+        return OptimizeResult(
+            nfev=stats.nfev,
+            njev=stats.njev,
+            nlu=stats.nlu,
+            status=0,
+            message="The solver successfully reached the end of the integration interval.",
+            success=True,
+        )
+
+    @staticmethod
+    def _get_expm_action(
+        A: sp.csr_matrix, tol: float = 2**-53
+    ) -> Callable[[np.ndarray], np.ndarray]:
+        """
+        Returns a function computing z @ expm(A).T (i.e., expm(A) applied to each
+        row of z) without forming expm(A).
+
+        Uses a truncated Taylor series of expm(A / s), applied s times, with s
+        chosen so that ||A / s|| <= 1 (Al-Mohy & Higham 2011, with a simpler
+        choice of parameters). The parameters are found once, so the action is
+        cheap to apply repeatedly.
+        """
+        num_steps = max(1, int(np.ceil(spla.norm(A, 1))))
+        A_scaled = sp.csr_matrix(A / num_steps)
+        # Taylor remainder of expm(B) is below 2 / (m + 1)! for ||B|| <= 1
+        degree = 1
+        remainder = 1.0
+        while remainder > tol:
+            degree += 1
+            remainder /= degree
+
+        def expm_action(z):
+            z = z.T
+            for _ in range(num_steps):
+                term = z
+                result = z
+                for k in range(1, degree + 1):
+                    term = (A_scaled @ term) / k
+                    result = result + term
+                    if np.max(np.abs(term)) <= tol * np.max(np.abs(result)):
+                        break
+                z = result
+            return z.T
+
+        return expm_action
+
+    @staticmethod
+    def _react_sdirk(
+        grow: Callable[[float, np.ndarray], np.ndarray],
+        grow_jacobian: Optional[Callable[[float, np.ndarray], np.ndarray]],
+        t: float,
+        z: np.ndarray,
+        dt: float,
+        atol: float,
+        rtol: float,
+        stats: SolverStats,
+        max_depth: int = 10,
+    ) -> Optional[np.ndarray]:
+        """
+        Advances the reactions z' = grow(t, z) by dt, returning None on failure.
+
+        Uses the L-stable, second order SDIRK method of Alexander (1977). Since
+        the reactions are local to each compartment, the Newton iterations only
+        need the (species x species) Jacobian block of each compartment, and
+        all compartments are solved together with batched linear solves. If
+        grow_jacobian isn't given, the blocks are found by finite differences,
+        perturbing one species in all compartments at a time. If the Newton
+        iterations don't converge, the step is split in two.
+        """
+        gamma = 1 - np.sqrt(2) / 2
+        num_species = z.shape[0]
+
+        f = grow(t, z)
+        stats.nfev += 1
+        if grow_jacobian is not None:
+            J = grow_jacobian(t, z)
+        else:
+            J = np.zeros((num_species, num_species, z.shape[1]))
+            for j in range(num_species):
+                h = np.sqrt(np.finfo(float).eps) * np.maximum(np.abs(z[j]), 1)
+                z_h = z.copy()
+                z_h[j] += h
+                J[:, j, :] = (grow(t, z_h) - f) / h
+            stats.nfev += num_species
+        stats.njev += 1
+
+        # (I - gamma dt J)^-1 for each compartment, shape (compartments, s, s)
+        M = np.eye(num_species) - gamma * dt * np.moveaxis(J, 2, 0)
+        M_inv = np.linalg.inv(M)
+        stats.nlu += 1
+
+        def solve_stage(t_stage, z_known):
+            # Solves Y = z_known + gamma dt grow(t_stage, Y) by simplified Newton
+            Y = z_known + gamma * dt * f
+            for _ in range(8):
+                residual = z_known + gamma * dt * grow(t_stage, Y) - Y
+                stats.nfev += 1
+                dY = np.einsum("cij,jc->ic", M_inv, residual)
+                Y = Y + dY
+                scale = atol + rtol * np.abs(Y)
+                if np.all(np.isfinite(Y)) and np.max(np.abs(dY) / scale) < 1:
+                    return Y
+            return None
+
+        Y1 = solve_stage(t + gamma * dt, z)
+        if Y1 is not None:
+            f1 = grow(t + gamma * dt, Y1)
+            stats.nfev += 1
+            Y2 = solve_stage(t + dt, z + (1 - gamma) * dt * f1)
+            if Y2 is not None:
+                return Y2
+
+        if max_depth == 0:
+            return None
+        stats.n_rejected += 1
+        z_half = CompartmentModel._react_sdirk(
+            grow, grow_jacobian, t, z, dt / 2, atol, rtol, stats, max_depth - 1
+        )
+        if z_half is None:
+            return None
+        return CompartmentModel._react_sdirk(
+            grow, grow_jacobian, t + dt / 2, z_half, dt / 2, atol, rtol, stats, max_depth - 1
+        )
 
     @staticmethod
     def _readCompartmentData(case_dir: str) -> CompartmentData:
@@ -100,7 +990,7 @@ class CompartmentModel:
         volumes = compartment_df["volume"].values
         top_gas_flux = compartment_df["top_gas_flux"].values
         high_shear_fraction = compartment_df["high_tau_fraction"].values
-        is_top = compartment_df["is_top"].values
+        is_top = compartment_df["is_top"].values.astype(bool)
 
         return CompartmentData(
             ids=compartment_ids,
@@ -114,54 +1004,234 @@ class CompartmentModel:
         )
 
     def _create_case(self) -> Case:
-        compartment_data = CompartmentModel._readCompartmentData(self.case_dir)
-        self.compartment_ids = list(compartment_data.ids)
-        k_d = np.zeros(len(self.compartment_ids))
-        for model in self.damage_models:
-            k_d += model(compartment_data)
+        snapshots = CompartmentModel._find_snapshots(self.case_dir)
+        if not snapshots:
+            case = self._load_case(self.case_dir, self.cache)
+        else:
+            cases = []
+            for _, name in snapshots:
+                cache = self.cache
+                if isinstance(cache, str):
+                    cache = os.path.join(cache, name)
+                cases.append(self._load_case(os.path.join(self.case_dir, name), cache))
+            case = dataclasses.replace(
+                cases[0],
+                snapshots=CaseSnapshots(
+                    [time for time, _ in snapshots], cases, self.snapshot_interpolation
+                ),
+            )
+        self.compartment_ids = list(case.compartment_data.ids)
+        return case
+
+    @staticmethod
+    def _find_snapshots(case_dir: str) -> List[Tuple[float, str]]:
+        """
+        Returns the (time, subdirectory name) of each snapshot of a time-varying
+        case, sorted by time, or an empty list for a single snapshot case.
+        """
+        snapshots = []
+        for name in os.listdir(case_dir):
+            try:
+                time = float(name)
+            except ValueError:
+                continue
+            if os.path.isfile(os.path.join(case_dir, name, "compartment_values.csv")):
+                snapshots.append((time, name))
+        return sorted(snapshots)
+
+    def _load_case(self, case_dir: str, cache: Union[bool, str]) -> Case:
+        """Loads the case (of a single snapshot) in case_dir."""
+        if cache:
+            cache = CaseCache(case_dir, None if cache is True else cache)
+        else:
+            cache = None
+        cached = cache.load() if cache is not None else None
+        if cached is not None:
+            compartment_data, F = cached
+        else:
+            compartment_data = CompartmentModel._readCompartmentData(case_dir)
+            F = self._create_interface_values(case_dir, list(compartment_data.ids))
+            if cache is not None:
+                cache.save(compartment_data, F)
+
+        # Damage rates are cached for damage models that have a key
+        k_d = None
+        key = None
+        if cache is not None:
+            key = damage_models_key(self.damage_models)
+        if key is not None:
+            k_d = cache.load_k_d(key)
+        if k_d is None:
+            k_d = np.zeros(len(compartment_data.ids))
+            for model in self.damage_models:
+                k_d += model(compartment_data)
+            if key is not None:
+                cache.save_k_d(key, k_d)
 
-        F = self._create_interface_values(self.case_dir, self.compartment_ids)
         return Case(
             F=F,
             compartment_data=compartment_data,
             k_d=k_d,
             volume=np.sum(compartment_data.volumes),
+            transport=CompartmentModel._create_transport_operator(
+                F, compartment_data.volumes
+            ),
         )
 
     def _create_interface_values(
         self, case_dir: str, compartment_ids: List[str]
-    ) -> np.ndarray:
-        """Calculates flow matrix between compartments in m^3/h."""
-        F = np.zeros((len(compartment_ids), len(compartment_ids)))
+    ) -> Union[np.ndarray, sp.csr_matrix]:
+        """
+        Calculates flow matrix between compartments in m^3/h, stored as sparse
+        for large cases.
+        """
+        num_compartments = len(compartment_ids)
         interface_values = pd.read_csv(
             os.path.join(case_dir, "interface_values.csv"), index_col=None
+        ).drop_duplicates(["compartment_src", "compartment_dest"], keep="last")
+        index = pd.Index(compartment_ids)
+        c1 = index.get_indexer(interface_values["compartment_src"])
+        c2 = index.get_indexer(interface_values["compartment_dest"])
+        if np.any(c1 < 0) or np.any(c2 < 0):
+            raise ValueError(
+                f"interface_values.csv in {case_dir} has unknown compartments"
+            )
+        # convert m^3/s -> m^3/h
+        flow = interface_values["corrected_flow"].values * 3600
+        if num_compartments < _SPARSE_TRANSPORT_MIN_COMPARTMENTS:
+            F = np.zeros((num_compartments, num_compartments))
+            F[c1, c2] = flow
+            return F
+        F = sp.csr_matrix(
+            (flow, (c1, c2)), shape=(num_compartments, num_compartments)
         )
-        for _, row in interface_values.iterrows():
-            c1 = compartment_ids.index(row["compartment_src"])
-            c2 = compartment_ids.index(row["compartment_dest"])
-            F[c1, c2] = row["corrected_flow"] * 3600  # convert m^3/s -> m^3/h
-
+        F.eliminate_zeros()
         return F
 
     @staticmethod
     def _get_flux_array(
-        concentrations: np.ndarray, F: np.ndarray, volumes: np.ndarray
+        concentrations: np.ndarray,
+        F: Union[np.ndarray, sp.spmatrix],
+        volumes: np.ndarray,
     ) -> np.ndarray:
         """Converts concentrations to a numerical flux matrix between all pairs of compartments."""
-        # matrix [c_i * F_ij]
-        X = F * concentrations[:, np.newaxis]
-        # num entering compartment i is sum of column i of X
-        # num leaving compartment i is sum of row i of X
-        return (np.sum(X, axis=0) - np.sum(X, axis=1)) / volumes
+        # num entering compartment i is sum_j c_j * F_ji
+        # num leaving compartment i is c_i * sum_j F_ij
+        out_flow = np.asarray(F.sum(axis=1)).ravel()
+        return (F.T @ concentrations - out_flow * concentrations) / volumes
 
     @staticmethod
-    def _update_model(
+    def _get_transport_matrix(
+        F: Union[np.ndarray, sp.spmatrix], volumes: np.ndarray
+    ) -> sp.csr_matrix:
+        """
+        Returns the matrix T such that T @ c is the flux array of concentrations c
+        (see _get_flux_array).
+        """
+        F = sp.csr_matrix(F)
+        out_flow = np.asarray(F.sum(axis=1)).ravel()
+        T = F.T - sp.diags(out_flow)
+        return sp.csr_matrix(sp.diags(1 / volumes) @ T)
+
+    @staticmethod
+    def _create_transport_operator(
+        F: Union[np.ndarray, sp.spmatrix], volumes: np.ndarray
+    ) -> Union[np.ndarray, sp.csr_matrix]:
+        """Returns the transport matrix, stored as sparse for large cases."""
+        transport = CompartmentModel._get_transport_matrix(F, volumes)
+        if len(volumes) < _SPARSE_TRANSPORT_MIN_COMPARTMENTS:
+            return transport.toarray()
+        return transport
+
+    @staticmethod
+    def _get_block_indices(
+        num_species: int, num_compartments: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the row and column indices in the full Jacobian of the entries of
+        a local growth Jacobian with shape (species, species, compartments).
+        """
+        i, j, c = np.meshgrid(
+            np.arange(num_species),
+            np.arange(num_species),
+            np.arange(num_compartments),
+            indexing="ij",
+        )
+        rows = (i * num_compartments + c).ravel()
+        cols = (j * num_compartments + c).ravel()
+        return rows, cols
+
+    @staticmethod
+    def _get_jacobian_sparsity(
+        transport_jacobian: sp.csr_matrix, num_species: int, num_compartments: int
+    ) -> sp.csr_matrix:
+        """
+        Returns the sparsity pattern of the full Jacobian: transport couples each
+        species between compartments, and growth couples all species within a
+        compartment.
+        """
+        rows, cols = CompartmentModel._get_block_indices(num_species, num_compartments)
+        size = num_species * num_compartments
+        growth_pattern = sp.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(size, size)
+        )
+        pattern = abs(transport_jacobian) + growth_pattern
+        return (pattern != 0).astype(np.int8)
+
+    @staticmethod
+    def _update_jacobian(
         t: float,
         z: np.ndarray,
         p: dict,
         case: Case,
+        growth_jacobian: Callable[[float, np.ndarray, Any, Case, np.ndarray], None],
+        transport_jacobian: sp.csr_matrix,
+        block_indices: Tuple[np.ndarray, np.ndarray],
+        J_growth: Optional[np.ndarray] = None,
+    ) -> sp.csr_matrix:
+        """
+        Returns the Jacobian of _update_model as a sparse matrix.
+
+        Args:
+            t: Time (hours)
+            z: Flattened array of concentrations of cells and metabolites.
+            p: Parameters of the growth model, as bound by its bind method.
+            case: Case data
+            growth_jacobian: Jacobian method of a GrowthModel, writing the local
+                growth Jacobian (species, species, compartments) into its last
+                argument.
+            transport_jacobian: Block diagonal transport matrix, one block per
+                species (for time-varying cases, the one at t is used instead).
+            block_indices: Row and column indices of the local growth Jacobian
+                entries (see _get_block_indices).
+            J_growth: Optional array to write the local growth Jacobian into.
+        """
+        num_compartments = len(case.compartment_data.volumes)
+        z = z.reshape(-1, num_compartments)
+        if case.snapshots is not None:
+            transport_jacobian = case.snapshots.transport_jacobian(t, z.shape[0])
+            case = case.snapshots.at(t)
+        if J_growth is None:
+            J_growth = np.empty((z.shape[0], z.shape[0], num_compartments))
+        growth_jacobian(t, z, p, case, J_growth)
+        rows, cols = block_indices
+        J = sp.csr_matrix(
+            (J_growth.ravel(), (rows, cols)), shape=transport_jacobian.shape
+        )
+        return J + transport_jacobian
+
+    @staticmethod
+    def _update_model(
+        t: float,
+        z: np.ndarray,
+        p,
+        case: Case,
         compartment_ids: List[str],
-        grow_cells: Callable[[float, np.ndarray, dict, Case], np.ndarray],
+        grow_cells: Union[
+            GrowthModel, Callable[[float, np.ndarray, dict, Case], np.ndarray]
+        ],
+        stats: Optional[SolverStats] = None,
+        transport_buffer: Optional[np.ndarray] = None,
     ) -> np.ndarray:
         """
         Solves given growth model in compartments, handling flux between compartments.
@@ -170,24 +1240,34 @@ class CompartmentModel:
             t: Time to solve growth model (hours)
             z: Array of concentrations of cells and metabolites in each compartment
                 (rows correspond to cells / metabolites, columns to compartments.
-            p: Dictionary of parameter values for growCells.
+            p: Parameters of the growth model, as bound by its bind method (a
+                dictionary for growth model functions).
             case: Case data
             compartment_ids: list of compartment id strings
-            growCells: Function describing the cell growth.
-        """
-        num_concentrations = int(len(z) / len(compartment_ids))
-        z = z.reshape(num_concentrations, len(compartment_ids))
-        growth_deltas = grow_cells(t, z, p, case)
-        F = case.F
-        volumes = case.compartment_data.volumes
-
-        result = np.zeros(z.shape)
-        for i in range(z.shape[0]):
-            result[i, :] = growth_deltas[i, :] + CompartmentModel._get_flux_array(
-                z[i, :], F, volumes
-            )
-        result = result.reshape(
-            result.shape[0] * result.shape[1],
-        )
+            grow_cells: GrowthModel (or function) describing the cell growth.
+            stats: Optional SolverStats to add the time spent in the growth
+                model and transport to.
+            transport_buffer: Optional array with the shape of z to compute
+                the transport of dense operators into.
+        """
+        if not isinstance(grow_cells, GrowthModel):
+            grow_cells = LegacyGrowthModel(grow_cells)
+        z = z.reshape(-1, len(compartment_ids))
+        if case.snapshots is not None:
+            case = case.snapshots.at(t)
+        # The solver keeps the result, so it can't be a buffer reused between
+        # calls; the growth model writes into it directly
+        result = np.empty(z.shape)
+        start = perf_counter()
+        grow_cells.rates(t, z, p, case, result)
+        growth_end = perf_counter()
 
-        return result
+        # transport of all species at once, (T @ z.T).T
+        if isinstance(case.transport, np.ndarray) and transport_buffer is not None:
+            result += np.matmul(z, case.transport.T, out=transport_buffer)
+        else:
+            result += (case.transport @ z.T).T
+        if stats is not None:
+            stats.growth_time += growth_end - start
+            stats.transport_time += perf_counter() - growth_end
+        return result.ravel()
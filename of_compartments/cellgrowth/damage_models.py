@@ -1,8 +1,11 @@
+import inspect
+from collections import OrderedDict
 from collections.abc import Callable
 
 import numpy as np
-import scipy.integrate as si
+import scipy.special as ss
 
+from .case_cache import compartment_data_fingerprint
 from .compartment_model import CompartmentData
 
 
@@ -20,28 +23,33 @@ def bubbleDamageModel_shell(
     """
 
     def bubbleDamageModel(compartment_data: CompartmentData) -> np.ndarray:
-        bubble_lifespan = (
-            compartment_data.gas_holdup
-            * compartment_data.volumes
-            / compartment_data.top_gas_flux
+        return damage_rate_sweep(
+            bubbleDamageModel_shell,
+            compartment_data,
+            bubble_radius=bubble_radius,
+            cell_radius=cell_radius,
         )
-        # Get the fraction of total volume that is in shells of thickness
-        # equal to the cell radius around bubbles
-        gas_volume = compartment_data.gas_holdup * compartment_data.volumes
-        bubble_volume = (4 * np.pi / 3) * bubble_radius**3
-        num_bubbles = gas_volume / bubble_volume
-        interaction_volume = (4 * np.pi / 3) * (
-            (bubble_radius + cell_radius) ** 3 - bubble_radius**3
-        )
-        bubble_danger_volume_fraction = (
-            num_bubbles * interaction_volume
-        ) / compartment_data.volumes
-        # k_d_bubble
-        return np.log(1 - bubble_danger_volume_fraction) / bubble_lifespan
 
     return bubbleDamageModel
 
 
+def _bubble_damage_shell(compartment_data, bubble_radius, cell_radius):
+    gas_holdup = np.asarray(compartment_data.gas_holdup)
+    volumes = np.asarray(compartment_data.volumes)
+    bubble_lifespan = gas_holdup * volumes / np.asarray(compartment_data.top_gas_flux)
+    # Get the fraction of total volume that is in shells of thickness
+    # equal to the cell radius around bubbles
+    gas_volume = gas_holdup * volumes
+    bubble_volume = (4 * np.pi / 3) * bubble_radius**3
+    num_bubbles = gas_volume / bubble_volume
+    interaction_volume = (4 * np.pi / 3) * (
+        (bubble_radius + cell_radius) ** 3 - bubble_radius**3
+    )
+    bubble_danger_volume_fraction = (num_bubbles * interaction_volume) / volumes
+    # k_d_bubble
+    return np.log(1 - bubble_danger_volume_fraction) / bubble_lifespan
+
+
 def bubbleDamageModel_cherry1992(
     bubble_radius: float,
     Psi: float = 0.2,
@@ -60,25 +68,37 @@ def bubbleDamageModel_cherry1992(
     """
 
     def bubbleDamageModel(compartment_data: CompartmentData) -> np.ndarray:
-        top_compartments = np.array(compartment_data.ids)[compartment_data.is_top]
-        top_indices = np.isin(compartment_data.ids, top_compartments)
-        k = (
-            Psi
-            * film_cell_density_ratio
-            * 3
-            * film_thickness
-            * compartment_data.top_gas_flux
-            / (bubble_radius * compartment_data.volumes)
+        return damage_rate_sweep(
+            bubbleDamageModel_cherry1992,
+            compartment_data,
+            bubble_radius=bubble_radius,
+            Psi=Psi,
+            film_cell_density_ratio=film_cell_density_ratio,
+            film_thickness=film_thickness,
         )
-        k *= 3600  # convert to h^-1
-
-        k_d = np.zeros(len(compartment_data.ids))
-        k_d[top_indices] = k[top_indices]
-        return k_d
 
     return bubbleDamageModel
 
 
+def _bubble_damage_cherry1992(
+    compartment_data, bubble_radius, Psi, film_cell_density_ratio, film_thickness
+):
+    k = (
+        Psi
+        * film_cell_density_ratio
+        * 3
+        * film_thickness
+        * np.asarray(compartment_data.top_gas_flux)
+        / (bubble_radius * np.asarray(compartment_data.volumes))
+    )
+    k *= 3600  # convert to h^-1
+    return np.where(np.asarray(compartment_data.is_top, dtype=bool), k, 0.0)
+
+
+# Fit (m, b) of the deadly volume per bubble volume, exp(b) * R^m, by threshold
+_WALLS2017_THRESHOLDS = {"low": (-1.550, 7.982), "mid": (-1.848, 8.261)}
+
+
 def bubbleDamageModel_walls2017(
     bubble_radius: float, threshold: str, death_fraction: float = 1
 ) -> Callable[[CompartmentData], np.ndarray]:
@@ -93,42 +113,61 @@ def bubbleDamageModel_walls2017(
     Potential for Bursting Bubbles to Damage Suspended Cells, Scientific Reports.
 
     """
-    # convert to um
-    R = bubble_radius * 1e6
-
-    if threshold == "low":
-        m = -1.550
-        b = 7.982
-    elif threshold == "mid":
-        m = -1.848
-        b = 8.261
-    else:
+    if threshold not in _WALLS2017_THRESHOLDS:
         raise Exception(f"invalid threshold value {threshold}")
 
     def bubbleDamageModel(compartment_data: CompartmentData) -> np.ndarray:
-        top_compartments = np.array(compartment_data.ids)[compartment_data.is_top]
-        top_indices = np.isin(compartment_data.ids, top_compartments)
-        coef = np.exp(b) * R**m
-        V_b = 4 / 3 * np.pi * (R * 1e-6) ** 3  # m^3
-        V_deadly = V_b * coef
-        num_bubbles = compartment_data.top_gas_flux / V_b
-        V_deadly_total = V_deadly * num_bubbles
-        q = 3600 * V_deadly_total / compartment_data.volumes
-
-        k_d = np.zeros(len(compartment_data.ids))
-        k_d[top_indices] = q[top_indices]
-        return k_d * death_fraction
+        return damage_rate_sweep(
+            bubbleDamageModel_walls2017,
+            compartment_data,
+            bubble_radius=bubble_radius,
+            threshold=threshold,
+            death_fraction=death_fraction,
+        )
 
     return bubbleDamageModel
 
 
+def _bubble_damage_walls2017(
+    compartment_data, bubble_radius, threshold, death_fraction
+):
+    threshold = np.asarray(threshold)
+    for value in np.unique(threshold):
+        if value not in _WALLS2017_THRESHOLDS:
+            raise Exception(f"invalid threshold value {value}")
+    m, b = (
+        np.vectorize(lambda value: _WALLS2017_THRESHOLDS[value][i], otypes=[float])(
+            threshold
+        )
+        for i in range(2)
+    )
+    # convert to um
+    R = bubble_radius * 1e6
+
+    coef = np.exp(b) * R**m
+    V_b = 4 / 3 * np.pi * (R * 1e-6) ** 3  # m^3
+    V_deadly = V_b * coef
+    num_bubbles = np.asarray(compartment_data.top_gas_flux) / V_b
+    V_deadly_total = V_deadly * num_bubbles
+    q = 3600 * V_deadly_total / np.asarray(compartment_data.volumes)
+
+    k_d = np.where(np.asarray(compartment_data.is_top, dtype=bool), q, 0.0)
+    return k_d * death_fraction
+
+
 def shearDamageModel_constant(rate: float) -> Callable[[CompartmentData], np.ndarray]:
     def shearDamageModel(compartment_data: CompartmentData) -> np.ndarray:
-        return rate * compartment_data.high_shear_fraction
+        return damage_rate_sweep(
+            shearDamageModel_constant, compartment_data, rate=rate
+        )
 
     return shearDamageModel
 
 
+def _shear_damage_constant(compartment_data, rate):
+    return rate * np.asarray(compartment_data.high_shear_fraction)
+
+
 def eddyDamageModel_lakhotia_papoutsakis(
     B, k_c, E_0, nu
 ) -> Callable[[CompartmentData], np.ndarray]:
@@ -144,19 +183,155 @@ def eddyDamageModel_lakhotia_papoutsakis(
     """
 
     def eddyDamageModel(compartment_data: CompartmentData) -> np.ndarray:
-        # convert from m^2/s^3 to cm^2/s^3
-        eps = compartment_data.epsilon * 1e4
-
-        I, _ = si.quad_vec(
-            lambda k: 1.7
-            * eps ** (2 / 3)
-            * k ** (-5 / 3)
-            * np.exp(-2.55 * nu * eps ** (-1 / 3) * k ** (4 / 3)),
-            k_c,
-            np.inf,
+        return damage_rate_sweep(
+            eddyDamageModel_lakhotia_papoutsakis,
+            compartment_data,
+            B=B,
+            k_c=k_c,
+            E_0=E_0,
+            nu=nu,
         )
-        k_d = np.zeros(len(eps))
-        k_d[I > E_0] = B * I[I > E_0]
-        return k_d
 
     return eddyDamageModel
+
+
+def _eddy_damage_lakhotia_papoutsakis(compartment_data, B, k_c, E_0, nu):
+    # convert from m^2/s^3 to cm^2/s^3
+    eps = np.asarray(compartment_data.epsilon, dtype=float) * 1e4
+
+    I = eddy_energy_lakhotia_papoutsakis(eps, k_c, nu)
+    return np.where(I > E_0, B * I, 0.0)
+
+
+def eddy_energy_lakhotia_papoutsakis(eps: np.ndarray, k_c: float, nu: float):
+    """
+    Kinetic energy (cm^2/s^2) of the eddies with wavenumbers above k_c (cm^-1),
+    the integral from k_c to infinity of
+
+        1.7 eps^(2/3) k^(-5/3) exp(-a k^(4/3)),  a = 2.55 nu eps^(-1/3)
+
+    With x = a k^(4/3) it reduces to the incomplete gamma function
+    Gamma(-1/2, x) = 2 exp(-x) / sqrt(x) - 2 sqrt(pi) erfc(sqrt(x)), giving
+
+        2.55 eps^(2/3) exp(-x_c) (k_c^(-2/3) - sqrt(pi a) erfcx(sqrt(x_c)))
+
+    in closed form. Compartments without dissipation (eps <= 0) have none.
+
+    Args:
+        eps: Energy dissipation rate (cm^2/s^3) of each compartment.
+        k_c: Smallest wavenumber (cm^-1) of the damaging eddies.
+        nu: Kinematic viscosity (cm^2/s).
+    """
+    eps = np.asarray(eps, dtype=float)
+    positive = eps > 0
+    eps_positive = np.where(positive, eps, 1.0)
+    a = 2.55 * nu * eps_positive ** (-1 / 3)
+    x_c = a * k_c ** (4 / 3)
+    I = (
+        2.55
+        * eps_positive ** (2 / 3)
+        * np.exp(-x_c)
+        * (k_c ** (-2 / 3) - np.sqrt(np.pi * a) * ss.erfcx(np.sqrt(x_c)))
+    )
+    return np.where(positive, I, 0.0)
+
+
+# Vectorized damage rates of each factory, taking the compartment data and the
+# factory's parameters, which may be arrays of shape (..., 1) that broadcast
+# over the compartments
+_VECTORIZED = {
+    bubbleDamageModel_shell: _bubble_damage_shell,
+    bubbleDamageModel_cherry1992: _bubble_damage_cherry1992,
+    bubbleDamageModel_walls2017: _bubble_damage_walls2017,
+    shearDamageModel_constant: _shear_damage_constant,
+    eddyDamageModel_lakhotia_papoutsakis: _eddy_damage_lakhotia_papoutsakis,
+}
+
+
+class _Memo:
+    """Damage rates by key, dropping the least recently used beyond max_bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.rates: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.num_bytes = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.rates
+
+    def get(self, key: str) -> np.ndarray:
+        self.rates.move_to_end(key)
+        return self.rates[key]
+
+    def add(self, key: str, k_d: np.ndarray) -> None:
+        k_d = k_d.copy()
+        k_d.flags.writeable = False
+        self.rates[key] = k_d
+        self.num_bytes += k_d.nbytes
+        while self.num_bytes > self.max_bytes and len(self.rates) > 1:
+            _, dropped = self.rates.popitem(last=False)
+            self.num_bytes -= dropped.nbytes
+
+
+# Damage rates computed in this process, by fingerprint of the compartment
+# data, factory and parameters
+_memo = _Memo(max_bytes=256 * 2**20)
+
+
+def damage_rate_sweep(
+    factory: Callable, compartment_data: CompartmentData, **params
+) -> np.ndarray:
+    """
+    Returns the damage rates of a damage model for many parameter sets at once,
+    e.g., damage_rate_sweep(bubbleDamageModel_cherry1992, compartment_data,
+    bubble_radius=np.linspace(1e-3, 5e-3, 100), Psi=0.3) has shape (100,
+    compartments).
+
+    The parameters are broadcast together, and the result has their shape
+    followed by the compartments. Parameters not given take the factory's
+    defaults. Rates are memoized by a fingerprint of the compartment data and
+    parameters, so sweeps that overlap, and models created from the factories
+    (which are evaluated through this function), only compute new parameter
+    sets.
+
+    Args:
+        factory: One of the damage model factories in this module.
+        compartment_data: Compartment data to evaluate the model on.
+        params: Parameters of the factory, as scalars or arrays.
+    """
+    if factory not in _VECTORIZED:
+        raise ValueError(f"{getattr(factory, '__name__', factory)} can't be swept")
+    signature = inspect.signature(factory)
+    try:
+        bound = signature.bind(**params)
+    except TypeError as e:
+        raise ValueError(f"invalid parameters for {factory.__name__}: {e}")
+    bound.apply_defaults()
+    names = list(bound.arguments)
+    values = np.broadcast_arrays(*[np.asarray(v) for v in bound.arguments.values()])
+    shape = values[0].shape
+    values = [value.ravel() for value in values]
+    num_compartments = len(compartment_data.ids)
+
+    prefix = f"{factory.__name__} {compartment_data_fingerprint(compartment_data)}"
+    keys = [
+        f"{prefix} {[value[i].item() for value in values]!r}"
+        for i in range(len(values[0]))
+    ]
+    missing = [i for i, key in enumerate(keys) if key not in _memo]
+    if missing:
+        k_d = _VECTORIZED[factory](
+            compartment_data,
+            **{
+                name: value[missing][:, np.newaxis]
+                for name, value in zip(names, values)
+            },
+        )
+        k_d = np.broadcast_to(k_d, (len(missing), num_compartments)).astype(float)
+        for i, row in zip(missing, k_d):
+            _memo.add(keys[i], row)
+
+    k_d = np.empty((len(keys), num_compartments))
+    for i, key in enumerate(keys):
+        k_d[i] = _memo.get(key)
+    return k_d.reshape(shape + (num_compartments,))
@@ -0,0 +1,283 @@
+"""Runs a compartment model for many parameter sets against the same case"""
+import dataclasses
+import sys
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from .compartment_model import Case, CompartmentModel
+
+# Shared arrays of a sparse (CSR) flow matrix; a dense one is shared as "F",
+# along with the volumes and damage rates
+_SPARSE_F_FIELDS = ["F_data", "F_indices", "F_indptr"]
+
+# Case and shared memory blocks of the current worker process
+_worker_case = None
+_worker_shared_memory = []
+
+
+@dataclass
+class EnsembleResult:
+    # Common output times (hours)
+    t: np.ndarray
+    # Concentrations with shape (members, times, species, compartments)
+    z: np.ndarray
+    # Compartment volumes
+    v: np.ndarray
+    # Whether the solver succeeded for each member
+    success: np.ndarray
+    # Solver message for each member
+    message: List[str]
+
+
+class EnsembleRunner:
+    """
+    Runs ensemble members in a pool of worker processes.
+
+    The flow matrix, volumes and damage rates of the case are placed in shared
+    memory once, and each worker builds its case from them when it starts, so
+    the pool can be reused for several batches of members (e.g., while fitting
+    parameters). Use as a context manager:
+
+        with EnsembleRunner(cm.case, time, growth_model) as runner:
+            result = runner.run(params_list, initial_conditions_list)
+
+    The growth model (and growth Jacobian) must be picklable, i.e., defined at
+    module level. With max_workers=1, members are run in this process.
+    """
+
+    def __init__(
+        self,
+        case: Case,
+        time: float,
+        growth_model: Callable[[float, np.ndarray, dict, Case], np.ndarray],
+        growth_jacobian: Optional[
+            Callable[[float, np.ndarray, dict, Case], np.ndarray]
+        ] = None,
+        t_eval: Optional[np.ndarray] = None,
+        max_workers: Optional[int] = None,
+    ):
+        self.case = case
+        self.time = time
+        self.growth_model = growth_model
+        self.growth_jacobian = growth_jacobian
+        CompartmentModel._check_t_eval(t_eval, time)
+        if t_eval is None:
+            t_eval = CompartmentModel._hourly_times(time)
+        self.t_eval = np.asarray(t_eval, dtype=float)
+        self.max_workers = max_workers
+
+        self._shared_memory = []
+        self._executor = None
+
+    def __enter__(self):
+        if self.max_workers != 1 and self.case.snapshots is not None:
+            # Time-varying cases are sent to each worker whole
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_worker_case,
+                initargs=(self.case,),
+            )
+        elif self.max_workers != 1:
+            shared_arrays = self._share_case_arrays()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_worker,
+                initargs=(
+                    shared_arrays,
+                    dataclasses.replace(self.case.compartment_data, volumes=None),
+                    self.case.volume,
+                ),
+            )
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for shm in self._shared_memory:
+            shm.close()
+            shm.unlink()
+        self._shared_memory = []
+
+    def run(
+        self,
+        params_list: List[dict],
+        initial_conditions_list: List[List[float]],
+    ) -> EnsembleResult:
+        """
+        Runs one simulation per member and stacks the results.
+
+        A list with a single entry is used for every member.
+        """
+        params_list, initial_conditions_list = _broadcast_members(
+            params_list, initial_conditions_list
+        )
+        tasks = [
+            (
+                self.time,
+                self.growth_model,
+                params,
+                initial_conditions,
+                self.growth_jacobian,
+                self.t_eval,
+            )
+            for params, initial_conditions in zip(params_list, initial_conditions_list)
+        ]
+        if self._executor is None:
+            results = [_run_member(task, self.case) for task in tasks]
+        else:
+            results = list(self._executor.map(_run_member, tasks))
+
+        return EnsembleResult(
+            t=self.t_eval,
+            z=np.stack([z for _, _, z in results]),
+            v=self.case.compartment_data.volumes,
+            success=np.array([success for success, _, _ in results]),
+            message=[message for _, message, _ in results],
+        )
+
+    def _share_case_arrays(self) -> Dict[str, Tuple[str, tuple, str]]:
+        """Copies case arrays to shared memory, returning how to attach to them."""
+        arrays = {
+            "volumes": self.case.compartment_data.volumes,
+            "k_d": self.case.k_d,
+        }
+        if sp.issparse(self.case.F):
+            F = sp.csr_matrix(self.case.F)
+            arrays.update(F_data=F.data, F_indices=F.indices, F_indptr=F.indptr)
+        else:
+            arrays["F"] = np.asarray(self.case.F, dtype=float)
+        shared_arrays = {}
+        for field, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            self._shared_memory.append(shm)
+            shared_arrays[field] = (shm.name, array.shape, array.dtype.str)
+        return shared_arrays
+
+
+def run_ensemble(
+    case: Case,
+    time: float,
+    growth_model: Callable[[float, np.ndarray, dict, Case], np.ndarray],
+    params_list: List[dict],
+    initial_conditions_list: List[List[float]],
+    growth_jacobian: Optional[
+        Callable[[float, np.ndarray, dict, Case], np.ndarray]
+    ] = None,
+    t_eval: Optional[np.ndarray] = None,
+    max_workers: Optional[int] = None,
+) -> EnsembleResult:
+    """
+    Runs the growth model in the given case for each parameter set and initial
+    condition, in parallel.
+
+    Args:
+        case: Case data
+        time: The time to run each simulation for (hours)
+        growth_model: Function describing the cell growth.
+        params_list: parameter dicts, one per member (or a single one for all).
+        initial_conditions_list: initial concentrations, one per member (or a
+            single one for all).
+        growth_jacobian: Optional local Jacobian of the growth model.
+        t_eval: Times at which to store the results (default hourly).
+        max_workers: Number of worker processes (default number of CPUs).
+    """
+    with EnsembleRunner(
+        case,
+        time,
+        growth_model,
+        growth_jacobian=growth_jacobian,
+        t_eval=t_eval,
+        max_workers=max_workers,
+    ) as runner:
+        return runner.run(params_list, initial_conditions_list)
+
+
+def _broadcast_members(params_list, initial_conditions_list):
+    params_list = list(params_list)
+    initial_conditions_list = list(initial_conditions_list)
+    num_members = max(len(params_list), len(initial_conditions_list))
+    if len(params_list) == 1:
+        params_list *= num_members
+    if len(initial_conditions_list) == 1:
+        initial_conditions_list *= num_members
+    if len(params_list) != len(initial_conditions_list):
+        raise ValueError(
+            f"got {len(params_list)} parameter sets but "
+            f"{len(initial_conditions_list)} initial conditions"
+        )
+    return params_list, initial_conditions_list
+
+
+def _attach_shared_array(name, shape, dtype):
+    # The parent process owns the block and unlinks it. Workers share its
+    # resource tracker (whatever the start method), so attaching registers the
+    # block again, which the tracker ignores; it must not be unregistered here,
+    # or the parent's registration would be removed with it.
+    if sys.version_info >= (3, 13):
+        shm = SharedMemory(name=name, track=False)
+    else:
+        shm = SharedMemory(name=name)
+    _worker_shared_memory.append(shm)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _init_worker(shared_arrays, compartment_data, volume):
+    """Builds the case of a worker process from the shared arrays."""
+    global _worker_case
+    arrays = {
+        field: _attach_shared_array(*spec) for field, spec in shared_arrays.items()
+    }
+    if "F" in arrays:
+        F = arrays["F"]
+    else:
+        num_compartments = len(arrays["volumes"])
+        F = sp.csr_matrix(
+            tuple(arrays[field] for field in _SPARSE_F_FIELDS),
+            shape=(num_compartments, num_compartments),
+        )
+    compartment_data = dataclasses.replace(compartment_data, volumes=arrays["volumes"])
+    _worker_case = Case(
+        volume=volume,
+        F=F,
+        k_d=arrays["k_d"],
+        compartment_data=compartment_data,
+        transport=CompartmentModel._create_transport_operator(F, arrays["volumes"]),
+    )
+
+
+def _init_worker_case(case):
+    """Sets the case of a worker process."""
+    global _worker_case
+    _worker_case = case
+
+
+def _run_member(task, case=None):
+    """Runs a single member, returning (success, message, z at t_eval)."""
+    if case is None:
+        case = _worker_case
+    time, growth_model, params, initial_conditions, growth_jacobian, t_eval = task
+    sol = CompartmentModel._solve(
+        case,
+        time,
+        growth_model,
+        params,
+        initial_conditions,
+        growth_jacobian=growth_jacobian,
+        t_eval=t_eval,
+    )
+    # Pad failed runs so every member has the same time grid
+    z = np.full((len(t_eval),) + sol.z.shape[1:], np.nan)
+    z[: sol.z.shape[0]] = sol.z
+    return sol.success, sol.message, z
@@ -1,6 +1,8 @@
 import numpy as np
 
 from .compartment_model import Case
+from .growth_protocol import GrowthModel
+from .kinetic_model import KineticModel
 
 
 def growthModel_xing_simplified(t: float, z: np.ndarray, p: dict, case: Case):
@@ -49,6 +51,282 @@ def growthModel_xing_simplified(t: float, z: np.ndarray, p: dict, case: Case):
     return growth_deltas
 
 
+def growthJacobian_xing_simplified(t: float, z: np.ndarray, p: dict, case: Case):
+    """
+    Local Jacobian of growthModel_xing_simplified in each compartment.
+
+    Returns an array J of shape (species, species, compartments), where
+    J[i, j, c] is the derivative of the rate of species i with respect to
+    the concentration of species j in compartment c.
+    """
+    S = z[0, :]
+    G = z[1, :]
+    L = z[2, :]
+    A = z[3, :]
+    X = z[5, :]
+
+    f_S = S / (S + p["K_S"])
+    f_G = G / (G + p["K_G"])
+    f_L = p["KI_L"] / (L + p["KI_L"])
+    f_A = p["KI_A"] / (A + p["KI_A"])
+    mu = p["mu_m"] * f_S * f_G * f_L * f_A
+    # derivatives of mu with respect to S, G, L, A
+    dmu = np.zeros((4, len(S)))
+    dmu[0, :] = p["mu_m"] * p["K_S"] / (S + p["K_S"]) ** 2 * f_G * f_L * f_A
+    dmu[1, :] = p["mu_m"] * f_S * p["K_G"] / (G + p["K_G"]) ** 2 * f_L * f_A
+    dmu[2, :] = -p["mu_m"] * f_S * f_G * p["KI_L"] / (L + p["KI_L"]) ** 2 * f_A
+    dmu[3, :] = -p["mu_m"] * f_S * f_G * f_L * p["KI_A"] / (A + p["KI_A"]) ** 2
+
+    g_L = L / (L + p["KD_L"])
+    g_A = A / (A + p["KD_A"])
+    mu_d = p["mu_dm"] * g_L * g_A
+    # derivatives of mu_d with respect to L, A
+    dmu_d_dL = p["mu_dm"] * p["KD_L"] / (L + p["KD_L"]) ** 2 * g_A
+    dmu_d_dA = p["mu_dm"] * g_L * p["KD_A"] / (A + p["KD_A"]) ** 2
+
+    m_G = p["a_1"] * G / (p["a_2"] + G)
+    dm_G_dG = p["a_1"] * p["a_2"] / (p["a_2"] + G) ** 2
+
+    J = np.zeros((z.shape[0], z.shape[0], z.shape[1]))
+    J[0, :4, :] = -X * dmu / p["Y_XS"]
+    J[0, 5, :] = -(p["m_S"] + mu / p["Y_XS"])
+
+    J[1, :4, :] = -X * dmu / p["Y_XG"]
+    J[1, 1, :] += -X * dm_G_dG - p["d_G"]
+    J[1, 5, :] = -(m_G + mu / p["Y_XG"])
+
+    J[2, :4, :] = X * dmu / p["Y_XS"] * p["Y_LS"]
+    J[2, 5, :] = (p["m_S"] + mu / p["Y_XS"]) * p["Y_LS"]
+
+    J[3, :4, :] = X * dmu / p["Y_XG"] * p["Y_AG"]
+    J[3, 1, :] += p["d_G"]
+    J[3, 5, :] = mu / p["Y_XG"] * p["Y_AG"] - p["r_A"]
+
+    J[4, 4, :] = -case.compartment_data.kLa
+    J[4, 5, :] = -p["OUR"]
+
+    J[5, :4, :] = X * dmu
+    J[5, 2, :] -= X * dmu_d_dL
+    J[5, 3, :] -= X * dmu_d_dA
+    J[5, 5, :] = mu - mu_d - case.k_d
+
+    J[0, :, S <= 0] = 0
+    J[2, :, S <= 0] = 0
+    J[1, :, G <= 0] = 0
+    return J
+
+
+class XingSimplified(GrowthModel):
+    """
+    growthModel_xing_simplified (with growthJacobian_xing_simplified) as an
+    in-place GrowthModel, computing the rates without allocating arrays.
+    """
+
+    param_names = [
+        "m_S",
+        "a_1",
+        "a_2",
+        "mu_m",
+        "mu_dm",
+        "K_S",
+        "K_G",
+        "KI_L",
+        "KI_A",
+        "KD_L",
+        "KD_A",
+        "d_G",
+        "r_A",
+        "Y_XS",
+        "Y_XG",
+        "Y_LS",
+        "Y_AG",
+        "DO_eq",
+        "OUR",
+    ]
+
+    species = ["S", "G", "L", "A", "DO", "X"]
+
+    def __init__(self):
+        # Work arrays of rates and jacobian by number of compartments
+        self._work = {}
+        self._jacobian_work = {}
+
+    def rates(self, t: float, z: np.ndarray, p, case: Case, out: np.ndarray) -> None:
+        (m_S, a_1, a_2, mu_m, mu_dm, K_S, K_G, KI_L, KI_A, KD_L, KD_A, d_G, r_A,
+         Y_XS, Y_XG, Y_LS, Y_AG, DO_eq, OUR) = p  # fmt: skip
+        S, G, L, A, DO, X = z[:6]
+        dS, dG, dL, dA, dO, dX = out[:6]
+        n = z.shape[1]
+        if n not in self._work:
+            self._work[n] = (np.empty(n), np.empty(n), np.empty(n), np.empty(n, bool))
+        mu, mu_d, tmp, mask = self._work[n]
+
+        # mu = mu_m S / (S + K_S) G / (G + K_G) KI_L / (L + KI_L) KI_A / (A + KI_A)
+        np.add(S, K_S, out=tmp)
+        np.divide(S, tmp, out=mu)
+        np.add(G, K_G, out=tmp)
+        np.divide(G, tmp, out=tmp)
+        mu *= tmp
+        np.add(L, KI_L, out=tmp)
+        np.divide(KI_L, tmp, out=tmp)
+        mu *= tmp
+        np.add(A, KI_A, out=tmp)
+        np.divide(KI_A, tmp, out=tmp)
+        mu *= tmp
+        mu *= mu_m
+        # mu_d = mu_dm L / (L + KD_L) A / (A + KD_A)
+        np.add(L, KD_L, out=tmp)
+        np.divide(L, tmp, out=mu_d)
+        np.add(A, KD_A, out=tmp)
+        np.divide(A, tmp, out=tmp)
+        mu_d *= tmp
+        mu_d *= mu_dm
+
+        # dS = -X (m_S + mu / Y_XS), dL = -dS Y_LS
+        np.divide(mu, Y_XS, out=dS)
+        dS += m_S
+        dS *= X
+        np.multiply(dS, Y_LS, out=dL)
+        np.negative(dS, out=dS)
+        # dG = -X (m_G + mu / Y_XG) - d_G G, with m_G = a_1 G / (a_2 + G)
+        np.add(G, a_2, out=tmp)
+        np.divide(G, tmp, out=dG)
+        dG *= a_1
+        np.divide(mu, Y_XG, out=tmp)
+        dG += tmp
+        dG *= X
+        # dA = X (mu / Y_XG Y_AG - r_A) + d_G G
+        np.multiply(tmp, Y_AG, out=dA)
+        dA -= r_A
+        dA *= X
+        np.multiply(G, d_G, out=tmp)
+        dA += tmp
+        np.negative(dG, out=dG)
+        dG -= tmp
+        # dO = kLa (DO_eq - DO) - X OUR
+        np.subtract(DO_eq, DO, out=dO)
+        dO *= case.compartment_data.kLa
+        np.multiply(X, OUR, out=tmp)
+        dO -= tmp
+        # dX = X (mu - mu_d) - X k_d
+        np.subtract(mu, mu_d, out=dX)
+        dX -= case.k_d
+        dX *= X
+
+        np.less_equal(S, 0, out=mask)
+        np.copyto(dS, 0, where=mask)
+        np.copyto(dL, 0, where=mask)
+        np.less_equal(G, 0, out=mask)
+        np.copyto(dG, 0, where=mask)
+        out[6:] = 0
+
+    def jacobian(
+        self, t: float, z: np.ndarray, p, case: Case, out: np.ndarray
+    ) -> None:
+        (m_S, a_1, a_2, mu_m, mu_dm, K_S, K_G, KI_L, KI_A, KD_L, KD_A, d_G, r_A,
+         Y_XS, Y_XG, Y_LS, Y_AG, DO_eq, OUR) = p  # fmt: skip
+        S, G, L, A, DO, X = z[:6]
+        n = z.shape[1]
+        if n not in self._jacobian_work:
+            self._jacobian_work[n] = (
+                np.empty((4, n)),
+                np.empty((4, n)),
+                np.empty(n),
+                np.empty(n),
+                np.empty(n),
+                np.empty(n, bool),
+            )
+        f, dmu, mu, mu_d, tmp, mask = self._jacobian_work[n]
+
+        # mu = mu_m f_S f_G f_L f_A, with f_S = S / (S + K_S), f_G = G / (G + K_G),
+        # f_L = KI_L / (L + KI_L) and f_A = KI_A / (A + KI_A). dmu holds the
+        # derivatives of mu with respect to S, G, L, A
+        np.add(S, K_S, out=tmp)
+        np.divide(S, tmp, out=f[0])
+        np.square(tmp, out=tmp)
+        np.divide(K_S, tmp, out=dmu[0])
+        np.add(G, K_G, out=tmp)
+        np.divide(G, tmp, out=f[1])
+        np.square(tmp, out=tmp)
+        np.divide(K_G, tmp, out=dmu[1])
+        np.add(L, KI_L, out=tmp)
+        np.divide(KI_L, tmp, out=f[2])
+        np.divide(f[2], tmp, out=dmu[2])
+        np.negative(dmu[2], out=dmu[2])
+        np.add(A, KI_A, out=tmp)
+        np.divide(KI_A, tmp, out=f[3])
+        np.divide(f[3], tmp, out=dmu[3])
+        np.negative(dmu[3], out=dmu[3])
+        for i in range(4):
+            for j in range(4):
+                if i != j:
+                    dmu[i] *= f[j]
+        dmu *= mu_m
+        np.prod(f, axis=0, out=mu)
+        mu *= mu_m
+        # mu_d = mu_dm g_L g_A, with g_L = L / (L + KD_L) and g_A = A / (A + KD_A),
+        # in f[:2], and its derivatives with respect to L, A in f[2:]
+        np.add(L, KD_L, out=tmp)
+        np.divide(L, tmp, out=f[0])
+        np.square(tmp, out=tmp)
+        np.divide(KD_L, tmp, out=f[2])
+        np.add(A, KD_A, out=tmp)
+        np.divide(A, tmp, out=f[1])
+        np.square(tmp, out=tmp)
+        np.divide(KD_A, tmp, out=f[3])
+        f[2] *= f[1]
+        f[3] *= f[0]
+        f[2:] *= mu_dm
+        np.multiply(f[0], f[1], out=mu_d)
+        mu_d *= mu_dm
+
+        out[...] = 0
+        # dS = -X (m_S + mu / Y_XS), dL = -dS Y_LS
+        np.multiply(dmu, X, out=out[0, :4])
+        out[0, :4] /= -Y_XS
+        np.divide(mu, Y_XS, out=out[0, 5])
+        out[0, 5] += m_S
+        np.negative(out[0, 5], out=out[0, 5])
+        np.multiply(out[0], -Y_LS, out=out[2])
+        # dA = X (mu / Y_XG Y_AG - r_A) + d_G G
+        np.multiply(dmu, X, out=out[3, :4])
+        out[3, :4] *= Y_AG / Y_XG
+        out[3, 1] += d_G
+        np.multiply(mu, Y_AG / Y_XG, out=out[3, 5])
+        out[3, 5] -= r_A
+        # dG = -X (m_G + mu / Y_XG) - d_G G, with m_G = a_1 G / (a_2 + G)
+        np.multiply(dmu, X, out=out[1, :4])
+        out[1, :4] /= -Y_XG
+        np.add(G, a_2, out=tmp)
+        np.divide(G, tmp, out=out[1, 5])
+        out[1, 5] *= a_1
+        np.square(tmp, out=tmp)
+        np.divide(a_1 * a_2, tmp, out=tmp)
+        tmp *= X
+        out[1, 1] -= tmp
+        out[1, 1] -= d_G
+        np.divide(mu, Y_XG, out=tmp)
+        out[1, 5] += tmp
+        np.negative(out[1, 5], out=out[1, 5])
+        # dO = kLa (DO_eq - DO) - X OUR
+        np.negative(case.compartment_data.kLa, out=out[4, 4])
+        out[4, 5] = -OUR
+        # dX = X (mu - mu_d) - X k_d
+        np.multiply(dmu, X, out=out[5, :4])
+        np.multiply(f[2], X, out=tmp)
+        out[5, 2] -= tmp
+        np.multiply(f[3], X, out=tmp)
+        out[5, 3] -= tmp
+        np.subtract(mu, mu_d, out=out[5, 5])
+        out[5, 5] -= case.k_d
+
+        np.less_equal(S, 0, out=mask)
+        np.copyto(out[0], 0, where=mask)
+        np.copyto(out[2], 0, where=mask)
+        np.less_equal(G, 0, out=mask)
+        np.copyto(out[1], 0, where=mask)
+
+
 params_xing_simplified = {
     "m_S": 6.92e-11,  # mmol / cell / h
     "a_1": 3.2e-12,  # mmol / cell / h
@@ -70,3 +348,26 @@ params_xing_simplified = {
     "DO_eq": 1.07,  # mM
     "OUR": 3.2e-10,  # mmol / cell h
 }
+
+
+# growthModel_xing_simplified declared as a KineticModel, with a generated
+# Jacobian
+kineticModel_xing_simplified = KineticModel(
+    species=["S", "G", "L", "A", "DO", "X"],
+    parameters=list(params_xing_simplified),
+    expressions={
+        "mu": "mu_m * S / (S + K_S) * G / (G + K_G) * KI_L / (L + KI_L)"
+        " * KI_A / (A + KI_A)",
+        "mu_d": "mu_dm * L / (L + KD_L) * A / (A + KD_A)",
+        "m_G": "a_1 * G / (a_2 + G)",
+    },
+    rates={
+        "S": "-X * (m_S + mu / Y_XS)",
+        "G": "-X * (m_G + mu / Y_XG) - d_G * G",
+        "L": "X * (m_S + mu / Y_XS) * Y_LS",
+        "A": "X * (mu / Y_XG) * Y_AG - r_A * X + d_G * G",
+        "DO": "kLa * (DO_eq - DO) - X * OUR",
+        "X": "X * (mu - mu_d) - X * k_d",
+    },
+    clip={"S": "S <= 0", "L": "S <= 0", "G": "G <= 0"},
+)
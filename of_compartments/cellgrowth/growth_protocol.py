@@ -0,0 +1,107 @@
+"""Growth models that write their rates into buffers supplied by the solver"""
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional
+
+import numpy as np
+
+
+class GrowthModel(ABC):
+    """
+    Growth model evaluated in place.
+
+    The parameters are bound once per simulation with bind, which by default
+    returns the values of param_names as a flat tuple of floats (so models
+    unpack them instead of looking up a dict on every call). rates then writes
+    the rate of each species in each compartment into out, an array with the
+    shape of z (species, compartments) supplied by CompartmentModel, whose
+    initial contents are undefined. Models may also override jacobian, which
+    writes the local Jacobian (species, species, compartments) into out.
+
+    Instances can also be called like the plain growth model functions,
+    model(t, z, p, case) with a parameter dict, which allocates the result, so
+    they can be used wherever those functions are (e.g., with the strang
+    method or fast species). Implementations typically keep work arrays
+    between calls, so an instance shouldn't be shared between threads.
+    """
+
+    # Names of the parameters, in the order bind returns them
+    param_names: List[str] = []
+    # Names of the species, in the order of the state rows, if known
+    species: Optional[List[str]] = None
+
+    def bind(self, params: dict):
+        """Returns the parameters in the form rates and jacobian take."""
+        return tuple(float(params[name]) for name in self.param_names)
+
+    @abstractmethod
+    def rates(self, t: float, z: np.ndarray, p, case, out: np.ndarray) -> None:
+        """Writes the rates into out."""
+
+    def jacobian(self, t: float, z: np.ndarray, p, case, out: np.ndarray) -> None:
+        """Writes the local Jacobian into out, if the model has one."""
+        raise TypeError(f"{type(self).__name__} has no jacobian")
+
+    @property
+    def has_jacobian(self) -> bool:
+        return type(self).jacobian is not GrowthModel.jacobian
+
+    def __call__(self, t: float, z: np.ndarray, p: dict, case) -> np.ndarray:
+        out = np.empty(z.shape)
+        self.rates(t, z, self.bind(p), case, out)
+        return out
+
+    def local_jacobian(self, t: float, z: np.ndarray, p: dict, case) -> np.ndarray:
+        """Returns the local Jacobian, with the signature of growth_jacobian."""
+        out = np.empty((z.shape[0], z.shape[0], z.shape[1]))
+        self.jacobian(t, z, self.bind(p), case, out)
+        return out
+
+
+class LegacyGrowthModel(GrowthModel):
+    """
+    Adapts a growth model function growth_model(t, z, p, case) returning the
+    rates (and optionally a Jacobian function with the same signature) to the
+    GrowthModel protocol. The parameters are passed through as given.
+    """
+
+    def __init__(
+        self,
+        growth_model: Callable,
+        growth_jacobian: Optional[Callable] = None,
+    ):
+        self.growth_model = growth_model
+        self.growth_jacobian = growth_jacobian
+
+    def bind(self, params: dict):
+        return params
+
+    def rates(self, t: float, z: np.ndarray, p, case, out: np.ndarray) -> None:
+        out[...] = self.growth_model(t, z, p, case)
+
+    def jacobian(self, t: float, z: np.ndarray, p, case, out: np.ndarray) -> None:
+        out[...] = self.growth_jacobian(t, z, p, case)
+
+    @property
+    def has_jacobian(self) -> bool:
+        return self.growth_jacobian is not None
+
+    def __call__(self, t: float, z: np.ndarray, p: dict, case) -> np.ndarray:
+        return self.growth_model(t, z, p, case)
+
+    def local_jacobian(self, t: float, z: np.ndarray, p: dict, case) -> np.ndarray:
+        return self.growth_jacobian(t, z, p, case)
+
+
+def as_growth_model(
+    growth_model: Callable, growth_jacobian: Optional[Callable] = None
+) -> GrowthModel:
+    """
+    Returns growth_model as a GrowthModel, adapting plain functions (and a
+    GrowthModel given with a separate Jacobian function) with
+    LegacyGrowthModel.
+    """
+    if isinstance(growth_model, GrowthModel) and (
+        growth_jacobian is None or growth_jacobian == growth_model.local_jacobian
+    ):
+        return growth_model
+    return LegacyGrowthModel(growth_model, growth_jacobian)
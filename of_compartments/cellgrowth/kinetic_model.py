@@ -0,0 +1,394 @@
+"""Growth models declared as rate laws, with generated rates and Jacobians"""
+import ast
+import keyword
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from .growth_protocol import GrowthModel
+
+# Case quantities that rate laws can use, and how the generated code gets them
+CASE_QUANTITIES = {
+    "k_d": "case.k_d",
+    "kLa": "case.compartment_data.kLa",
+    "epsilon": "case.compartment_data.epsilon",
+    "gas_holdup": "case.compartment_data.gas_holdup",
+    "high_shear_fraction": "case.compartment_data.high_shear_fraction",
+    "top_gas_flux": "case.compartment_data.top_gas_flux",
+    "volumes": "case.compartment_data.volumes",
+    "is_top": "case.compartment_data.is_top",
+}
+
+FUNCTIONS = ["exp", "log", "sqrt"]
+
+# Names used by the generated code
+_RESERVED = {"t", "z", "p", "case", "out", "np"}
+
+_BINARY_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow)
+_CONDITION_OPS = (ast.BitAnd, ast.BitOr)
+
+
+class KineticModel(GrowthModel):
+    """
+    Growth model declared by its species, parameters and rate laws, from which
+    the rates and the local Jacobian are generated as vectorized code.
+
+    Rate laws are Python expressions in the species, parameters, intermediate
+    expressions, t, the case quantities in CASE_QUANTITIES (e.g., kLa and k_d)
+    and the functions exp, log and sqrt. For example, the Monod growth of
+    cells X on glucose G:
+
+        KineticModel(
+            species=["G", "X"],
+            parameters=["mu_m", "K_G", "Y_XG"],
+            expressions={"mu": "mu_m * G / (G + K_G)"},
+            rates={"G": "-X * mu / Y_XG", "X": "X * mu - k_d * X"},
+            clip={"G": "G <= 0"},
+        )
+
+    Species without a rate law don't change. clip sets the rate of a species
+    (and its row of the Jacobian) to zero where a condition holds; conditions
+    are comparisons, combined with & and |.
+
+    The Jacobian is differentiated symbolically, with the chain rule through
+    the intermediate expressions. The generated code (in self.source) is used
+    as a GrowthModel, with the parameters bound from a dict in the order of
+    parameters, and solutions of CompartmentModel.run_sim get the states of
+    each species by name in sol.species.
+
+    Args:
+        species: Names of the species, in the order of the state rows.
+        parameters: Names of the parameters.
+        rates: Rate law of each species, by name.
+        expressions: Intermediate expressions by name, in order; each can use
+            the ones before it.
+        clip: Condition under which the rate of each species is zero, by name.
+    """
+
+    def __init__(
+        self,
+        species: List[str],
+        parameters: List[str],
+        rates: Dict[str, str],
+        expressions: Optional[Dict[str, str]] = None,
+        clip: Optional[Dict[str, str]] = None,
+    ):
+        self.species = list(species)
+        self.param_names = list(parameters)
+        self.rate_laws = dict(rates)
+        self.expressions = dict(expressions or {})
+        self.clip = dict(clip or {})
+        self._generate()
+
+    def initial_concentrations(self, **concentrations: float) -> List[float]:
+        """Returns the initial concentrations given by species name."""
+        missing = set(self.species) - set(concentrations)
+        unknown = set(concentrations) - set(self.species)
+        if missing or unknown:
+            raise ValueError(
+                f"need a concentration for each species: missing {sorted(missing)}, "
+                f"unknown {sorted(unknown)}"
+            )
+        return [concentrations[name] for name in self.species]
+
+    def species_index(self, name: str) -> int:
+        """Returns the row of a species in the states."""
+        return self.species.index(name)
+
+    def __getstate__(self) -> dict:
+        # The generated functions can't be pickled, so they're generated again
+        return {
+            "species": self.species,
+            "parameters": self.param_names,
+            "rates": self.rate_laws,
+            "expressions": self.expressions,
+            "clip": self.clip,
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def _generate(self) -> None:
+        """Checks the spec and generates the rates and jacobian methods."""
+        names = self.species + self.param_names + list(self.expressions)
+        for name in names:
+            if keyword.iskeyword(name):
+                raise ValueError(f"invalid name {name}, it is a Python keyword")
+            if (
+                not name.isidentifier()
+                or name.startswith("_")
+                or "__" in name
+                or name in _RESERVED
+                or name in CASE_QUANTITIES
+                or name in FUNCTIONS
+            ):
+                raise ValueError(f"invalid name {name}")
+        if len(set(names)) != len(names):
+            raise ValueError("species, parameter and expression names must differ")
+        for kind, laws in [("rate", self.rate_laws), ("clip", self.clip)]:
+            unknown = set(laws) - set(self.species)
+            if unknown:
+                raise ValueError(f"{kind} for unknown species {sorted(unknown)}")
+
+        known = set(self.species) | set(self.param_names) | set(CASE_QUANTITIES)
+        known.add("t")
+        expressions = {}
+        for name, source in self.expressions.items():
+            expressions[name] = _parse(source, known)
+            known.add(name)
+        rates = {name: _parse(source, known) for name, source in self.rate_laws.items()}
+        clip = {
+            name: _parse(source, known, condition=True)
+            for name, source in self.clip.items()
+        }
+
+        prologue = []
+        if self.param_names:
+            prologue.append(f"{', '.join(self.param_names)}, = p")
+        prologue.append(f"{', '.join(self.species)}, = z")
+        sources = list(expressions.values()) + list(rates.values())
+        sources += list(clip.values())
+        used = set().union(*[_names(node) for node in sources]) if sources else set()
+        for name, attribute in CASE_QUANTITIES.items():
+            if name in used:
+                prologue.append(f"{name} = {attribute}")
+        prologue += [
+            f"{name} = {ast.unparse(node)}" for name, node in expressions.items()
+        ]
+
+        rates_body = list(prologue)
+        for i, name in enumerate(self.species):
+            node = rates.get(name, ast.Constant(0))
+            rates_body.append(f"out[{i}] = {ast.unparse(node)}")
+        for name, condition in clip.items():
+            i = self.species_index(name)
+            rates_body.append(f"np.copyto(out[{i}], 0, where={ast.unparse(condition)})")
+
+        # Derivatives of the intermediate expressions, then of the rates, with
+        # respect to each species; only nonzero ones are generated
+        jacobian_body = list(prologue) + ["out[...] = 0"]
+        for j, variable in enumerate(self.species):
+            nonzero: Set[str] = set()
+            for name, node in expressions.items():
+                derivative = _derivative(node, variable, nonzero)
+                if not _is_constant(derivative, 0):
+                    nonzero.add(name)
+                    jacobian_body.append(
+                        f"{_derivative_name(name, variable)} = "
+                        f"{ast.unparse(derivative)}"
+                    )
+            for i, name in enumerate(self.species):
+                if name not in rates:
+                    continue
+                derivative = _derivative(rates[name], variable, nonzero)
+                if not _is_constant(derivative, 0):
+                    jacobian_body.append(f"out[{i}, {j}] = {ast.unparse(derivative)}")
+        for name, condition in clip.items():
+            i = self.species_index(name)
+            jacobian_body.append(f"out[{i}, :, {ast.unparse(condition)}] = 0")
+
+        self.source = "\n".join(
+            [
+                "def rates(t, z, p, case, out):",
+                *[f"    {line}" for line in rates_body],
+                "",
+                "def jacobian(t, z, p, case, out):",
+                *[f"    {line}" for line in jacobian_body],
+            ]
+        )
+        namespace = {"np": np, **{name: getattr(np, name) for name in FUNCTIONS}}
+        exec(compile(self.source, "<kinetic model>", "exec"), namespace)
+        self._rates = namespace["rates"]
+        self._jacobian = namespace["jacobian"]
+
+    def rates(self, t: float, z: np.ndarray, p, case, out: np.ndarray) -> None:
+        self._rates(t, z, p, case, out)
+
+    def jacobian(self, t: float, z: np.ndarray, p, case, out: np.ndarray) -> None:
+        self._jacobian(t, z, p, case, out)
+
+
+def _parse(source: str, known: Set[str], condition: bool = False) -> ast.expr:
+    """Parses a rate law (or clip condition), checking its names and operations."""
+    try:
+        node = ast.parse(source, mode="eval").body
+    except SyntaxError as e:
+        raise ValueError(f"invalid expression {source!r}: {e}")
+    for child in ast.walk(node):
+        if isinstance(child, ast.Call):
+            if (
+                not isinstance(child.func, ast.Name)
+                or child.func.id not in FUNCTIONS
+                or len(child.args) != 1
+                or child.keywords
+            ):
+                raise ValueError(f"invalid function call in {source!r}")
+        elif isinstance(child, ast.Name):
+            if child.id not in known and child.id not in FUNCTIONS:
+                raise ValueError(f"unknown name {child.id} in {source!r}")
+        elif isinstance(child, ast.BinOp):
+            allowed = _BINARY_OPS + (_CONDITION_OPS if condition else ())
+            if not isinstance(child.op, allowed):
+                raise ValueError(f"unsupported operation in {source!r}")
+        elif isinstance(child, ast.Compare):
+            if not condition or len(child.ops) != 1:
+                raise ValueError(f"unsupported comparison in {source!r}")
+        elif isinstance(child, ast.Constant):
+            if not isinstance(child.value, (int, float)):
+                raise ValueError(f"invalid constant in {source!r}")
+        elif not isinstance(
+            child,
+            (
+                ast.UnaryOp,
+                ast.USub,
+                ast.UAdd,
+                ast.Load,
+                ast.operator,
+                ast.cmpop,
+            ),
+        ):
+            raise ValueError(f"unsupported expression in {source!r}")
+    if condition and not isinstance(node, (ast.Compare, ast.BinOp)):
+        raise ValueError(f"clip condition {source!r} is not a comparison")
+    return node
+
+
+def _names(node: ast.expr) -> Set[str]:
+    return {child.id for child in ast.walk(node) if isinstance(child, ast.Name)}
+
+
+def _derivative_name(name: str, variable: str) -> str:
+    # Names can't contain "__", so these don't collide
+    return f"_d__{name}__{variable}"
+
+
+def _derivative(node: ast.expr, variable: str, nonzero: Set[str]) -> ast.expr:
+    """
+    Returns the derivative of node with respect to variable. Intermediate
+    expressions in nonzero stand for their derivatives (see _derivative_name);
+    the others don't depend on variable.
+    """
+    if isinstance(node, ast.Constant):
+        return _constant(0)
+    if isinstance(node, ast.Name):
+        if node.id == variable:
+            return _constant(1)
+        if node.id in nonzero:
+            return ast.Name(_derivative_name(node.id, variable), ast.Load())
+        return _constant(0)
+    if isinstance(node, ast.UnaryOp):
+        derivative = _derivative(node.operand, variable, nonzero)
+        return derivative if isinstance(node.op, ast.UAdd) else _negative(derivative)
+    if isinstance(node, ast.Call):
+        (a,) = node.args
+        da = _derivative(a, variable, nonzero)
+        name = node.func.id
+        if name == "exp":
+            return _product(node, da)
+        if name == "log":
+            return _quotient(da, a)
+        # sqrt
+        return _quotient(da, _product(_constant(2), node))
+
+    a, b = node.left, node.right
+    da = _derivative(a, variable, nonzero)
+    db = _derivative(b, variable, nonzero)
+    if isinstance(node.op, ast.Add):
+        return _sum(da, db)
+    if isinstance(node.op, ast.Sub):
+        return _sum(da, _negative(db))
+    if isinstance(node.op, ast.Mult):
+        return _sum(_product(da, b), _product(a, db))
+    if isinstance(node.op, ast.Div):
+        # (da b - a db) / b^2, as da / b - a db / b^2
+        return _sum(
+            _quotient(da, b), _negative(_quotient(_product(a, db), _power(b, 2)))
+        )
+    # Power
+    if _is_constant(db, 0):
+        exponent = _sum(b, _constant(-1))
+        return _product(_product(b, _power(a, exponent)), da)
+    # a^b (db log(a) + b da / a)
+    log_a = ast.Call(ast.Name("log", ast.Load()), [a], [])
+    return _product(node, _sum(_product(db, log_a), _quotient(_product(b, da), a)))
+
+
+def _constant(value: float) -> ast.expr:
+    if value < 0:
+        return ast.UnaryOp(ast.USub(), ast.Constant(-value))
+    return ast.Constant(value)
+
+
+def _constant_value(node: ast.expr) -> Optional[float]:
+    if isinstance(node, ast.Constant):
+        return node.value
+    if (
+        isinstance(node, ast.UnaryOp)
+        and isinstance(node.op, ast.USub)
+        and isinstance(node.operand, ast.Constant)
+    ):
+        return -node.operand.value
+    return None
+
+
+def _is_constant(node: ast.expr, value: float) -> bool:
+    return _constant_value(node) == value
+
+
+def _sum(a: ast.expr, b: ast.expr) -> ast.expr:
+    x, y = _constant_value(a), _constant_value(b)
+    if x is not None and y is not None:
+        return _constant(x + y)
+    if x == 0:
+        return b
+    if y == 0:
+        return a
+    if isinstance(b, ast.UnaryOp) and isinstance(b.op, ast.USub):
+        return ast.BinOp(a, ast.Sub(), b.operand)
+    return ast.BinOp(a, ast.Add(), b)
+
+
+def _negative(a: ast.expr) -> ast.expr:
+    x = _constant_value(a)
+    if x is not None:
+        return _constant(-x)
+    if isinstance(a, ast.UnaryOp) and isinstance(a.op, ast.USub):
+        return a.operand
+    return ast.UnaryOp(ast.USub(), a)
+
+
+def _product(a: ast.expr, b: ast.expr) -> ast.expr:
+    x, y = _constant_value(a), _constant_value(b)
+    if x is not None and y is not None:
+        return _constant(x * y)
+    if x == 0 or y == 0:
+        return _constant(0)
+    if x == 1:
+        return b
+    if y == 1:
+        return a
+    if x == -1:
+        return _negative(b)
+    if y == -1:
+        return _negative(a)
+    return ast.BinOp(a, ast.Mult(), b)
+
+
+def _quotient(a: ast.expr, b: ast.expr) -> ast.expr:
+    x, y = _constant_value(a), _constant_value(b)
+    if x == 0:
+        return _constant(0)
+    if y == 1:
+        return a
+    return ast.BinOp(a, ast.Div(), b)
+
+
+def _power(a: ast.expr, exponent) -> ast.expr:
+    if not isinstance(exponent, ast.AST):
+        exponent = _constant(exponent)
+    n = _constant_value(exponent)
+    if n == 0:
+        return _constant(1)
+    if n == 1:
+        return a
+    return ast.BinOp(a, ast.Pow(), exponent)
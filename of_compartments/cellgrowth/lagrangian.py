@@ -0,0 +1,225 @@
+"""Individual cell trajectories through the compartment network"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import scipy.sparse as sp
+
+from .compartment_model import Case
+
+# Exposures accumulated over each cell's path, in the columns of the rates
+# from _exposure_rates
+_EXPOSURES = ["epsilon", "high_shear_time", "top_time", "top_gas_flux"]
+
+
+@dataclass
+class CellExposures:
+    # Time (hours) over which the cells were tracked
+    time: float
+    # Compartment of each cell at the start and end
+    start_compartment: np.ndarray
+    end_compartment: np.ndarray
+    # Number of moves between compartments of each cell
+    num_jumps: np.ndarray
+    # Time integral of the energy dissipation rate (W/kg h) along each path
+    epsilon: np.ndarray
+    # Largest energy dissipation rate (W/kg) of the compartments visited
+    max_epsilon: np.ndarray
+    # Time (hours) spent at high shear (time integral of high_shear_fraction)
+    high_shear_time: np.ndarray
+    # Time (hours) spent in top compartments, where bubbles burst
+    top_time: np.ndarray
+    # Number of times each cell entered a top compartment
+    top_visits: np.ndarray
+    # Time integral of the gas flux through the top of the compartment per
+    # liquid volume, i.e., of the bubble bursting rate seen by the cell
+    top_gas_flux: np.ndarray
+    # Time (hours) spent above each of epsilon_thresholds, shape (cells,
+    # thresholds)
+    epsilon_threshold_time: np.ndarray
+    epsilon_thresholds: np.ndarray
+
+    def distribution(self, name: str, bins: Union[int, np.ndarray] = 50):
+        """Returns the histogram (counts, bin edges) of an exposure over cells."""
+        return np.histogram(getattr(self, name), bins=bins)
+
+
+def track_cells(
+    case: Case,
+    num_cells: int,
+    time: float,
+    seed: Optional[Union[int, np.random.SeedSequence]] = None,
+    batch_size: int = 100_000,
+    epsilon_thresholds: List[float] = (),
+    initial_compartments: Optional[np.ndarray] = None,
+) -> CellExposures:
+    """
+    Simulates individual cells moving through the compartments and records the
+    shear and bubble exposure along their paths.
+
+    Each cell follows the continuous-time Markov chain defined by the flow: it
+    leaves compartment i at rate sum_j F[i, j] / V_i, to compartment j with
+    probability proportional to F[i, j]. Paths are simulated exactly, one jump
+    at a time for all cells of a batch at once, so the cost is proportional to
+    the total number of jumps (about time times the mean exit rate per cell).
+    Cells are simulated in batches of batch_size, which bounds the memory used
+    besides the per-cell results. Each batch has its own random generator
+    spawned from seed, so results are reproducible for a given seed and
+    batch_size.
+
+    Args:
+        case: Case data (a single snapshot).
+        num_cells: Number of cells to track.
+        time: Time (hours) to track each cell for.
+        seed: Seed of the random generators.
+        batch_size: Number of cells simulated at once.
+        epsilon_thresholds: Energy dissipation rates (W/kg) above which to
+            record the time spent, e.g., for damage models with thresholds.
+        initial_compartments: Compartment of each cell at the start. By
+            default they are drawn in proportion to the compartment volumes,
+            the stationary distribution of the flow.
+    """
+    if case.snapshots is not None:
+        raise ValueError("time-varying cases are not supported")
+    data = case.compartment_data
+    volumes = np.asarray(data.volumes, dtype=float)
+    num_compartments = len(volumes)
+    epsilon = np.asarray(data.epsilon, dtype=float)
+    epsilon_thresholds = np.asarray(epsilon_thresholds, dtype=float)
+    if initial_compartments is not None:
+        initial_compartments = np.asarray(initial_compartments)
+        if len(initial_compartments) != num_cells:
+            raise ValueError("need one initial compartment per cell")
+
+    F = sp.csr_matrix(case.F)
+    F.setdiag(0)
+    F.eliminate_zeros()
+    exit_rates = np.asarray(F.sum(axis=1)).ravel() / volumes
+    cumulative = _jump_table(F)
+    rates = np.column_stack(
+        [_exposure_rates(case)]
+        + [(epsilon > threshold).astype(float) for threshold in epsilon_thresholds]
+    )
+    is_top = np.asarray(data.is_top, dtype=bool)
+
+    result = {
+        "start_compartment": np.zeros(num_cells, dtype=np.int64),
+        "end_compartment": np.zeros(num_cells, dtype=np.int64),
+        "num_jumps": np.zeros(num_cells, dtype=np.int64),
+        "max_epsilon": np.zeros(num_cells),
+        "top_visits": np.zeros(num_cells, dtype=np.int64),
+        "exposures": np.zeros((num_cells, rates.shape[1])),
+    }
+    num_batches = max(int(np.ceil(num_cells / batch_size)), 1)
+    seeds = np.random.SeedSequence(seed).spawn(num_batches)
+    for batch, batch_seed in enumerate(seeds):
+        cells = slice(batch * batch_size, min((batch + 1) * batch_size, num_cells))
+        rng = np.random.default_rng(batch_seed)
+        size = cells.stop - cells.start
+        if initial_compartments is None:
+            start = rng.choice(num_compartments, size=size, p=volumes / volumes.sum())
+        else:
+            start = initial_compartments[cells]
+        batch_result = _track_batch(
+            start, time, rng, F, cumulative, exit_rates, rates, epsilon, is_top
+        )
+        result["start_compartment"][cells] = start
+        for name, values in batch_result.items():
+            result[name][cells] = values
+
+    exposures = result.pop("exposures")
+    return CellExposures(
+        time=time,
+        **result,
+        **{name: exposures[:, i] for i, name in enumerate(_EXPOSURES)},
+        epsilon_threshold_time=exposures[:, len(_EXPOSURES) :],
+        epsilon_thresholds=epsilon_thresholds,
+    )
+
+
+def _exposure_rates(case: Case) -> np.ndarray:
+    """
+    Returns the rate at which each exposure in _EXPOSURES accumulates in each
+    compartment, with shape (compartments, exposures).
+    """
+    data = case.compartment_data
+    is_top = np.asarray(data.is_top, dtype=float)
+    return np.column_stack(
+        [
+            data.epsilon,
+            data.high_shear_fraction,
+            is_top,
+            is_top * np.asarray(data.top_gas_flux) / np.asarray(data.volumes),
+        ]
+    ).astype(float)
+
+
+def _jump_table(F: sp.csr_matrix) -> np.ndarray:
+    """
+    Returns the cumulative jump probabilities of each row of F, offset by the
+    row index, so that for a cell in compartment c and a uniform u, the first
+    entry greater than c + u is its destination.
+    """
+    rows = np.repeat(np.arange(F.shape[0]), np.diff(F.indptr))
+    probabilities = F.data / np.asarray(F.sum(axis=1)).ravel()[rows]
+    total = np.cumsum(probabilities)
+    row_starts = np.concatenate([[0], total])[F.indptr[:-1]]
+    return rows + total - row_starts[rows]
+
+
+def _track_batch(
+    start: np.ndarray,
+    time: float,
+    rng: np.random.Generator,
+    F: sp.csr_matrix,
+    cumulative: np.ndarray,
+    exit_rates: np.ndarray,
+    rates: np.ndarray,
+    epsilon: np.ndarray,
+    is_top: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """Simulates the paths of a batch of cells starting in compartments start."""
+    size = len(start)
+    # State of the cells still moving, and their index in the batch. Cells
+    # that are done stay (without moving) until half of the cells are, and are
+    # then moved to result.
+    index = np.arange(size)
+    remaining = np.full(size, float(time))
+    state = {
+        "end_compartment": np.asarray(start).copy(),
+        "num_jumps": np.zeros(size, dtype=np.int64),
+        "max_epsilon": epsilon[start],
+        "top_visits": np.zeros(size, dtype=np.int64),
+        "exposures": np.zeros((size, rates.shape[1])),
+    }
+    result = {name: np.empty_like(values) for name, values in state.items()}
+    while len(index):
+        c = state["end_compartment"]
+        with np.errstate(divide="ignore"):
+            holding = rng.exponential(size=len(c)) / exit_rates[c]
+        dwell = np.minimum(holding, remaining)
+        state["exposures"] += rates[c] * dwell[:, np.newaxis]
+        moving = holding < remaining
+        remaining -= dwell
+
+        if np.any(moving):
+            k = np.searchsorted(cumulative, c + rng.random(len(c)), side="right")
+            # Guard against rounding at the ends of rows
+            k = np.clip(k, F.indptr[c], F.indptr[c + 1] - 1)
+            destination = np.where(moving, F.indices[k], c)
+            state["end_compartment"] = destination
+            state["num_jumps"] += moving
+            state["top_visits"] += moving & is_top[destination]
+            np.maximum(
+                state["max_epsilon"], epsilon[destination], out=state["max_epsilon"]
+            )
+
+        if np.count_nonzero(moving) <= len(index) // 2:
+            done = ~moving
+            for name, values in state.items():
+                result[name][index[done]] = values[done]
+                state[name] = values[moving]
+            index = index[moving]
+            remaining = remaining[moving]
+
+    return result
@@ -0,0 +1,250 @@
+"""Lumping of similar, adjacent compartments into fewer compartments"""
+import time as wall_time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import scipy.sparse as sp
+
+from .. import utils
+from .compartment_model import Case, CompartmentData, CompartmentModel
+
+# Default relative tolerances on the range of each field within a group
+DEFAULT_LUMPING_RTOL = {
+    "kLa": 0.1,
+    "epsilon": 0.1,
+    "gas_holdup": 0.1,
+    "k_d": 0.1,
+}
+
+# Fields of CompartmentData averaged over the volume of each group
+_AVERAGED_FIELDS = ["gas_holdup", "high_shear_fraction", "kLa", "epsilon"]
+
+
+@dataclass
+class LumpedCase:
+    # Case with one compartment per group
+    case: Case
+    # Group (compartment of the lumped case) of each original compartment
+    groups: np.ndarray
+
+    def expand(self, z: np.ndarray) -> np.ndarray:
+        """
+        Maps concentrations of the lumped case (compartments on the last axis)
+        to the original compartments.
+        """
+        return z[..., self.groups]
+
+
+@dataclass
+class LumpingReport:
+    num_compartments: int
+    num_lumped_compartments: int
+    # Largest deviation of the volume-weighted mean of each species over time,
+    # relative to its largest magnitude in the full model
+    mean_deviation: np.ndarray
+    # Largest deviation of each species in any original compartment, relative
+    # to its largest magnitude in the full model
+    local_deviation: np.ndarray
+    # Wall time (seconds) of the reference runs
+    solve_time: float
+    lumped_solve_time: float
+
+
+def lump_compartments(case: Case, rtol: Optional[Dict[str, float]] = None) -> LumpedCase:
+    """
+    Merges compartments that are adjacent in the flow graph and have similar
+    properties.
+
+    Adjacent pairs are merged in order of increasing difference, as long as the
+    range of each field in rtol (kLa, epsilon, gas_holdup or k_d) within the
+    merged group stays within rtol times its largest magnitude in the group.
+    Top compartments are only merged with other top compartments. For
+    time-varying cases, the fields must be within rtol in every snapshot.
+
+    In the lumped case, volumes and flows between groups are summed, flows
+    within groups are dropped, and the other fields and damage rates are
+    averaged over volume, which is exact for the uptake and death rates when
+    the concentrations within a group are uniform. The gas flux through the
+    top of a group leaves out the gas flowing up within it; the lumped case
+    keeps the gas flow between groups, so it can be lumped again.
+    """
+    if rtol is None:
+        rtol = DEFAULT_LUMPING_RTOL
+    data = case.compartment_data
+    num_compartments = len(data.ids)
+    cases = [case] if case.snapshots is None else case.snapshots.cases
+    fields = np.array(
+        [
+            c.k_d if name == "k_d" else getattr(c.compartment_data, name)
+            for c in cases
+            for name in rtol.keys()
+        ],
+        dtype=float,
+    ).reshape(len(cases) * len(rtol), num_compartments)
+    tolerances = np.tile(np.array(list(rtol.values()), dtype=float), len(cases))
+    tolerances = tolerances[:, np.newaxis]
+    is_top = np.asarray(data.is_top, dtype=bool)
+
+    F = sp.coo_matrix(sum(abs(sp.csr_matrix(c.F)) for c in cases))
+    adjacent = F.row != F.col
+    i, j = F.row[adjacent], F.col[adjacent]
+    scale = np.maximum(np.abs(fields[:, i]), np.abs(fields[:, j]))
+    difference = np.abs(fields[:, i] - fields[:, j]) / np.where(scale > 0, scale, 1)
+    order = np.argsort(np.max(difference / tolerances, axis=0, initial=0), kind="stable")
+
+    # Union-find, with the range of each field in each group
+    parent = np.arange(num_compartments)
+    field_min = fields.copy()
+    field_max = fields.copy()
+
+    def find(c):
+        while parent[c] != c:
+            parent[c] = parent[parent[c]]
+            c = parent[c]
+        return c
+
+    for edge in order:
+        a, b = find(i[edge]), find(j[edge])
+        if a == b or is_top[a] != is_top[b]:
+            continue
+        merged_min = np.minimum(field_min[:, a], field_min[:, b])
+        merged_max = np.maximum(field_max[:, a], field_max[:, b])
+        magnitude = np.maximum(np.abs(merged_min), np.abs(merged_max))
+        if np.all(merged_max - merged_min <= tolerances[:, 0] * magnitude):
+            parent[b] = a
+            field_min[:, a] = merged_min
+            field_max[:, a] = merged_max
+
+    roots = np.array([find(c) for c in range(num_compartments)])
+    _, groups = np.unique(roots, return_inverse=True)
+    return LumpedCase(case=_create_lumped_case(case, groups), groups=groups)
+
+
+def lumping_report(
+    case: Case,
+    lumped: LumpedCase,
+    time: float,
+    growth_model: Callable[[float, np.ndarray, dict, Case], np.ndarray],
+    params: dict,
+    initial_concentrations: List[float],
+    growth_jacobian: Optional[
+        Callable[[float, np.ndarray, dict, Case], np.ndarray]
+    ] = None,
+    t_eval: Optional[np.ndarray] = None,
+) -> LumpingReport:
+    """
+    Runs a reference simulation in the full and lumped cases and reports the
+    deviation of the lumped model (e.g., of VCD and DO for the Xing model) and
+    the cost of each.
+    """
+    if t_eval is None:
+        t_eval = CompartmentModel._hourly_times(time)
+    solutions = []
+    solve_times = []
+    for c in [case, lumped.case]:
+        start = wall_time.perf_counter()
+        solutions.append(
+            CompartmentModel._solve(
+                c,
+                time,
+                growth_model,
+                params,
+                initial_concentrations,
+                growth_jacobian=growth_jacobian,
+                t_eval=t_eval,
+            )
+        )
+        solve_times.append(wall_time.perf_counter() - start)
+    sol, sol_lumped = solutions
+    z_lumped = lumped.expand(sol_lumped.z)
+
+    volumes = case.compartment_data.volumes
+    scale = np.max(np.abs(sol.z), axis=(0, 2))
+    scale = np.where(scale > 0, scale, 1)
+    mean = np.sum(sol.z * volumes, axis=2) / np.sum(volumes)
+    mean_lumped = np.sum(z_lumped * volumes, axis=2) / np.sum(volumes)
+    return LumpingReport(
+        num_compartments=len(volumes),
+        num_lumped_compartments=len(lumped.case.compartment_data.volumes),
+        mean_deviation=np.max(np.abs(mean_lumped - mean), axis=0) / scale,
+        local_deviation=np.max(np.abs(z_lumped - sol.z), axis=(0, 2)) / scale,
+        solve_time=solve_times[0],
+        lumped_solve_time=solve_times[1],
+    )
+
+
+def _create_lumped_case(case: Case, groups: np.ndarray) -> Case:
+    data = case.compartment_data
+    num_groups = np.max(groups) + 1
+    # Aggregation matrix: P[g, c] = 1 if compartment c is in group g
+    P = sp.csr_matrix(
+        (np.ones(len(groups)), (groups, np.arange(len(groups)))),
+        shape=(num_groups, len(groups)),
+    )
+    volumes = P @ data.volumes
+
+    def volume_average(values):
+        return (P @ (np.asarray(values, dtype=float) * data.volumes)) / volumes
+
+    F = sp.csr_matrix(P @ sp.csr_matrix(case.F) @ P.T)
+    F.setdiag(0)
+    F.eliminate_zeros()
+    if not sp.issparse(case.F):
+        F = F.toarray()
+
+    # Gas flowing up between compartments of a group doesn't leave it
+    gas_flow = sp.csr_matrix(P @ _gas_flow(case) @ P.T)
+    top_gas_flux = P @ np.asarray(data.top_gas_flux, dtype=float) - gas_flow.diagonal()
+    gas_flow.setdiag(0)
+    gas_flow.eliminate_zeros()
+
+    ids = np.array(data.ids)
+    lumped_data = CompartmentData(
+        ids=["+".join(ids[groups == g]) for g in range(num_groups)],
+        volumes=volumes,
+        top_gas_flux=top_gas_flux,
+        is_top=np.asarray(P @ np.asarray(data.is_top, dtype=float) > 0),
+        **{
+            name: volume_average(getattr(data, name))
+            for name in _AVERAGED_FIELDS
+        },
+    )
+    snapshots = None
+    if case.snapshots is not None:
+        snapshots = case.snapshots.replace_cases(
+            [_create_lumped_case(c, groups) for c in case.snapshots.cases]
+        )
+    return Case(
+        volume=case.volume,
+        F=F,
+        k_d=volume_average(case.k_d),
+        compartment_data=lumped_data,
+        transport=CompartmentModel._create_transport_operator(F, volumes),
+        snapshots=snapshots,
+        gas_flow=gas_flow,
+    )
+
+
+def _gas_flow(case: Case) -> sp.csr_matrix:
+    """
+    Returns the upward gas flow between the compartments of a case, G[i, j]
+    from i into the compartment j directly above it. For cases that aren't
+    lumped, this is the gas flux through the top of each compartment that has
+    a compartment above it (the others' gas leaves the reactor).
+    """
+    if case.gas_flow is not None:
+        return case.gas_flow
+    data = case.compartment_data
+    index = {id: i for i, id in enumerate(data.ids)}
+    rows, cols = [], []
+    for lower, upper in utils.get_compartment_lower_upper_pairs_by_name(data.ids):
+        if lower in index and upper in index:
+            rows.append(index[lower])
+            cols.append(index[upper])
+    num_compartments = len(data.ids)
+    return sp.csr_matrix(
+        (np.asarray(data.top_gas_flux, dtype=float)[rows], (rows, cols)),
+        shape=(num_compartments, num_compartments),
+    )
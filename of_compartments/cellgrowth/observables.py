@@ -0,0 +1,226 @@
+"""Reactor-level quantities computed from the states while the integration runs"""
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+# Species index, or indices (the observable then has one value per species)
+Species = Union[int, List[int]]
+
+
+class Observable(ABC):
+    """
+    A quantity computed from the states at each output time.
+
+    Subclasses return the values for states z with shape (times, species,
+    compartments) at times t, with one row per time. If cumulative is set, the
+    values are integrated over time instead (see Integral).
+    """
+
+    cumulative = False
+
+    @abstractmethod
+    def __call__(self, t: np.ndarray, z: np.ndarray, case) -> np.ndarray:
+        """Returns the values at times t."""
+
+
+class VolumeWeightedMean(Observable):
+    """Volume-weighted mean concentration over the reactor, times scale."""
+
+    def __init__(self, species: Species, scale: float = 1.0):
+        self.species = species
+        self.scale = scale
+
+    def __call__(self, t, z, case):
+        volumes = case.compartment_data.volumes
+        return self.scale * (z[:, self.species, :] @ volumes) / np.sum(volumes)
+
+
+class Minimum(Observable):
+    """Lowest concentration in any compartment, times scale."""
+
+    def __init__(self, species: Species, scale: float = 1.0):
+        self.species = species
+        self.scale = scale
+
+    def __call__(self, t, z, case):
+        return self.scale * np.min(z[:, self.species, :], axis=-1)
+
+
+class Maximum(Observable):
+    """Highest concentration in any compartment, times scale."""
+
+    def __init__(self, species: Species, scale: float = 1.0):
+        self.species = species
+        self.scale = scale
+
+    def __call__(self, t, z, case):
+        return self.scale * np.max(z[:, self.species, :], axis=-1)
+
+
+class Integral(Observable):
+    """
+    Time integral in each compartment of integrand(t, z, case), which returns
+    an array of shape (times, compartments) for states z with shape (times,
+    species, compartments). E.g., the cells lost to damage per volume are
+
+        Integral(lambda t, z, case: case.k_d * z[:, 5, :])
+
+    The integral is accumulated with the trapezoidal rule between output times,
+    so its accuracy depends on them: by default every solver step is an output
+    time.
+    """
+
+    cumulative = True
+
+    def __init__(
+        self, integrand: Callable[[np.ndarray, np.ndarray, object], np.ndarray]
+    ):
+        self.integrand = integrand
+
+    def __call__(self, t, z, case):
+        return self.integrand(t, z, case)
+
+
+class ObservableRecorder:
+    """
+    Output that computes observables from the states written to it.
+
+    The states are passed on to output, if given, so they can be kept too. For
+    time-varying cases, the observables at each time are computed with the
+    case at that time (see CaseSnapshots.at).
+    """
+
+    def __init__(
+        self,
+        observables: Dict[str, Observable],
+        case,
+        num_species: int,
+        output=None,
+    ):
+        self.observables = observables
+        self.case = case
+        self.num_species = num_species
+        self.output = output
+        self._t = []
+        self._values = {name: [] for name in observables}
+        # Time and integrand at the last output time, and the integrals up to it
+        self._last_t = None
+        self._last_integrand = {}
+        self._integrals = {}
+
+    def write(self, t: np.ndarray, y: np.ndarray) -> None:
+        """Records the observables of states y (one row per time in t)."""
+        self.record(t, y)
+        if self.output is not None:
+            self.output.write(t, y)
+
+    def record(self, t: np.ndarray, y: np.ndarray) -> None:
+        """Records the observables without passing the states on to output."""
+        if len(t) == 0:
+            return
+        t = np.asarray(t, dtype=float)
+        z = np.asarray(y).reshape(len(t), self.num_species, -1)
+        self._t.append(t)
+        for name, observable in self.observables.items():
+            values = self._evaluate(observable, t, z)
+            if observable.cumulative:
+                values = self._accumulate(name, t, values)
+            self._values[name].append(values)
+        self._last_t = t[-1]
+
+    def flush(self) -> None:
+        if self.output is not None:
+            self.output.flush()
+
+    @property
+    def t(self) -> np.ndarray:
+        return np.concatenate(self._t) if self._t else np.zeros(0)
+
+    @property
+    def y(self) -> Optional[np.ndarray]:
+        """States kept by output, if any."""
+        return None if self.output is None else self.output.y
+
+    @property
+    def values(self) -> Dict[str, np.ndarray]:
+        """Values of each observable, with one row per output time."""
+        return {
+            name: np.concatenate(values) if values else np.zeros(0)
+            for name, values in self._values.items()
+        }
+
+    def state(self) -> dict:
+        """
+        Returns the times, values and integrator state recorded so far, so a
+        resumed run can continue them (see restore).
+        """
+        return {
+            "t": self.t,
+            "values": self.values,
+            "last_t": self._last_t,
+            "last_integrand": dict(self._last_integrand),
+            "integrals": dict(self._integrals),
+        }
+
+    def restore(self, state: dict) -> None:
+        """Continues from the state of another recorder (see state)."""
+        if len(state["t"]):
+            self._t = [np.asarray(state["t"], dtype=float)]
+            self._values = {
+                name: [np.asarray(state["values"][name], dtype=float)]
+                for name in self.observables
+            }
+        self._last_t = state["last_t"]
+        self._last_integrand = dict(state["last_integrand"])
+        self._integrals = dict(state["integrals"])
+
+    def _evaluate(self, observable: Observable, t: np.ndarray, z: np.ndarray):
+        """Returns the values of observable at times t, with the case at each."""
+        snapshots = getattr(self.case, "snapshots", None)
+        if snapshots is None:
+            return np.asarray(observable(t, z, self.case), dtype=float)
+        return np.concatenate(
+            [
+                np.asarray(
+                    observable(t[i : i + 1], z[i : i + 1], snapshots.at(t[i])),
+                    dtype=float,
+                )
+                for i in range(len(t))
+            ]
+        )
+
+    def _accumulate(self, name: str, t: np.ndarray, integrand: np.ndarray):
+        """Returns the integrals up to times t, given the integrand at t."""
+        previous = self._last_integrand.get(name)
+        if previous is None:
+            # The integral starts at the first output time
+            t_all, f_all = t, integrand
+            total = np.zeros(integrand.shape[1:])
+        else:
+            t_all = np.concatenate([[self._last_t], t])
+            f_all = np.concatenate([previous[np.newaxis], integrand])
+            total = self._integrals[name]
+        dt = np.diff(t_all).reshape((-1,) + (1,) * (f_all.ndim - 1))
+        increments = np.cumsum(dt * (f_all[1:] + f_all[:-1]) / 2, axis=0)
+        if previous is None:
+            increments = np.concatenate([np.zeros((1,) + total.shape), increments])
+        integrals = total + increments
+        self._last_integrand[name] = integrand[-1]
+        self._integrals[name] = integrals[-1]
+        return integrals
+
+
+def record_observables(
+    observables: Dict[str, Observable],
+    case,
+    t: np.ndarray,
+    z: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """
+    Returns the observables of a stored solution, with states z of shape
+    (times, species, compartments) at times t (e.g., sol.t and sol.z).
+    """
+    recorder = ObservableRecorder(observables, case, z.shape[1])
+    recorder.record(t, z.reshape(len(t), -1))
+    return recorder.values
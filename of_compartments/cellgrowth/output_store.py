@@ -0,0 +1,123 @@
+"""Storage for simulation states written while the integration runs"""
+import json
+import os
+
+import numpy as np
+
+_META_FILE = "meta.json"
+_TIME_FILE = "t.npy"
+_VOLUME_FILE = "v.npy"
+_STATE_FILE = "z.npy"
+
+
+class MemoryOutput:
+    """Keeps the simulation states in memory, like solve_ivp."""
+
+    def __init__(self, num_states: int = 0):
+        self.num_states = num_states
+        self._t = []
+        self._y = []
+
+    def write(self, t: np.ndarray, y: np.ndarray) -> None:
+        """Adds states y (one row per time in t)."""
+        self._t.append(t)
+        self._y.append(y)
+
+    def flush(self) -> None:
+        pass
+
+    @property
+    def t(self) -> np.ndarray:
+        return np.concatenate(self._t) if self._t else np.zeros(0)
+
+    @property
+    def y(self) -> np.ndarray:
+        """States with shape (n_states, n_times), as in solve_ivp."""
+        if not self._y:
+            # Nothing written, e.g., if the solver failed before the first
+            # output time
+            return np.zeros((self.num_states, 0))
+        return np.vstack(self._y).T
+
+
+class SimulationStore:
+    """
+    On-disk store of simulation states at fixed output times.
+
+    The store is a directory with one .npy file per array, so that the states
+    can be memory-mapped: 't.npy' (output times), 'v.npy' (compartment volumes)
+    and 'z.npy' (states with shape (times, species, compartments)), along with
+    'meta.json' recording how many times have been written. States are written
+    as the integration reaches each output time and flushed to disk in chunks,
+    so memory use doesn't grow with the length of the simulation.
+    """
+
+    def __init__(self, path: str, mode: str = "r"):
+        self.path = path
+        with open(os.path.join(path, _META_FILE), "r") as f:
+            self._count = json.load(f)["count"]
+        self.t_all = np.load(os.path.join(path, _TIME_FILE))
+        self.v = np.load(os.path.join(path, _VOLUME_FILE))
+        self._z = np.load(os.path.join(path, _STATE_FILE), mmap_mode=mode)
+        self.chunk_size = 64
+        self._unflushed = 0
+
+    @classmethod
+    def create(
+        cls,
+        path: str,
+        t: np.ndarray,
+        num_species: int,
+        num_compartments: int,
+        volumes: np.ndarray,
+    ) -> "SimulationStore":
+        """Creates an empty store for states at times t."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, _TIME_FILE), np.asarray(t, dtype=float))
+        np.save(os.path.join(path, _VOLUME_FILE), np.asarray(volumes, dtype=float))
+        np.lib.format.open_memmap(
+            os.path.join(path, _STATE_FILE),
+            mode="w+",
+            dtype=float,
+            shape=(len(t), num_species, num_compartments),
+        ).flush()
+        cls._write_meta(path, 0)
+        return cls(path, mode="r+")
+
+    @staticmethod
+    def _write_meta(path: str, count: int) -> None:
+        with open(os.path.join(path, _META_FILE), "w") as f:
+            json.dump({"count": count}, f)
+
+    def write(self, t: np.ndarray, y: np.ndarray) -> None:
+        """Writes states y (one flattened state per row) for the next times t."""
+        if not np.allclose(t, self.t_all[self._count : self._count + len(t)]):
+            raise ValueError("states must be written at the store's output times")
+        self._z[self._count : self._count + len(t)] = y.reshape(
+            (len(t),) + self._z.shape[1:]
+        )
+        self._count += len(t)
+        self._unflushed += len(t)
+        if self._unflushed >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        self._z.flush()
+        SimulationStore._write_meta(self.path, self._count)
+        self._unflushed = 0
+
+    @property
+    def t(self) -> np.ndarray:
+        """Output times that have been written."""
+        return self.t_all[: self._count]
+
+    @property
+    def z(self) -> np.ndarray:
+        """Memory-mapped states with shape (times, species, compartments)."""
+        return self._z[: self._count]
+
+    @property
+    def y(self) -> np.ndarray:
+        """Memory-mapped states with shape (n_states, n_times), as in solve_ivp."""
+        num_states = self._z.shape[1] * self._z.shape[2]
+        return self.z.reshape(self._count, num_states).T
@@ -0,0 +1,265 @@
+"""Estimation of growth model parameters from measured concentrations"""
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import scipy.optimize
+
+from .compartment_model import Case
+from .ensemble import EnsembleRunner
+
+# Scaled residual used in place of those of failed simulations
+_FAILED_RESIDUAL = 1e3
+
+
+@dataclass
+class Measurements:
+    # Measurement times (hours)
+    t: np.ndarray
+    # Indices of the measured species
+    species: List[int]
+    # Measured (volume-averaged) concentrations with shape (times, species), in
+    # the units of the growth model; NaN where a species wasn't measured
+    values: np.ndarray
+    # Standard deviation of the measurement errors, for all values, per species
+    # or per value
+    sigma: Union[float, np.ndarray] = 1.0
+
+
+@dataclass
+class McmcResult:
+    # Parameter vectors with shape (steps, walkers, parameters)
+    chain: np.ndarray
+    # Log posterior probability with shape (steps, walkers)
+    log_prob: np.ndarray
+    # Fraction of accepted proposals for each walker
+    acceptance_fraction: np.ndarray
+
+
+class ParameterEstimator:
+    """
+    Fits growth model parameters to measured concentrations.
+
+    The model is compared with the measurements through the volume-weighted
+    mean concentration of each measured species over the compartments. The
+    parameters in fit_params are varied as a vector theta (their logarithms if
+    log_scale, since kinetic parameters are positive and span many orders of
+    magnitude); the rest keep their values from params.
+
+    Candidate parameter sets are simulated in batches by an EnsembleRunner, so
+    they are run in parallel against the same case, and the residuals of every
+    parameter set are cached, so none is simulated twice. Use as a context
+    manager:
+
+        with ParameterEstimator(cm.case, growth_model, params, ["mu_m"],
+                                initial_concentrations, measurements) as est:
+            result = est.least_squares()
+    """
+
+    def __init__(
+        self,
+        case: Case,
+        growth_model: Callable[[float, np.ndarray, dict, Case], np.ndarray],
+        params: dict,
+        fit_params: List[str],
+        initial_concentrations: List[float],
+        measurements: Measurements,
+        growth_jacobian: Optional[
+            Callable[[float, np.ndarray, dict, Case], np.ndarray]
+        ] = None,
+        log_scale: bool = True,
+        max_workers: Optional[int] = None,
+    ):
+        self.case = case
+        self.params = params
+        self.fit_params = list(fit_params)
+        self.initial_concentrations = initial_concentrations
+        self.measurements = measurements
+        self.log_scale = log_scale
+
+        t = np.asarray(measurements.t, dtype=float)
+        self._runner = EnsembleRunner(
+            case,
+            np.max(t),
+            growth_model,
+            growth_jacobian=growth_jacobian,
+            t_eval=t,
+            max_workers=max_workers,
+        )
+        values = np.asarray(measurements.values, dtype=float)
+        self._measured = ~np.isnan(values)
+        self._values = values[self._measured]
+        self._sigma = np.broadcast_to(measurements.sigma, values.shape)[self._measured]
+        self._cache = {}
+        # Number of simulations run
+        self.num_simulations = 0
+
+    def __enter__(self):
+        self._runner.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._runner.close()
+
+    def to_params(self, theta: np.ndarray) -> dict:
+        """Returns the parameter dict for the parameter vector theta."""
+        values = np.exp(theta) if self.log_scale else theta
+        return {
+            **self.params,
+            **{name: float(value) for name, value in zip(self.fit_params, values)},
+        }
+
+    def to_theta(self, params: dict) -> np.ndarray:
+        """Returns the parameter vector of a parameter dict."""
+        values = np.array([params[name] for name in self.fit_params], dtype=float)
+        return np.log(values) if self.log_scale else values
+
+    def residuals(self, thetas: np.ndarray) -> np.ndarray:
+        """
+        Returns the scaled residuals (model - measured) / sigma of each
+        parameter vector in thetas (shape (n, parameters)), with shape
+        (n, measured values). Residuals of failed simulations are NaN.
+        """
+        thetas = np.atleast_2d(np.asarray(thetas, dtype=float))
+        keys = [theta.tobytes() for theta in thetas]
+        new_keys = list(dict.fromkeys(key for key in keys if key not in self._cache))
+        if new_keys:
+            new_thetas = [np.frombuffer(key) for key in new_keys]
+            result = self._runner.run(
+                [self.to_params(theta) for theta in new_thetas],
+                [self.initial_concentrations],
+            )
+            self.num_simulations += len(new_keys)
+            observed = self._observe(result.z, result.v)
+            for key, observed_i in zip(new_keys, observed):
+                model = observed_i[self._measured]
+                self._cache[key] = (model - self._values) / self._sigma
+        return np.array([self._cache[key] for key in keys])
+
+    def log_likelihood(self, thetas: np.ndarray) -> np.ndarray:
+        """Gaussian log likelihood (up to a constant) of each parameter vector."""
+        r = self.residuals(thetas)
+        log_likelihood = -0.5 * np.sum(r**2, axis=1)
+        return np.where(np.isnan(log_likelihood), -np.inf, log_likelihood)
+
+    def least_squares(
+        self,
+        x0: Optional[np.ndarray] = None,
+        bounds: Tuple = (-np.inf, np.inf),
+        diff_step: float = 1e-4,
+        **kwargs,
+    ) -> scipy.optimize.OptimizeResult:
+        """
+        Fits the parameters by nonlinear least squares.
+
+        The Jacobian is estimated by forward differences with relative step
+        diff_step (larger than the solver tolerance, so solver noise doesn't
+        dominate), simulating all perturbed parameter sets in one parallel
+        batch. x0 defaults to the parameters in params, and bounds are in terms
+        of theta. Other keyword arguments are passed to
+        scipy.optimize.least_squares. The fitted parameter dict is in
+        result.params.
+        """
+        if x0 is None:
+            x0 = self.to_theta(self.params)
+
+        def fun(theta):
+            return self._finite(self.residuals(theta)[0])
+
+        def jac(theta):
+            h = diff_step * np.maximum(np.abs(theta), 1)
+            thetas = theta + np.vstack([np.zeros(len(theta)), np.diag(h)])
+            r = self._finite(self.residuals(thetas))
+            return ((r[1:] - r[0]) / h[:, np.newaxis]).T
+
+        result = scipy.optimize.least_squares(fun, x0, jac=jac, bounds=bounds, **kwargs)
+        result.params = self.to_params(result.x)
+        return result
+
+    def mcmc(
+        self,
+        num_walkers: int,
+        num_steps: int,
+        bounds: Tuple[np.ndarray, np.ndarray],
+        x0: Optional[np.ndarray] = None,
+        spread: float = 1e-2,
+        seed: Optional[int] = None,
+    ) -> McmcResult:
+        """
+        Samples the posterior of the parameters with the affine-invariant
+        ensemble sampler of Goodman and Weare (stretch moves).
+
+        The prior is uniform on theta within bounds. Walkers start in a ball of
+        radius spread around x0 (default the parameters in params), and half of
+        the walkers are moved at a time, so the proposals of each half are
+        simulated in one parallel batch. num_walkers must be even and at least
+        twice the number of parameters.
+        """
+        lower, upper = (np.broadcast_to(b, len(self.fit_params)) for b in bounds)
+        num_params = len(self.fit_params)
+        if num_walkers % 2 or num_walkers < 2 * num_params:
+            raise ValueError(
+                "num_walkers must be even and at least twice the number of "
+                "parameters"
+            )
+        rng = np.random.default_rng(seed)
+        if x0 is None:
+            x0 = self.to_theta(self.params)
+
+        def log_prob(thetas):
+            in_bounds = np.all((thetas >= lower) & (thetas <= upper), axis=1)
+            result = np.full(len(thetas), -np.inf)
+            if np.any(in_bounds):
+                result[in_bounds] = self.log_likelihood(thetas[in_bounds])
+            return result
+
+        a = 2.0  # stretch scale
+        walkers = x0 + spread * rng.standard_normal((num_walkers, num_params))
+        walkers = np.clip(walkers, lower, upper)
+        walker_log_prob = log_prob(walkers)
+        halves = [np.arange(num_walkers // 2), np.arange(num_walkers // 2, num_walkers)]
+
+        chain = np.zeros((num_steps, num_walkers, num_params))
+        chain_log_prob = np.zeros((num_steps, num_walkers))
+        accepted = np.zeros(num_walkers)
+        for step in range(num_steps):
+            for active, other in (halves, halves[::-1]):
+                partners = walkers[rng.choice(other, len(active))]
+                z = ((a - 1) * rng.random(len(active)) + 1) ** 2 / a
+                proposals = partners + z[:, np.newaxis] * (walkers[active] - partners)
+                proposal_log_prob = log_prob(proposals)
+                # NaN (never accepted) if both are outside the bounds
+                with np.errstate(invalid="ignore"):
+                    log_accept = (
+                        (num_params - 1) * np.log(z)
+                        + proposal_log_prob
+                        - walker_log_prob[active]
+                    )
+                accept = np.log(rng.random(len(active))) < log_accept
+                walkers[active[accept]] = proposals[accept]
+                walker_log_prob[active[accept]] = proposal_log_prob[accept]
+                accepted[active[accept]] += 1
+            chain[step] = walkers
+            chain_log_prob[step] = walker_log_prob
+
+        return McmcResult(
+            chain=chain,
+            log_prob=chain_log_prob,
+            acceptance_fraction=accepted / max(num_steps, 1),
+        )
+
+    def _observe(self, z: np.ndarray, v: np.ndarray) -> np.ndarray:
+        """
+        Volume-weighted mean concentrations of the measured species, with shape
+        (members, times, species).
+        """
+        z = z[:, :, self.measurements.species, :]
+        return np.sum(z * v, axis=-1) / np.sum(v)
+
+    @staticmethod
+    def _finite(r: np.ndarray) -> np.ndarray:
+        return np.where(np.isfinite(r), r, _FAILED_RESIDUAL)
@@ -0,0 +1,192 @@
+"""Quasi-steady-state elimination of fast species from a growth model"""
+from collections.abc import Callable
+from typing import List, Optional
+
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+from scipy.linalg import lu_factor, lu_solve
+
+from .compartment_model import CompartmentModel
+
+# Number of fast unknowns above which the Newton matrix is factored as sparse
+_SPARSE_MIN_SIZE = 1000
+
+
+class QuasiSteadyState:
+    """
+    Growth model reduced to its slow species.
+
+    Fast species (e.g., dissolved oxygen, which relaxes to equilibrium much
+    faster than the cells grow) are not integrated. Instead, whenever the
+    reduced model is evaluated, their concentrations are solved from the
+    algebraic equations
+
+        growth_f(z) + T @ z_f = 0
+
+    for each fast species f, including transport between compartments (T is
+    the case's transport operator), by Newton's method. The reduced model and
+    its Jacobian have the same signatures as a growth model and growth
+    Jacobian, so they can be solved like the full model.
+    """
+
+    def __init__(
+        self,
+        growth_model: Callable,
+        growth_jacobian: Optional[Callable],
+        fast_species: List[int],
+        num_species: int,
+        transport,
+        atol: float = 1e-12,
+        rtol: float = 1e-8,
+        max_iterations: int = 10,
+    ):
+        self.growth_model = growth_model
+        self.growth_jacobian = growth_jacobian
+        self.fast = list(fast_species)
+        self.slow = [i for i in range(num_species) if i not in self.fast]
+        self.num_species = num_species
+        self.transport = transport
+        # Fast species are solved more accurately than the integrator
+        # tolerance so they don't add noise to the slow rates.
+        self.atol = 1e-3 * atol
+        self.rtol = 1e-3 * rtol
+        self.max_iterations = max_iterations
+
+        self._z_fast = None
+        self._solve_newton = None
+
+    def expand(self, t: float, z_slow: np.ndarray, p: dict, case) -> np.ndarray:
+        """Returns the full state, with fast species at their quasi-steady state."""
+        z, _ = self._solve_fast(t, z_slow, p, case)
+        return z
+
+    def growth(self, t: float, z_slow: np.ndarray, p: dict, case) -> np.ndarray:
+        """Reduced growth model: growth rates of the slow species."""
+        _, growth = self._solve_fast(t, z_slow, p, case)
+        return growth[self.slow]
+
+    def jacobian(self, t: float, z_slow: np.ndarray, p: dict, case) -> np.ndarray:
+        """
+        Local Jacobian of the reduced growth model.
+
+        Fast species respond to the slow ones through the local Schur complement
+        J_ss - J_sf J_ff^-1 J_fs of each compartment, i.e., neglecting transport
+        of the fast species over their (short) relaxation time.
+        """
+        z = self.expand(t, z_slow, p, case)
+        J = self.growth_jacobian(t, z, p, case)
+        J_ss = J[np.ix_(self.slow, self.slow)]
+        J_sf = np.moveaxis(J[np.ix_(self.slow, self.fast)], 2, 0)
+        J_ff = np.moveaxis(J[np.ix_(self.fast, self.fast)], 2, 0)
+        J_fs = np.moveaxis(J[np.ix_(self.fast, self.slow)], 2, 0)
+        correction = J_sf @ np.linalg.solve(J_ff, J_fs)
+        return J_ss - np.moveaxis(correction, 0, 2)
+
+    def error_estimate(
+        self, t: np.ndarray, z: np.ndarray, p: dict, case
+    ) -> np.ndarray:
+        """
+        Estimates the error of the fast species at the output times.
+
+        To first order, the fast species lag their quasi-steady state by
+        A^-1 dz_f/dt, where A is the Jacobian of the fast equations. Returns
+        the largest estimated error over compartments, with shape
+        (times, fast species).
+        """
+        if len(t) < 2:
+            return np.zeros((len(t), len(self.fast)))
+        dz_fast_dt = np.gradient(np.asarray(z[:, self.fast]), t, axis=0)
+        errors = np.zeros((len(t), len(self.fast)))
+        for i in range(len(t)):
+            solve = self._factor_newton_matrix(t[i], np.array(z[i]), p, case)
+            lag = solve(dz_fast_dt[i].ravel()).reshape(dz_fast_dt[i].shape)
+            errors[i] = np.max(np.abs(lag), axis=1)
+        return errors
+
+    def _solve_fast(self, t, z_slow, p, case):
+        """
+        Solves for the fast species by Newton's method, starting from the last
+        solution. Returns the full state and the growth rates there.
+        """
+        z = np.zeros((self.num_species, z_slow.shape[1]))
+        z[self.slow] = z_slow
+        if self._z_fast is not None:
+            z[self.fast] = self._z_fast
+
+        # The Newton matrix is reused between calls, and only refreshed if the
+        # iterations don't converge with it.
+        for refresh in (False, True):
+            if refresh or self._solve_newton is None:
+                self._solve_newton = self._factor_newton_matrix(t, z, p, case)
+            for _ in range(self.max_iterations):
+                growth = self.growth_model(t, z, p, case)
+                residual = growth[self.fast] + (self.transport @ z[self.fast].T).T
+                dz = -self._solve_newton(residual.ravel()).reshape(residual.shape)
+                z[self.fast] += dz
+                scale = self.atol + self.rtol * np.abs(z[self.fast])
+                if np.max(np.abs(dz) / scale) < 1:
+                    self._z_fast = z[self.fast].copy()
+                    return z, growth
+
+        # Not converged; continue from the last iterate and let the solver
+        # reject the step if needed
+        self._z_fast = z[self.fast].copy()
+        return z, self.growth_model(t, z, p, case)
+
+    def _fast_jacobian_blocks(self, t, z, p, case):
+        """Local Jacobian of the fast rates with respect to the fast species."""
+        if self.growth_jacobian is not None:
+            J = self.growth_jacobian(t, z, p, case)
+            return J[np.ix_(self.fast, self.fast)]
+
+        # Growth is local to each compartment, so perturbing one species in
+        # every compartment at once gives a column of every block.
+        f = self.growth_model(t, z, p, case)[self.fast]
+        J_ff = np.zeros((len(self.fast), len(self.fast), z.shape[1]))
+        for j, species in enumerate(self.fast):
+            h = np.sqrt(np.finfo(float).eps) * np.maximum(np.abs(z[species]), 1)
+            z_h = z.copy()
+            z_h[species] += h
+            J_ff[:, j, :] = (self.growth_model(t, z_h, p, case)[self.fast] - f) / h
+        return J_ff
+
+    def _factor_newton_matrix(self, t, z, p, case):
+        """Returns a function solving A x = b for the fast equations' Jacobian A."""
+        num_fast = len(self.fast)
+        num_compartments = z.shape[1]
+        J_ff = self._fast_jacobian_blocks(t, z, p, case)
+        rows, cols = CompartmentModel._get_block_indices(num_fast, num_compartments)
+        size = num_fast * num_compartments
+        A = sp.csc_matrix((J_ff.ravel(), (rows, cols)), shape=(size, size)) + sp.kron(
+            sp.identity(num_fast), sp.csr_matrix(self.transport), "csc"
+        )
+        if size < _SPARSE_MIN_SIZE:
+            lu = lu_factor(A.toarray())
+            return lambda b: lu_solve(lu, b)
+        return spla.splu(A).solve
+
+
+class QuasiSteadyStateOutput:
+    """Writes full states to an output, given states of the reduced model."""
+
+    def __init__(self, output, quasi_steady_state: QuasiSteadyState, p: dict, case):
+        self.output = output
+        self.quasi_steady_state = quasi_steady_state
+        self.p = p
+        self.case = case
+
+    def write(self, t: np.ndarray, y: np.ndarray) -> None:
+        num_slow = len(self.quasi_steady_state.slow)
+        y_full = np.array(
+            [
+                self.quasi_steady_state.expand(
+                    t_i, y_i.reshape(num_slow, -1), self.p, self.case
+                ).ravel()
+                for t_i, y_i in zip(t, y)
+            ]
+        )
+        self.output.write(t, y_full)
+
+    def flush(self) -> None:
+        self.output.flush()
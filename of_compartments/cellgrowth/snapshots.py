@@ -0,0 +1,139 @@
+"""Cases whose flow and compartment data change over time, from CFD snapshots"""
+import dataclasses
+from typing import Dict, List, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+INTERPOLATIONS = ["linear", "previous"]
+
+# CompartmentData fields that aren't interpolated between snapshots
+_FIXED_FIELDS = ["ids", "is_top", "volumes"]
+
+
+class InterpolatedOperator:
+    """(1 - weight) * A + weight * B, applied without forming the sum."""
+
+    def __init__(self, A, B, weight: float):
+        self.A = A
+        self.B = B
+        self.weight = weight
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.A.shape
+
+    def __matmul__(self, x: np.ndarray) -> np.ndarray:
+        return (1 - self.weight) * (self.A @ x) + self.weight * (self.B @ x)
+
+
+class CaseSnapshots:
+    """
+    Cases of a time-varying flow field, from CFD snapshots at different times
+    (e.g., after changes in aeration or agitation).
+
+    Snapshot i applies from times[i] (hours). Between snapshot times the case
+    is interpolated linearly ("linear"), or the latest snapshot is used
+    ("previous"); before the first and after the last time, the first and last
+    snapshots are used. Each snapshot's transport operator is computed once,
+    and between snapshots both are applied (see InterpolatedOperator), so no
+    matrices are built while the model is evaluated.
+
+    The compartment volumes must be the same in all snapshots: the model has no
+    dilution term for compartments whose volume changes over time.
+    """
+
+    def __init__(self, times: List[float], cases: List, interpolation: str = "linear"):
+        times = np.asarray(times, dtype=float)
+        if len(times) != len(cases) or len(cases) == 0:
+            raise ValueError("need one snapshot time per case")
+        if np.any(np.diff(times) <= 0):
+            raise ValueError("snapshot times must be increasing")
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(
+                f"invalid interpolation {interpolation}, should be one of "
+                f"{INTERPOLATIONS}"
+            )
+        ids = list(cases[0].compartment_data.ids)
+        for time, case in zip(times, cases):
+            if list(case.compartment_data.ids) != ids:
+                raise ValueError(f"snapshot at t={time} has different compartments")
+            if not np.allclose(
+                case.compartment_data.volumes, cases[0].compartment_data.volumes
+            ):
+                raise ValueError(
+                    f"snapshot at t={time} has different compartment volumes"
+                )
+        self.times = times
+        self.cases = cases
+        self.interpolation = interpolation
+        # Last interpolated case, as the solver evaluates the model at the same
+        # time repeatedly
+        self._last_t = None
+        self._last_case = None
+        self._transport_jacobians: Dict[int, List[sp.csr_matrix]] = {}
+
+    def weights(self, t: float) -> Tuple[int, float]:
+        """Returns i and w such that the case at t is (1 - w) case i + w case i+1."""
+        i = np.searchsorted(self.times, t, side="right") - 1
+        if i < 0:
+            return 0, 0.0
+        if i == len(self.times) - 1 or self.interpolation == "previous":
+            return i, 0.0
+        return i, (t - self.times[i]) / (self.times[i + 1] - self.times[i])
+
+    def at(self, t: float):
+        """Returns the case at time t (hours)."""
+        i, w = self.weights(t)
+        if w == 0:
+            return self.cases[i]
+        if t == self._last_t:
+            return self._last_case
+
+        a, b = self.cases[i], self.cases[i + 1]
+
+        def interpolate(x, y):
+            return (1 - w) * np.asarray(x) + w * np.asarray(y)
+
+        compartment_data = dataclasses.replace(
+            a.compartment_data,
+            **{
+                field.name: interpolate(
+                    getattr(a.compartment_data, field.name),
+                    getattr(b.compartment_data, field.name),
+                )
+                for field in dataclasses.fields(a.compartment_data)
+                if field.name not in _FIXED_FIELDS
+            },
+        )
+        case = dataclasses.replace(
+            a,
+            F=InterpolatedOperator(a.F, b.F, w),
+            k_d=interpolate(a.k_d, b.k_d),
+            compartment_data=compartment_data,
+            transport=InterpolatedOperator(a.transport, b.transport, w),
+        )
+        self._last_t = t
+        self._last_case = case
+        return case
+
+    def transport_jacobians(self, num_species: int) -> List[sp.csr_matrix]:
+        """Returns the block diagonal transport matrix of each snapshot."""
+        if num_species not in self._transport_jacobians:
+            self._transport_jacobians[num_species] = [
+                sp.kron(sp.identity(num_species), sp.csr_matrix(case.transport), "csr")
+                for case in self.cases
+            ]
+        return self._transport_jacobians[num_species]
+
+    def transport_jacobian(self, t: float, num_species: int) -> sp.csr_matrix:
+        """Returns the block diagonal transport matrix at time t."""
+        jacobians = self.transport_jacobians(num_species)
+        i, w = self.weights(t)
+        if w == 0:
+            return jacobians[i]
+        return (1 - w) * jacobians[i] + w * jacobians[i + 1]
+
+    def replace_cases(self, cases: List) -> "CaseSnapshots":
+        """Returns snapshots at the same times with the given cases."""
+        return CaseSnapshots(self.times, cases, self.interpolation)
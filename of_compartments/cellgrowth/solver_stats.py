@@ -0,0 +1,93 @@
+"""Statistics and progress reporting of the solvers"""
+import sys
+from collections.abc import Callable
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+@dataclass
+class SolverStats:
+    # Evaluations of the right-hand side (including those for finite
+    # difference Jacobians)
+    nfev: int = 0
+    # Jacobian evaluations
+    njev: int = 0
+    # LU decompositions
+    nlu: int = 0
+    # Accepted and rejected steps
+    n_accepted: int = 0
+    n_rejected: int = 0
+    # Wall time (seconds) of the whole solve, and of the growth model
+    # (including its Jacobian) and transport within it
+    wall_time: float = 0.0
+    growth_time: float = 0.0
+    transport_time: float = 0.0
+    # Peak resident memory of the process (bytes), if available
+    peak_memory: Optional[int] = None
+
+    @property
+    def overhead_time(self) -> float:
+        """Wall time spent in the solver itself (linear algebra, output, etc.)"""
+        return self.wall_time - self.growth_time - self.transport_time
+
+
+def timed(fun: Callable, stats: SolverStats, attribute: str) -> Callable:
+    """Wraps fun to add the wall time of each call to an attribute of stats."""
+
+    def timed_fun(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return fun(*args, **kwargs)
+        finally:
+            setattr(stats, attribute, getattr(stats, attribute) + perf_counter() - start)
+
+    return timed_fun
+
+
+def peak_memory() -> Optional[int]:
+    """Returns the peak resident memory of this process in bytes."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class ProgressReporter:
+    """
+    Reports the progress of an integration.
+
+    Called with the solver (or any object with the current time as t) after
+    every step; calls progress(t, time, rate) at most every interval seconds of
+    wall time, and at the end, where t is the current simulation time, time is
+    the end time, and rate is the average number of simulated hours per wall
+    second since t0.
+    """
+
+    def __init__(
+        self,
+        progress: Callable[[float, float, float], None],
+        t0: float,
+        time: float,
+        interval: float = 1.0,
+    ):
+        self.progress = progress
+        self.t0 = t0
+        self.time = time
+        self.interval = interval
+        self._start = perf_counter()
+        self._last_report = self._start
+
+    def __call__(self, solver, final: bool = False) -> None:
+        now = perf_counter()
+        if final or now - self._last_report >= self.interval:
+            elapsed = now - self._start
+            rate = (solver.t - self.t0) / elapsed if elapsed > 0 else 0.0
+            self.progress(solver.t, self.time, rate)
+            self._last_report = now
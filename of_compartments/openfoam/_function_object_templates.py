@@ -181,8 +181,9 @@ def _create_vol_field_value(name, zone, fields):
     """
 
 
-def create_tau(zone):
-    return _create_vol_field_value("tau", zone, ["tau_s"])
+def create_cell_values(zone, fields):
+    """Write the per-cell values of fields in the zone"""
+    return _create_vol_field_value("cellValues", zone, fields)
 
 
 def create_interface_area(boundary_name):
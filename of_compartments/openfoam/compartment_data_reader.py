@@ -1,12 +1,13 @@
 """Reads data from openfoam function object output"""
 import os
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from of_compartments import utils
 
-from . import COMPARTMENT_AVERAGE_FIELDS
+from . import COMPARTMENT_AVERAGE_FIELDS, field_reader
 
 _FLOW_FORMAT = "flux_data_{phase}.csv"
 _VOL_AVG_FORMAT = "{case_dir}/postProcessing/volAvg_{zone}/{t}/volFieldValue.dat"
@@ -14,26 +15,95 @@ _AREA_FORMAT = (
     "{case_dir}/postProcessing/area_{zone1}_{zone2}/{t}/surfaceFieldValue.dat"
 )
 # not in postProcessing
+_CELL_FIELD_FORMAT = "{case_dir}/{t}/{field}_cellZone-{zone}_zone"
 _TAU_FORMAT = "{case_dir}/{t}/tau_s_cellZone-{zone}_zone"
 _CELL_VOLUME_FORMAT = "{case_dir}/{t}/V_cellZone-{zone}_zone"
+_BOUNDARY_ZONE_FORMAT = "boundary_{zone1}_{zone2}_zone"
+_BOUNDARY_ZONE_TOP_FORMAT = "boundary_{zone}_top_zone"
+# Zones of boundary_{zone1}_{zone2}_zone (zone ids don't contain "_")
+_BOUNDARY_ZONE_PATTERN = r"^boundary_([^_]+)_([^_]+)_zone$"
 
 
 def _read_area_from_file(file_name):
     # Area is third line in file
-    file_name = file_name.replace("(", "\\(").replace(")", "\\)")
-    area = float(
-        subprocess.check_output(f"sed '3q;d' {file_name}", shell=True)
-        .strip()
-        .split(b" ")[-1]
+    return _read_header_value(file_name, 2)
+
+
+def _read_header_value(file_name, line_number):
+    """Returns the number at the end of a header line (e.g., "# Volume : 1e-3")."""
+    with open(file_name, "r") as f:
+        for i, line in enumerate(f):
+            if i == line_number:
+                return float(line.split()[-1])
+    raise ValueError(f"{file_name} has no line {line_number + 1}")
+
+
+def _parse_vol_field_value(file_name):
+    """
+    Returns the volume and the first row of averages, in the order of
+    COMPARTMENT_AVERAGE_FIELDS, of a volFieldValue.dat file, reading it once.
+
+    The file has a header of "#" lines, the third of which is the volume,
+    followed by a row per time of the time and the averages.
+    """
+    volume = None
+    with open(file_name, "r") as f:
+        for i, line in enumerate(f):
+            if line.startswith("#"):
+                if i == 2:
+                    volume = float(line.split()[-1])
+                continue
+            values = line.split()
+            if not values:
+                continue
+            if volume is None:
+                raise ValueError(f"no volume in {file_name}")
+            averages = [float(value) for value in values[1:]]
+            if len(averages) != len(COMPARTMENT_AVERAGE_FIELDS):
+                raise ValueError(
+                    f"expected {len(COMPARTMENT_AVERAGE_FIELDS)} averages in "
+                    f"{file_name}, found {len(averages)}"
+                )
+            return volume, averages
+    raise ValueError(f"no averages in {file_name}")
+
+
+def map_zones(read, zones, max_workers=None):
+    """
+    Returns [read(zone) for zone in zones], reading up to max_workers zones at
+    a time in a thread pool (the ThreadPoolExecutor default if None), so the
+    latency of each zone's files overlaps. max_workers=1 reads sequentially.
+    """
+    if max_workers == 1 or len(zones) <= 1:
+        return [read(zone) for zone in zones]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(read, zones))
+
+
+def read_vol_avg(zones, time, case_dir, max_workers=None):
+    """
+    Returns the volume averages (COMPARTMENT_AVERAGE_FIELDS) and the volume
+    (m^3) of each zone, as a DataFrame indexed by zone, reading each zone's
+    volFieldValue.dat once (up to max_workers zones at a time).
+    """
+
+    def read(zone):
+        file_name = _VOL_AVG_FORMAT.format(zone=zone, t=time, case_dir=case_dir)
+        return _parse_vol_field_value(file_name)
+
+    values = np.zeros((len(zones), len(COMPARTMENT_AVERAGE_FIELDS) + 1))
+    for i, (volume, averages) in enumerate(map_zones(read, zones, max_workers)):
+        values[i, :-1] = averages
+        values[i, -1] = volume
+    return pd.DataFrame(
+        values,
+        index=pd.Index(zones, name="zone"),
+        columns=COMPARTMENT_AVERAGE_FIELDS + ["volume"],
     )
-    return area
 
 
 def _read_vol_avg_field(zone, time, case_dir, field):
-    file_name = _VOL_AVG_FORMAT.format(zone=zone, t=time, case_dir=case_dir)
-    vol_avg = pd.read_csv(file_name, sep="\t", skiprows=3)
-    vol_avg.columns = ["Time"] + COMPARTMENT_AVERAGE_FIELDS
-    return float(vol_avg.iloc[0][field])
+    return float(read_vol_avg([zone], time, case_dir)[field].iloc[0])
 
 
 def read_gas_holdup(zone, time, case_dir):
@@ -52,23 +122,36 @@ def read_epsilon(zone, time, case_dir):
     return _read_vol_avg_field(zone, time, case_dir, "epsilonMean.water")
 
 
+def _zone_indices(zone_index, ids):
+    """Returns the positions of ids in zone_index (a pd.Index of the zones)"""
+    indices = zone_index.get_indexer(ids)
+    if (indices < 0).any():
+        missing = np.asarray(ids, dtype=object)[indices < 0]
+        raise ValueError(f"{', '.join(map(str, missing))} not in zones")
+    return indices
+
+
 def read_top_gas_flux(zones, case_dir):
     "Returns volumetric flow of gas through top of each compartment"
 
     file_name = os.path.join(case_dir, _FLOW_FORMAT.format(phase="air"))
-    BOUNDARY_ZONE_FORMAT = "boundary_{zone1}_{zone2}_zone"
-    BOUNDARY_ZONE_TOP_FORMAT = "boundary_{zone}_top_zone"
     top_gas_flux = np.zeros(len(zones))
 
     try:
-        flow_rate = pd.read_csv(file_name, index_col=3)
-        for zone1, zone2 in utils.get_compartment_lower_upper_pairs_by_name(zones):
-            name = BOUNDARY_ZONE_FORMAT.format(zone1=zone1, zone2=zone2)
-            top_gas_flux[zones.index(zone1)] = flow_rate.loc[name]["flux_pos"]
-
-        for top_zone in utils.get_top_compartments_by_id(zones):
-            name = BOUNDARY_ZONE_TOP_FORMAT.format(zone=top_zone)
-            top_gas_flux[zones.index(top_zone)] = flow_rate.loc[name]["flux_pos"]
+        flux_pos = pd.read_csv(file_name, index_col=3)["flux_pos"]
+        zone_index = pd.Index(zones)
+        lower_upper = utils.get_compartment_lower_upper_pairs_by_name(zones)
+        if lower_upper:
+            lower = [zone1 for zone1, _ in lower_upper]
+            names = [
+                _BOUNDARY_ZONE_FORMAT.format(zone1=zone1, zone2=zone2)
+                for zone1, zone2 in lower_upper
+            ]
+            top_gas_flux[_zone_indices(zone_index, lower)] = flux_pos.loc[names]
+
+        top_zones = utils.get_top_compartments_by_id(zones)
+        names = [_BOUNDARY_ZONE_TOP_FORMAT.format(zone=zone) for zone in top_zones]
+        top_gas_flux[_zone_indices(zone_index, top_zones)] = flux_pos.loc[names]
 
     except FileNotFoundError:
         print("no flow found")
@@ -76,35 +159,59 @@ def read_top_gas_flux(zones, case_dir):
     return top_gas_flux
 
 
-def read_flow(zones, case_dir, phase):
-    "Returns volumetric flow"
-    file_name = os.path.join(case_dir, _FLOW_FORMAT.format(phase=phase))
-    BOUNDARY_ZONE_FORMAT = "boundary_{zone1}_{zone2}_zone"
-    flow_matrix = np.zeros((len(zones), len(zones)))
-
-    try:
-        flow_rate = pd.read_csv(file_name, index_col=3)
+def _read_boundary_flows(file_name, zones):
+    """
+    Returns the flows between zones through each boundary in file_name, as
+    arrays of source and destination zone positions and flows, with a single
+    entry per direction (if both boundary_a_b_zone and boundary_b_a_zone are
+    given, the one whose first zone comes later in zones is used).
+    """
+    flow_rate = pd.read_csv(file_name, index_col=3)
+    pairs = flow_rate.index.to_series().str.extract(_BOUNDARY_ZONE_PATTERN)
+    zone_index = pd.Index(zones)
+    src = zone_index.get_indexer(pairs[0])
+    dest = zone_index.get_indexer(pairs[1])
+    boundaries = np.flatnonzero((src >= 0) & (dest >= 0) & (src != dest))
+    boundaries = boundaries[np.argsort(src[boundaries], kind="stable")]
+    src, dest = src[boundaries], dest[boundaries]
+
+    # flux_pos flows from the first zone of the name to the second
+    rows = np.r_[src, dest]
+    cols = np.r_[dest, src]
+    flows = np.r_[
+        flow_rate["flux_pos"].to_numpy(dtype=float)[boundaries],
+        np.abs(flow_rate["flux_neg"].to_numpy(dtype=float)[boundaries]),
+    ]
+
+    # Keep the entry of each (row, col) from the last boundary
+    boundary = np.r_[np.arange(len(boundaries)), np.arange(len(boundaries))]
+    latest_first = np.argsort(-boundary, kind="stable")
+    _, first = np.unique(
+        rows[latest_first] * len(zones) + cols[latest_first], return_index=True
+    )
+    last = latest_first[first]
+    return rows[last], cols[last], flows[last]
 
-        for i in range(len(zones)):
-            for j in range(len(zones)):
-                if i == j:
-                    continue
 
-                forward_name = BOUNDARY_ZONE_FORMAT.format(
-                    zone1=zones[i], zone2=zones[j]
-                )
-                backward_name = BOUNDARY_ZONE_FORMAT.format(
-                    zone1=zones[j], zone2=zones[i]
-                )
-                if forward_name in flow_rate.index:
-                    flow_matrix[i, j] = flow_rate.loc[forward_name]["flux_pos"]
-                    flow_matrix[j, i] = abs(flow_rate.loc[forward_name]["flux_neg"])
-                elif backward_name in flow_rate.index:
-                    flow_matrix[i, j] = abs(flow_rate.loc[backward_name]["flux_neg"])
-                    flow_matrix[j, i] = flow_rate.loc[backward_name]["flux_pos"]
+def read_flow(zones, case_dir, phase, sparse=False):
+    """
+    Returns volumetric flow, F[i, j] from zones[i] to zones[j], as an array or,
+    if sparse, as a scipy.sparse csr_matrix with entries only for boundaries
+    between zones
+    """
+    file_name = os.path.join(case_dir, _FLOW_FORMAT.format(phase=phase))
+    shape = (len(zones), len(zones))
+    try:
+        rows, cols, flows = _read_boundary_flows(file_name, zones)
     except FileNotFoundError:
         print("no flow found")
+        rows = cols = np.zeros(0, dtype=int)
+        flows = np.zeros(0)
 
+    if sparse:
+        return sp.csr_matrix((flows, (rows, cols)), shape=shape)
+    flow_matrix = np.zeros(shape)
+    flow_matrix[rows, cols] = flows
     return flow_matrix
 
 
@@ -112,27 +219,32 @@ def read_volume(zone, time, case_dir):
     """Returns volume of given zone (m^3)"""
     file_name = _VOL_AVG_FORMAT.format(zone=zone, t=time, case_dir=case_dir)
     # Volume is third line in file
-    volume = float(
-        subprocess.check_output(f"sed '3q;d' {file_name}", shell=True)
-        .strip()
-        .split(b" ")[-1]
-    )
-    return volume
+    return _read_header_value(file_name, 2)
 
 
 def read_cell_volumes(zone, time, case_dir):
-    """Returns list of volumes of all cells in zone (m^3)"""
+    """Returns array of volumes of all cells in zone (m^3)"""
     file_name = _CELL_VOLUME_FORMAT.format(zone=zone, t=time, case_dir=case_dir)
-    volumes = pd.read_fwf(file_name, skiprows=18).iloc[:-2]
-    volumes = list(map(float, volumes["("]))
-    return volumes
+    return field_reader.read_field(file_name)
+
+
+def read_cell_values(zone, time, field, case_dir):
+    """Returns array of values of field in all cells in zone"""
+    file_name = _CELL_FIELD_FORMAT.format(
+        field=field, zone=zone, t=time, case_dir=case_dir
+    )
+    return field_reader.read_field(file_name)
+
+
+def tau_threshold_fraction(shear, volumes, threshold):
+    """Returns the volume fraction where shear stress is above threshold"""
+    volumes = np.asarray(volumes)
+    return volumes @ (np.asarray(shear) > threshold) / np.sum(volumes)
 
 
 def read_tau_threshold_fraction(zone, time, threshold, case_dir):
     """Returns the volume fraction where shear stress is above threshold"""
     file_name = _TAU_FORMAT.format(t=time, zone=zone, case_dir=case_dir)
-    shear = pd.read_csv(file_name, skiprows=18).iloc[:-2]
-    shear = list(map(float, shear["("]))
-    cells_above_threshold = list(map(lambda x: 1 if x > threshold else 0, shear))
+    shear = field_reader.read_field(file_name)
     volumes = read_cell_volumes(zone, time, case_dir)
-    return np.mean(np.array(cells_above_threshold) * np.array(volumes))
+    return tau_threshold_fraction(shear, volumes, threshold)
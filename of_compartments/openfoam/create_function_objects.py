@@ -39,8 +39,11 @@ def _write_compartment_value_control_dict(compartments, case_dir):
         functions_str += fot.create_volume_average(
             compartment.id, COMPARTMENT_AVERAGE_FIELDS
         )
-        # Write per-cell values for fields to calculate volume fractions
-        functions_str += fot.create_tau(compartment.id)
+        # Write per-cell values for fields to calculate volume fractions and
+        # distributions
+        functions_str += fot.create_cell_values(
+            compartment.id, COMPARTMENT_AVERAGE_FIELDS
+        )
         functions_str += fot.create_volume(compartment.id)
 
     # Write to new controlDict
@@ -0,0 +1,245 @@
+"""Volume-weighted distributions of fields within each compartment"""
+import warnings
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import of_compartments.openfoam.compartment_data_reader as cdr
+import pandas as pd
+
+from . import COMPARTMENT_AVERAGE_FIELDS
+
+FIELD_DISTRIBUTIONS_FILE = "field_distributions.csv"
+
+
+def volume_weighted_quantiles(
+    values: np.ndarray, volumes: np.ndarray, levels: np.ndarray
+) -> np.ndarray:
+    """
+    Returns the values below which the given fractions (levels) of the volume
+    lie, i.e., for each level the smallest value whose cell, together with the
+    cells with lower values, holds at least that fraction of the volume. Level
+    0 gives the minimum and level 1 the maximum (of the cells with volume).
+    NaN if there are no cells.
+
+    Args:
+        values: Value of each cell.
+        volumes: Volume of each cell.
+        levels: Volume fractions, in [0, 1].
+    """
+    values = np.asarray(values, dtype=float).ravel()
+    volumes = np.broadcast_to(np.asarray(volumes, dtype=float), values.shape)
+    levels = np.asarray(levels, dtype=float)
+    if len(values) == 0:
+        return np.full(levels.shape, np.nan)
+    order = np.argsort(values, kind="stable")
+    cumulative = np.cumsum(volumes[order])
+    cumulative /= cumulative[-1]
+    indices = np.searchsorted(cumulative, levels, side="left")
+    # Level 0 is the minimum (even if the first cells have no volume)
+    indices[levels <= 0] = 0
+    return values[order][np.minimum(indices, len(values) - 1)]
+
+
+class FieldDistributions:
+    """
+    Sketches of the volume-weighted distribution of fields in each compartment.
+
+    Each field is stored as its volume-weighted quantiles at evenly spaced
+    levels (fractions of the compartment volume), so volume fractions above a
+    threshold and percentiles can be evaluated for any threshold without the
+    per-cell data. Between the stored quantiles the distribution is linearly
+    interpolated, so with num_levels levels the fractions are within
+    1 / (num_levels - 1) of the per-cell values.
+
+    Args:
+        compartments: Compartment ids.
+        levels: Volume fractions of the quantiles, increasing from 0 to 1.
+        quantiles: Dict mapping each field name to an array (compartments,
+            levels) of its quantiles.
+    """
+
+    def __init__(
+        self, compartments: Sequence[str], levels: np.ndarray, quantiles: dict
+    ):
+        self.compartments = list(compartments)
+        self.levels = np.asarray(levels, dtype=float)
+        self.quantiles = {
+            field: np.asarray(values, dtype=float)
+            for field, values in quantiles.items()
+        }
+        for field, values in self.quantiles.items():
+            if values.shape != (len(self.compartments), len(self.levels)):
+                raise ValueError(
+                    f"{field} quantiles have shape {values.shape}, expected "
+                    f"{(len(self.compartments), len(self.levels))}"
+                )
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self.quantiles)
+
+    def fraction_below(self, field: str, threshold) -> np.ndarray:
+        """
+        Returns the volume fraction of each compartment where field is at most
+        threshold (a scalar, or an array broadcasting against the
+        compartments).
+        """
+        q = self.quantiles[field]
+        threshold = np.broadcast_to(
+            np.asarray(threshold, dtype=float), (len(self.compartments),)
+        )
+        # q[i] <= threshold < q[i + 1] (the last of equal quantiles)
+        i = np.sum(q <= threshold[:, np.newaxis], axis=1)
+        below = i > 0
+        inside = below & (i < len(self.levels))
+        fraction = np.where(below, 1.0, 0.0)
+        rows = np.flatnonzero(inside)
+        lo, hi = i[rows] - 1, i[rows]
+        q_lo, q_hi = q[rows, lo], q[rows, hi]
+        fraction[rows] = self.levels[lo] + (self.levels[hi] - self.levels[lo]) * (
+            threshold[rows] - q_lo
+        ) / (q_hi - q_lo)
+        fraction[np.isnan(q[:, 0])] = np.nan
+        return fraction
+
+    def fraction_above(self, field: str, threshold) -> np.ndarray:
+        """
+        Returns the volume fraction of each compartment where field is above
+        threshold (e.g., the high shear fraction for a shear threshold).
+        """
+        return 1 - self.fraction_below(field, threshold)
+
+    def quantile(self, field: str, level) -> np.ndarray:
+        """
+        Returns the value of field in each compartment below which the volume
+        fraction level lies (e.g., 0.99 for the 99th percentile).
+        """
+        q = self.quantiles[field]
+        return np.array([np.interp(level, self.levels, row) for row in q])
+
+    def to_csv(self, file_name: str) -> None:
+        """Writes a row per compartment and field, with a column per level."""
+        rows = []
+        for field, values in self.quantiles.items():
+            columns = [f"{level:.10g}" for level in self.levels]
+            df = pd.DataFrame(values, columns=columns)
+            df.insert(0, "field", field)
+            df.insert(0, "compartment", self.compartments)
+            rows.append(df)
+        pd.concat(rows, ignore_index=True).to_csv(file_name, index=False)
+
+    @classmethod
+    def from_csv(cls, file_name: str) -> "FieldDistributions":
+        """Reads distributions written by to_csv."""
+        df = pd.read_csv(
+            file_name, dtype={"compartment": str}, float_precision="round_trip"
+        )
+        level_columns = [
+            column for column in df.columns if column not in ("compartment", "field")
+        ]
+        fields = list(dict.fromkeys(df["field"]))
+        compartments = list(df.loc[df["field"] == fields[0], "compartment"])
+        quantiles = {}
+        for field in fields:
+            rows = df[df["field"] == field].set_index("compartment")
+            quantiles[field] = rows.loc[compartments, level_columns].to_numpy()
+        return cls(compartments, [float(c) for c in level_columns], quantiles)
+
+
+def read_field_distributions(
+    zones: Sequence[str],
+    time,
+    case_dir: str,
+    fields: Optional[Sequence[str]] = None,
+    num_levels: int = 101,
+    max_workers: Optional[int] = None,
+) -> FieldDistributions:
+    """
+    Returns the volume-weighted distributions of fields in each zone, from the
+    per-cell values and volumes written by the compartment function objects.
+    Fields without per-cell values in some zone (e.g., in cases post-processed
+    before they were written) are left out, with a warning.
+
+    Args:
+        zones: Zone (compartment) ids.
+        time: Simulation time of the data.
+        case_dir: OpenFOAM case directory.
+        fields: Fields to read (by default COMPARTMENT_AVERAGE_FIELDS).
+        num_levels: Number of stored quantiles, evenly spaced from 0 to 1.
+        max_workers: Number of zones read at a time (see cdr.map_zones).
+    """
+    return read_cell_data(
+        zones,
+        time,
+        case_dir,
+        fields=fields,
+        num_levels=num_levels,
+        max_workers=max_workers,
+    )[0]
+
+
+def read_cell_data(
+    zones: Sequence[str],
+    time,
+    case_dir: str,
+    high_shear_threshold: Optional[float] = None,
+    fields: Optional[Sequence[str]] = None,
+    num_levels: int = 101,
+    max_workers: Optional[int] = None,
+) -> Tuple[FieldDistributions, Optional[np.ndarray]]:
+    """
+    Returns the distributions of fields in each zone (see
+    read_field_distributions) and, if high_shear_threshold is given, the volume
+    fraction of each zone where tau_s is above it (see
+    cdr.tau_threshold_fraction), reading each per-cell file once.
+    """
+    if fields is None:
+        fields = COMPARTMENT_AVERAGE_FIELDS
+    levels = np.linspace(0, 1, num_levels)
+
+    def read(zone):
+        volumes = cdr.read_cell_volumes(zone, time, case_dir)
+        quantiles = {}
+        high_shear_fraction = None
+        for field in fields:
+            try:
+                values = cdr.read_cell_values(zone, time, field, case_dir)
+            except FileNotFoundError:
+                continue
+            quantiles[field] = volume_weighted_quantiles(values, volumes, levels)
+            if field == "tau_s" and high_shear_threshold is not None:
+                high_shear_fraction = cdr.tau_threshold_fraction(
+                    values, volumes, high_shear_threshold
+                )
+        if high_shear_threshold is not None and high_shear_fraction is None:
+            high_shear_fraction = cdr.read_tau_threshold_fraction(
+                zone, time, high_shear_threshold, case_dir
+            )
+        return quantiles, high_shear_fraction
+
+    results = cdr.map_zones(read, list(zones), max_workers)
+    available = [
+        field
+        for field in fields
+        if all(field in quantiles for quantiles, _ in results)
+    ]
+    missing = [field for field in fields if field not in available]
+    if missing:
+        warnings.warn(
+            f"no per-cell values of {', '.join(missing)} in some compartments "
+            f"at time {time}, leaving them out of the field distributions"
+        )
+    distributions = FieldDistributions(
+        zones,
+        levels,
+        {
+            field: np.array([quantiles[field] for quantiles, _ in results]).reshape(
+                len(zones), num_levels
+            )
+            for field in available
+        },
+    )
+    high_shear_fractions = None
+    if high_shear_threshold is not None:
+        high_shear_fractions = np.array([fraction for _, fraction in results])
+    return distributions, high_shear_fractions
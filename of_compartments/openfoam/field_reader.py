@@ -0,0 +1,234 @@
+"""Reads OpenFOAM field files (e.g., per-cell values written by function objects)"""
+import gzip
+import mmap
+import os
+import re
+from typing import Optional
+
+import numpy as np
+
+# Number of components of each type of list element
+_COMPONENTS = {
+    "scalar": 1,
+    "label": 1,
+    "vector": 3,
+    "symmTensor": 6,
+    "tensor": 9,
+    "sphericalTensor": 1,
+}
+
+# Element type of field classes (e.g., vectorField, volVectorField, labelList)
+_CLASS_TYPE = re.compile(
+    r"(?:vol|surface|point)?(scalar|label|vector|symmTensor|tensor|sphericalTensor)"
+    r"(?:Field|List)",
+    re.IGNORECASE,
+)
+
+_HEADER = re.compile(rb"\bFoamFile\s*\{(.*?)\}", re.DOTALL)
+_HEADER_ENTRY = re.compile(rb'(\w+)\s+("[^"]*"|[^;]*);')
+_SPACE_AND_COMMENTS = re.compile(rb"(?:\s+|//[^\n]*|/\*.*?\*/)*", re.DOTALL)
+_INTERNAL_FIELD = re.compile(rb"\binternalField\b")
+_TOKEN = re.compile(rb"[^\s;({]+")
+_LIST_TYPE = re.compile(rb"List<(\w+)>")
+# Closing parentheses of the last vector or tensor and of the list
+_LIST_END = re.compile(rb"\)\s*\)")
+# Parentheses of vectors and tensors, dropped before parsing their components
+_NO_PARENTHESES = bytes.maketrans(b"()", b"  ")
+
+
+def read_field_header(file_name: str) -> dict:
+    """Returns the entries of the FoamFile header of a field file."""
+    with _FieldBuffer(file_name) as buffer:
+        return _parse_header(buffer)[0]
+
+
+def read_field(file_name: str, size: Optional[int] = None) -> np.ndarray:
+    """
+    Returns the values of an OpenFOAM field file.
+
+    Reads the internalField of geometric fields (e.g., volScalarField), or the
+    list of plain field files (e.g., scalarField), in ascii or binary format,
+    optionally gzip-compressed (file_name ending in .gz, or found with .gz
+    added). Uncompressed files are memory-mapped, and the list is converted
+    directly from the mapped bytes. Scalar and label fields have shape
+    (values,); vectors and tensors have a column per component.
+
+    Args:
+        file_name: Path of the field file.
+        size: Number of values of uniform fields, which don't store it. If not
+            given, a uniform field is returned as a 0-d array.
+    """
+    with _FieldBuffer(file_name) as buffer:
+        header, pos = _parse_header(buffer)
+        binary = header.get("format", "ascii") == "binary"
+        element_type = _element_type(header.get("class", "").strip('"'))
+
+        match = _INTERNAL_FIELD.search(buffer, pos)
+        if match is not None:
+            pos = _skip(buffer, match.end())
+            token, pos = _token(buffer, pos)
+            if token == b"uniform":
+                return _uniform(buffer, pos, element_type, size, file_name)
+            if token != b"nonuniform":
+                raise ValueError(f"invalid internalField in {file_name}")
+            token, pos = _token(buffer, _skip(buffer, pos))
+            list_type = _LIST_TYPE.fullmatch(token)
+            if list_type is None:
+                raise ValueError(f"invalid internalField list in {file_name}")
+            element_type = list_type.group(1).decode()
+            pos = _skip(buffer, pos)
+
+        return _read_list(buffer, pos, element_type, binary, header, file_name)
+
+
+class _FieldBuffer:
+    """Context manager giving the (memory-mapped, if not compressed) bytes."""
+
+    def __init__(self, file_name: str):
+        if not os.path.exists(file_name) and os.path.exists(file_name + ".gz"):
+            file_name += ".gz"
+        self.file_name = file_name
+        self.file = None
+        self.map = None
+
+    def __enter__(self):
+        if self.file_name.endswith(".gz"):
+            with gzip.open(self.file_name, "rb") as f:
+                return f.read()
+        self.file = open(self.file_name, "rb")
+        if os.fstat(self.file.fileno()).st_size == 0:
+            return b""
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def __exit__(self, *args):
+        if self.map is not None:
+            self.map.close()
+        if self.file is not None:
+            self.file.close()
+
+
+def _parse_header(buffer):
+    """Returns the header entries and the position after the header."""
+    match = _HEADER.search(buffer)
+    if match is None:
+        raise ValueError("no FoamFile header")
+    header = {
+        key.decode(): value.strip().decode()
+        for key, value in _HEADER_ENTRY.findall(match.group(1))
+    }
+    return header, match.end()
+
+
+def _element_type(field_class: str) -> str:
+    """Returns the element type of a field class, scalar if not known."""
+    match = _CLASS_TYPE.fullmatch(field_class)
+    if match is None:
+        return "scalar"
+    name = match.group(1)
+    # e.g., volSymmTensorField has the type symmTensor
+    return next(key for key in _COMPONENTS if key.lower() == name.lower())
+
+
+def _skip(buffer, pos: int) -> int:
+    """Returns the position after any whitespace and comments at pos."""
+    return _SPACE_AND_COMMENTS.match(buffer, pos).end()
+
+
+def _token(buffer, pos: int):
+    match = _TOKEN.match(buffer, pos)
+    if match is None:
+        return b"", pos
+    return match.group(), match.end()
+
+
+def _dtype(element_type: str, header: dict, binary: bool) -> np.dtype:
+    arch = header.get("arch", "").strip('"')
+    if element_type == "label":
+        bits = re.search(r"label=(\d+)", arch)
+        dtype = np.dtype(f"i{int(bits.group(1)) // 8 if bits else 4}")
+    else:
+        bits = re.search(r"scalar=(\d+)", arch)
+        dtype = np.dtype(f"f{int(bits.group(1)) // 8 if bits else 8}")
+    if binary:
+        dtype = dtype.newbyteorder(">" if "MSB" in arch else "<")
+    return dtype
+
+
+def _shape(values: np.ndarray, element_type: str) -> np.ndarray:
+    components = _COMPONENTS.get(element_type, 1)
+    if components == 1:
+        return values
+    return values.reshape(-1, components)
+
+
+def _uniform(buffer, pos: int, element_type: str, size, file_name: str):
+    """Returns the value of a uniform field (e.g., "uniform (0 0 1);")."""
+    end = buffer.find(b";", pos)
+    if end < 0:
+        raise ValueError(f"invalid uniform value in {file_name}")
+    text = bytes(buffer[pos:end]).translate(_NO_PARENTHESES)
+    value = np.fromstring(text, sep=" ")
+    if _COMPONENTS.get(element_type, 1) == 1:
+        value = value.reshape(())
+    if size is None:
+        return value
+    return np.broadcast_to(value, (size,) + value.shape).copy()
+
+
+def _read_list(buffer, pos, element_type, binary, header, file_name) -> np.ndarray:
+    """Returns the list at pos, "N (values)" or the uniform list "N{value}"."""
+    token, pos = _token(buffer, _skip(buffer, pos))
+    if not token.isdigit():
+        raise ValueError(f"expected the list size in {file_name}")
+    size = int(token)
+    pos = _skip(buffer, pos)
+    components = _COMPONENTS.get(element_type, 1)
+    count = size * components
+    dtype = _dtype(element_type, header, binary)
+
+    if buffer[pos : pos + 1] == b"{":
+        # A single value, raw bytes in binary files
+        if binary:
+            end = pos + 1 + components * dtype.itemsize
+            if buffer[end : end + 1] != b"}":
+                raise ValueError(f"invalid uniform list in {file_name}")
+            value = np.frombuffer(buffer, dtype=dtype, count=components, offset=pos + 1)
+        else:
+            end = buffer.find(b"}", pos)
+            if end < 0:
+                raise ValueError(f"invalid uniform list in {file_name}")
+            text = bytes(buffer[pos + 1 : end]).translate(_NO_PARENTHESES)
+            value = np.fromstring(text, sep=" ")
+        if len(value) != components:
+            raise ValueError(
+                f"uniform list in {file_name} has {len(value)} of {components} "
+                "values"
+            )
+        value = value.astype(dtype.newbyteorder("="))
+        return _shape(np.tile(value, size), element_type)
+    if buffer[pos : pos + 1] != b"(":
+        raise ValueError(f"expected a list in {file_name}")
+    pos += 1
+
+    if binary:
+        if len(buffer) < pos + count * dtype.itemsize:
+            raise ValueError(f"list in {file_name} is shorter than its size")
+        values = np.frombuffer(buffer, dtype=dtype, count=count, offset=pos)
+        values = values.astype(dtype.newbyteorder("="))
+    else:
+        # The list ends at its first closing parenthesis, or for vectors and
+        # tensors (whose parentheses are dropped) at the one after the last
+        # element
+        if element_type in ("scalar", "label") or size == 0:
+            end = buffer.find(b")", pos)
+            text = bytes(buffer[pos:end])
+        else:
+            match = _LIST_END.search(buffer, pos)
+            end = match.end() - 1 if match else len(buffer)
+            text = bytes(buffer[pos:end]).translate(_NO_PARENTHESES)
+        values = np.fromstring(text, sep=" ")
+        values = values.astype(dtype.newbyteorder("="))
+    if len(values) != count:
+        raise ValueError(f"list in {file_name} has {len(values)} of {count} values")
+    return _shape(values, element_type)
@@ -1,17 +1,28 @@
 """Writes compartment values from openFOAM postprocessing to .csv files"""
 import os
 
+import numpy as np
 import of_compartments.openfoam.compartment_data_reader as cdr
 import pandas as pd
 from of_compartments import utils
+from of_compartments.openfoam.field_distributions import (
+    FIELD_DISTRIBUTIONS_FILE, read_cell_data)
 
 
 def write_compartment_values(
-    case_dir, compartment_config, output_dir, time, high_shear_threshold
+    case_dir,
+    compartment_config,
+    output_dir,
+    time,
+    high_shear_threshold,
+    max_workers=None,
 ):
-    """Write all compartment average and interface values to .csv"""
-    compartment_df, interface_df = get_compartment_values(
-        time, case_dir, compartment_config, high_shear_threshold
+    """
+    Write all compartment average and interface values, and the distributions
+    of the fields in each compartment, to .csv
+    """
+    compartment_df, interface_df, distributions = get_compartment_values(
+        time, case_dir, compartment_config, high_shear_threshold, max_workers
     )
 
     os.system(f"mkdir -p {output_dir}")
@@ -19,47 +30,55 @@ def write_compartment_values(
     interface_output_path = os.path.join(output_dir, "interface_values.csv")
     compartment_df.to_csv(compartment_output_path, index=False)
     interface_df.to_csv(interface_output_path, index=False)
+    if distributions.fields:
+        distributions.to_csv(os.path.join(output_dir, FIELD_DISTRIBUTIONS_FILE))
 
 
-def get_compartment_values(time, case_dir, compartment_config, high_shear_threshold):
-    """Returns dictionary for each field mapping compartment ids to values"""
+def get_compartment_values(
+    time, case_dir, compartment_config, high_shear_threshold, max_workers=None
+):
+    """
+    Returns dictionary for each field mapping compartment ids to values, the
+    interface flows, and the distributions of the fields in each compartment.
+    Compartments' files are read up to max_workers at a time (by default the
+    ThreadPoolExecutor default, 1 to read sequentially).
+    """
     compartments = utils.read_compartment_config(compartment_config)
     compartment_ids = utils.get_ids(compartments)
     top_compartments = list(utils.get_top_compartments_by_id(compartment_ids))
 
-    # Compartment averages
+    # Compartment averages, reading each compartment's averages file once
+    vol_avg = cdr.read_vol_avg(compartment_ids, time, case_dir, max_workers)
+    # Distributions and high shear fractions, reading the per-cell files once
+    distributions, high_tau_fraction = read_cell_data(
+        compartment_ids, time, case_dir, high_shear_threshold, max_workers=max_workers
+    )
     compartment_dict = {
         "compartment": compartment_ids,
-        "gas_holdup": [
-            cdr.read_gas_holdup(id, time, case_dir) for id in compartment_ids
-        ],
-        "kLa": [cdr.read_kLa(id, time, case_dir) for id in compartment_ids],
-        "epsilon": [cdr.read_epsilon(id, time, case_dir) for id in compartment_ids],
-        "volume": [cdr.read_volume(id, time, case_dir) for id in compartment_ids],
+        "gas_holdup": vol_avg["alphaMean.air"].to_numpy(),
+        "kLa": vol_avg["kLa"].to_numpy(),
+        "epsilon": vol_avg["epsilonMean.water"].to_numpy(),
+        "volume": vol_avg["volume"].to_numpy(),
         "top_gas_flux": cdr.read_top_gas_flux(compartment_ids, case_dir),
-        "tau": [cdr.read_tau_average(id, time, case_dir) for id in compartment_ids],
-        "high_tau_fraction": [
-            cdr.read_tau_threshold_fraction(id, time, high_shear_threshold, case_dir)
-            for id in compartment_ids
-        ],
+        "tau": vol_avg["tau_s"].to_numpy(),
+        "high_tau_fraction": high_tau_fraction,
         "is_top": [id in top_compartments for id in compartment_ids],
     }
     compartment_df = pd.DataFrame.from_dict(compartment_dict)
 
     # Interface values
-    flux_matrix = cdr.read_flow(compartment_ids, case_dir, "water")
+    flux_matrix = cdr.read_flow(compartment_ids, case_dir, "water", sparse=True)
     print("\t- Correcting net flow")
-    corrected_flow = utils.correct_flow(flux_matrix)
+    corrected_flow = utils.correct_flow(flux_matrix).tocoo()
 
-    compartment_idx_tuples = [
-        (i, j) for i in range(len(compartment_ids)) for j in range(len(compartment_ids))
-    ]
+    # Only interfaces with nonzero flow are written
+    compartment_ids = np.asarray(compartment_ids)
     interface_dict = {
-        "compartment_src": [compartment_ids[c[0]] for c in compartment_idx_tuples],
-        "compartment_dest": [compartment_ids[c[1]] for c in compartment_idx_tuples],
-        "corrected_flow": [corrected_flow[c[0], c[1]] for c in compartment_idx_tuples],
+        "compartment_src": compartment_ids[corrected_flow.row],
+        "compartment_dest": compartment_ids[corrected_flow.col],
+        "corrected_flow": corrected_flow.data,
     }
 
     interface_df = pd.DataFrame.from_dict(interface_dict)
 
-    return compartment_df, interface_df
+    return compartment_df, interface_df, distributions
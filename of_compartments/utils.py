@@ -1,10 +1,11 @@
 import re
 import subprocess
+import warnings
 from collections import namedtuple
-from functools import partial
 
 import numpy as np
-from scipy.optimize import minimize
+import scipy.sparse as sp
+from scipy.sparse.linalg import spsolve
 
 
 def _parse_field(field, filename):
@@ -149,55 +150,76 @@ def create_boundary_name(c1, c2):
     return f"{c1}_{c2}"
 
 
-def correct_flow(F, tol=1e-6):
+def correct_flow(F, tol=1e-6, max_iter=1000):
     """
     Corrects the flow matrix F.
 
-    Adds small adjustments to minimize the net flow in each compartment.
-    """
-    F_flat = F.ravel()
-    nonzero_idx = np.where(F_flat != 0)
-    F_nonzero = F_flat[nonzero_idx]
-
-    def objective(eps):
-        return np.sum(np.square(eps))
-
-    def flow_equality_constraint(eps):
-        eps_full = np.zeros(len(F_flat))
-        np.put(eps_full, nonzero_idx, eps)
-        eps = np.reshape(eps_full, (F.shape))
-        M = F - eps
-        diffs = M.sum(axis=1) - M.sum(axis=0)
-        return np.sum(np.abs(diffs))
-
-    # See https://stackoverflow.com/a/6805307
-    def correction_bounds_constraint(i, eps):
-        # want abs(eps_ij) <= abs(F_ij), i.e.,
-        # abs(F_ij) - abs(eps_ij) >= 0
-        return np.abs(F_nonzero[i]) - np.abs(eps[i])
-
-    constraints = [
-        {"type": "eq", "fun": flow_equality_constraint},
-    ]
+    Adds the smallest (least squares) adjustments to the nonzero flows so that
+    the net flow in each compartment is zero, without changing any flow by more
+    than its magnitude. F may be dense or sparse; the corrected matrix has the
+    same type and nonzero entries.
 
-    for i in range(len(F_nonzero)):
-        constraints.append(
-            {"type": "ineq", "fun": partial(correction_bounds_constraint, i)}
+    Args:
+        F: Flow matrix, F[i, j] from compartment i to j.
+        tol: Largest remaining net flow, relative to the largest flow.
+        max_iter: Maximum number of Newton iterations.
+    """
+    F_coo = sp.coo_matrix(F)
+    F_coo.sum_duplicates()
+    F_coo.eliminate_zeros()
+    rows, cols, flow = F_coo.row, F_coo.col, F_coo.data.astype(float)
+    num_compartments = F.shape[0]
+    bound = np.abs(flow)
+
+    # B @ flow is the net flow out of each compartment
+    edges = np.arange(len(flow))
+    B = sp.csr_matrix(
+        (
+            np.r_[np.ones(len(flow)), -np.ones(len(flow))],
+            (np.r_[rows, cols], np.r_[edges, edges]),
+        ),
+        shape=(num_compartments, len(flow)),
+    )
+    net_flow = B @ flow
+
+    # The correction minimizing |eps|^2 subject to B @ eps = net_flow and
+    # |eps| <= bound is eps = clip(B^T y, -bound, bound) for the y maximizing
+    # the dual function. It's found by (semismooth) Newton's method, whose
+    # first step from y = 0 solves the graph Laplacian system B B^T y =
+    # net_flow, giving the unbounded correction.
+    def dual_objective(y):
+        v = B.T @ y
+        eps = np.clip(v, -bound, bound)
+        return np.sum(eps * v - 0.5 * np.square(eps)) - y @ net_flow, eps
+
+    y = np.zeros(num_compartments)
+    objective, eps = dual_objective(y)
+    max_residual = tol * np.max(bound, initial=0)
+    for _ in range(max_iter):
+        residual = B @ eps - net_flow
+        if np.max(np.abs(residual), initial=0) <= max_residual:
+            break
+        free = np.abs(B.T @ y) < bound
+        H = B @ sp.diags(free.astype(float)) @ B.T
+        # Regularized for the constant net flow of each connected group of
+        # compartments, which is zero
+        H = H + 1e-10 * sp.identity(num_compartments)
+        step = -spsolve(H.tocsc(), residual)
+        # Backtracking line search
+        size = 1.0
+        while size > 1e-10:
+            new_objective, new_eps = dual_objective(y + size * step)
+            if new_objective <= objective + 1e-4 * size * (residual @ step):
+                break
+            size /= 2
+        y += size * step
+        objective, eps = new_objective, new_eps
+    else:
+        warnings.warn(
+            f"could not balance the flows to tol {tol} in {max_iter} iterations"
         )
 
-    eps_init = np.zeros(len(F_nonzero))
-    sol = minimize(
-        objective,
-        eps_init,
-        constraints=constraints,
-        method="SLSQP",
-        options={"ftol": tol, "maxiter": 1000},
-    )
-    eps = np.zeros(F.shape)
-    np.put(eps, nonzero_idx, sol.x)
-    eps = eps.reshape(F.shape)
-    corrected_F = F - eps
-    if objective(sol.x) > 1 or np.isnan(objective(sol.x)):
-        print(f"objective too high. Trying again with increased tol {tol*10}")
-        corrected_F = correct_flow(F, tol * 10)
-    return corrected_F
+    corrected_F = sp.coo_matrix((flow - eps, (rows, cols)), shape=F.shape)
+    if sp.issparse(F):
+        return corrected_F.asformat(F.format)
+    return corrected_F.toarray()
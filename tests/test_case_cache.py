@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import of_compartments.cellgrowth.damage_models as dm
+import pandas as pd
+import scipy.sparse as sp
+from benchmarks.synthetic_case import write_synthetic_case
+from of_compartments.cellgrowth.case_cache import (CaseCache,
+                                                   damage_model_key,
+                                                   damage_models_key)
+from of_compartments.cellgrowth.compartment_model import CompartmentModel
+
+CASE_DIR = os.path.join("tests", "data", "compartment_case")
+
+
+class TestCaseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.case_dir = os.path.join(self.tmp_dir.name, "case")
+        shutil.copytree(CASE_DIR, self.case_dir, ignore=shutil.ignore_patterns(".*"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def cached_model(self, **kwargs):
+        """Returns a model of the case that must be loaded from the cache."""
+        with mock.patch.object(
+            CompartmentModel, "_readCompartmentData", side_effect=AssertionError
+        ):
+            return CompartmentModel(self.case_dir, cache=True, **kwargs)
+
+    def test_cached_case(self):
+        damage_models = [dm.shearDamageModel_constant(0.2)]
+        cm = CompartmentModel(self.case_dir, damage_models=damage_models, cache=True)
+
+        cm_cached = self.cached_model(damage_models=damage_models)
+        key = damage_models_key(damage_models)
+        self.assertIsNotNone(CaseCache(self.case_dir).load_k_d(key))
+        np.testing.assert_array_equal(cm_cached.case.F, cm.case.F)
+        np.testing.assert_array_equal(cm_cached.case.k_d, cm.case.k_d)
+        np.testing.assert_array_equal(cm_cached.case.transport, cm.case.transport)
+        self.assertEqual(cm_cached.compartment_ids, cm.compartment_ids)
+        for field in ["kLa", "volumes", "is_top", "top_gas_flux"]:
+            np.testing.assert_array_equal(
+                getattr(cm_cached.case.compartment_data, field),
+                getattr(cm.case.compartment_data, field),
+            )
+
+        # Different damage model parameters
+        cm_damage = self.cached_model(
+            damage_models=[dm.shearDamageModel_constant(0.4)]
+        )
+        np.testing.assert_allclose(cm_damage.case.k_d, 2 * cm.case.k_d)
+
+        # The cached arrays can be changed in place
+        cm_cached.case.k_d[0] = 1.0
+        cm_cached.case.compartment_data.kLa[0] = 1.0
+
+    def test_cached_sparse_case(self):
+        write_synthetic_case(self.case_dir, 10, 10)
+        cm = CompartmentModel(self.case_dir, damage_models=[], cache=True)
+        cm_cached = self.cached_model(damage_models=[])
+        self.assertTrue(sp.issparse(cm_cached.case.F))
+        self.assertEqual((cm_cached.case.F != cm.case.F).nnz, 0)
+        self.assertEqual((cm_cached.case.transport != cm.case.transport).nnz, 0)
+
+    def test_cache_invalidated(self):
+        interface_path = os.path.join(self.case_dir, "interface_values.csv")
+        CompartmentModel(self.case_dir, damage_models=[], cache=True)
+
+        # Touching the file keeps the cache
+        os.utime(interface_path, (0, 0))
+        cm = self.cached_model(damage_models=[])
+
+        interface_df = pd.read_csv(interface_path)
+        interface_df["corrected_flow"] *= 2
+        interface_df.to_csv(interface_path, index=False)
+        self.assertIsNone(CaseCache(self.case_dir).load())
+        cm_changed = CompartmentModel(self.case_dir, damage_models=[], cache=True)
+        np.testing.assert_allclose(cm_changed.case.F, 2 * cm.case.F)
+
+    def test_no_cache(self):
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        CompartmentModel(self.case_dir, damage_models=[])
+        CompartmentModel(self.case_dir, damage_models=[], cache=cache_dir)
+        self.assertFalse(os.path.exists(os.path.join(self.case_dir, ".case_cache")))
+        self.assertTrue(os.path.exists(os.path.join(cache_dir, "meta.json")))
+
+    def test_unknown_interface_compartment(self):
+        interface_path = os.path.join(self.case_dir, "interface_values.csv")
+        with open(interface_path, "a") as f:
+            f.write("h0r0,h9r9,0.1\n")
+        with self.assertRaises(ValueError):
+            CompartmentModel(self.case_dir, damage_models=[], cache=False)
+
+    def test_damage_model_key(self):
+        model = dm.eddyDamageModel_lakhotia_papoutsakis(B=1, k_c=10, E_0=0.5, nu=1e-6)
+        same = dm.eddyDamageModel_lakhotia_papoutsakis(B=1, k_c=10, E_0=0.5, nu=1e-6)
+        other = dm.eddyDamageModel_lakhotia_papoutsakis(B=2, k_c=10, E_0=0.5, nu=1e-6)
+        self.assertIsNotNone(damage_model_key(model))
+        self.assertEqual(damage_model_key(model), damage_model_key(same))
+        self.assertNotEqual(damage_model_key(model), damage_model_key(other))
+        self.assertNotEqual(
+            damage_model_key(model),
+            damage_model_key(dm.shearDamageModel_constant(1)),
+        )
+
+        # Lambdas have no name
+        self.assertIsNone(damage_model_key(lambda data: 0.1 * data.kLa))
+
+
+if __name__ == "__main__":
+    unittest.main()
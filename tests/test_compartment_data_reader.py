@@ -0,0 +1,123 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import of_compartments.openfoam.compartment_data_reader as cdr
+
+VOL_FIELD_VALUE = """# Region type : cellZone {zone}_zone
+# Cells  : 120
+# Volume : {volume}
+# Time        \tvolAverage(alpha.air)\tvolAverage(epsilon.water)\tvolAverage(kLa)\tvolAverage(tau_s)
+10\t{values}
+11\t1\t1\t1\t1
+"""
+
+SURFACE_FIELD_VALUE = """# Region type : faceZone boundary_h0r0_h1r0_zone
+# Faces  : 40
+# Area   : 0.0125
+# Time        \tsum(phi.water)
+10\t0.5
+"""
+
+FLUX_DATA = """Row ID,flux_pos,flux_neg,name
+0,1,-2,boundary_h0r0_h0r1_zone
+1,3,-4,boundary_h0r0_h1r0_zone
+2,5,-6,boundary_h0r1_h1r1_zone
+3,7,-8,boundary_h1r0_h1r1_zone
+4,9,0,boundary_h1r0_top_zone
+5,10,0,boundary_h1r1_top_zone
+6,0,0,
+"""
+
+# F[i, j] from zone i to zone j (h0r0, h0r1, h1r0, h1r1)
+FLOW = [[0, 1, 3, 0], [2, 0, 0, 5], [4, 0, 0, 7], [0, 6, 8, 0]]
+
+
+class TestCompartmentDataReader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.case_dir = self.tmp_dir.name
+        self.zones = ["h0r0", "h0r1", "h1r0"]
+        self.volumes = [1e-3, 2.5e-3, 4e-4]
+        self.values = np.array(
+            [[0.01, 0.02, 3.5, 0.1], [0.02, 0.005, 4.5, 0.2], [0.03, 1e-4, 5.5, 0.3]]
+        )
+        for zone, volume, values in zip(self.zones, self.volumes, self.values):
+            file_name = cdr._VOL_AVG_FORMAT.format(
+                zone=zone, t=10, case_dir=self.case_dir
+            )
+            os.makedirs(os.path.dirname(file_name))
+            with open(file_name, "w") as f:
+                f.write(
+                    VOL_FIELD_VALUE.format(
+                        zone=zone,
+                        volume=volume,
+                        values="\t".join(str(value) for value in values),
+                    )
+                )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_read_vol_avg(self):
+        vol_avg = cdr.read_vol_avg(self.zones, 10, self.case_dir)
+        self.assertEqual(list(vol_avg.index), self.zones)
+        np.testing.assert_array_equal(vol_avg["volume"], self.volumes)
+        np.testing.assert_array_equal(
+            vol_avg[cdr.COMPARTMENT_AVERAGE_FIELDS], self.values
+        )
+
+        self.assertEqual(cdr.read_volume("h0r1", 10, self.case_dir), 2.5e-3)
+        self.assertEqual(cdr.read_kLa("h1r0", 10, self.case_dir), 5.5)
+        self.assertEqual(cdr.read_gas_holdup("h0r1", 10, self.case_dir), 0.02)
+        self.assertEqual(cdr.read_epsilon("h0r0", 10, self.case_dir), 0.02)
+        self.assertEqual(cdr.read_tau_average("h1r0", 10, self.case_dir), 0.3)
+
+        with self.assertRaises(FileNotFoundError):
+            cdr.read_vol_avg(["h1r1"], 10, self.case_dir)
+
+    def test_read_vol_avg_threads(self):
+        # Zones are returned in order whatever order the threads finish in
+        zones = self.zones * 20
+        sequential = cdr.read_vol_avg(zones, 10, self.case_dir, max_workers=1)
+        threaded = cdr.read_vol_avg(zones, 10, self.case_dir, max_workers=8)
+        self.assertTrue(threaded.equals(sequential))
+        self.assertEqual(list(threaded.index), zones)
+
+        # Errors of any zone are raised
+        with self.assertRaises(FileNotFoundError):
+            cdr.read_vol_avg(zones + ["h1r1"], 10, self.case_dir, max_workers=8)
+
+    def test_read_flow(self):
+        for phase in ["water", "air"]:
+            with open(os.path.join(self.case_dir, f"flux_data_{phase}.csv"), "w") as f:
+                f.write(FLUX_DATA)
+        zones = ["h0r0", "h0r1", "h1r0", "h1r1"]
+
+        flow = cdr.read_flow(zones, self.case_dir, "water")
+        np.testing.assert_array_equal(flow, FLOW)
+        flow = cdr.read_flow(zones, self.case_dir, "water", sparse=True)
+        self.assertEqual(flow.nnz, 8)
+        np.testing.assert_array_equal(flow.toarray(), FLOW)
+        # Rows follow the order of zones
+        np.testing.assert_array_equal(
+            cdr.read_flow(zones[::-1], self.case_dir, "water"),
+            np.array(FLOW)[::-1, ::-1],
+        )
+
+        np.testing.assert_array_equal(
+            cdr.read_top_gas_flux(zones, self.case_dir), [3, 5, 9, 10]
+        )
+
+    def test_read_area(self):
+        # Parentheses in the path are read as they are
+        file_name = os.path.join(self.case_dir, "area (1)", "surfaceFieldValue.dat")
+        os.makedirs(os.path.dirname(file_name))
+        with open(file_name, "w") as f:
+            f.write(SURFACE_FIELD_VALUE)
+        self.assertEqual(cdr._read_area_from_file(file_name), 0.0125)
+
+
+if __name__ == "__main__":
+    unittest.main()
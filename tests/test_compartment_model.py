@@ -1,7 +1,21 @@
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 
 import numpy as np
+import scipy.sparse as sp
+from benchmarks.synthetic_case import write_synthetic_case
 from of_compartments.cellgrowth.compartment_model import CompartmentModel
+from of_compartments.cellgrowth.growth_models import (
+    growthJacobian_xing_simplified, growthModel_xing_simplified,
+    params_xing_simplified)
+from of_compartments.cellgrowth.output_store import (MemoryOutput,
+                                                     SimulationStore)
+
+CASE_DIR = os.path.join("tests", "data", "compartment_case")
+INITIAL_CONCENTRATIONS = [100, 10, 0, 0, 1.07 / 5, 0.2e9]
 
 
 class TestCompartmentModel(unittest.TestCase):
@@ -14,3 +28,326 @@ class TestCompartmentModel(unittest.TestCase):
         flux = CompartmentModel._get_flux_array(concentrations, F, volumes)
         expected = np.array([0.85, -0.55, -0.5, 0.75])
         np.testing.assert_allclose(flux, expected)
+
+    def test_get_transport_matrix(self):
+        concentrations = np.array([1, 2, 1, 0.5])
+        F = np.array(
+            [[0, 0.1, 0.5, 1.2], [1, 0, 0.1, 0], [0.5, 1, 0, 0.3], [0.3, 0, 1.2, 0]]
+        )
+        volumes = np.array([1, 2, 1, 1])
+        T = CompartmentModel._get_transport_matrix(F, volumes)
+        np.testing.assert_allclose(
+            T @ concentrations,
+            CompartmentModel._get_flux_array(concentrations, F, volumes),
+        )
+
+    def test_sparse_flow_matrix(self):
+        with tempfile.TemporaryDirectory() as case_dir:
+            write_synthetic_case(case_dir, 10, 10)
+            cm = CompartmentModel(case_dir, damage_models=[], cache=False)
+        F = cm.case.F
+        self.assertTrue(sp.issparse(F))
+        self.assertEqual(F.nnz, 2 * (9 * 10 + 10 * 9))
+
+        concentrations = np.linspace(1, 2, 100)
+        volumes = cm.case.compartment_data.volumes
+        flux = CompartmentModel._get_flux_array(concentrations, F, volumes)
+        np.testing.assert_allclose(
+            flux,
+            CompartmentModel._get_flux_array(concentrations, F.toarray(), volumes),
+        )
+        np.testing.assert_allclose(cm.case.transport @ concentrations, flux)
+
+        params_list = [
+            params_xing_simplified,
+            {**params_xing_simplified, "mu_m": 0.035},
+        ]
+        result = cm.run_ensemble(
+            time=2,
+            growth_model=growthModel_xing_simplified,
+            params_list=params_list,
+            initial_conditions_list=[INITIAL_CONCENTRATIONS],
+            growth_jacobian=growthJacobian_xing_simplified,
+            max_workers=2,
+        )
+        self.assertTrue(np.all(result.success))
+        sol = cm.run_sim(
+            time=2,
+            growth_model=growthModel_xing_simplified,
+            params=params_list[1],
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            growth_jacobian=growthJacobian_xing_simplified,
+        )
+        np.testing.assert_allclose(result.z[1, -1], sol.z[-1], rtol=1e-6)
+
+    def test_update_model_transport(self):
+        cm = CompartmentModel(CASE_DIR, damage_models=[])
+        z = np.arange(12, dtype=float).reshape(3, 4)
+        volumes = cm.case.compartment_data.volumes
+        expected = np.array(
+            [CompartmentModel._get_flux_array(c, cm.case.F, volumes) for c in z]
+        )
+
+        def no_growth(t, z, p, case):
+            return np.zeros(z.shape)
+
+        result = CompartmentModel._update_model(
+            0, z.ravel(), {}, cm.case, cm.compartment_ids, no_growth
+        )
+        np.testing.assert_allclose(result, expected.ravel())
+
+        # sparse operator, as used for large numbers of compartments
+        cm.case.transport = CompartmentModel._get_transport_matrix(cm.case.F, volumes)
+        result = CompartmentModel._update_model(
+            0, z.ravel(), {}, cm.case, cm.compartment_ids, no_growth
+        )
+        np.testing.assert_allclose(result, expected.ravel())
+
+    def test_run_sim_with_growth_jacobian(self):
+        cm = CompartmentModel(CASE_DIR, damage_models=[])
+        sol_fd = cm.run_sim(
+            time=48,
+            growth_model=growthModel_xing_simplified,
+            params=params_xing_simplified,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+        )
+        sol_jac = cm.run_sim(
+            time=48,
+            growth_model=growthModel_xing_simplified,
+            params=params_xing_simplified,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            growth_jacobian=growthJacobian_xing_simplified,
+        )
+        np.testing.assert_allclose(sol_jac.z[-1], sol_fd.z[-1], rtol=1e-5)
+        self.assertLess(sol_jac.nfev, sol_fd.nfev)
+
+    def test_run_ensemble(self):
+        cm = CompartmentModel(CASE_DIR, damage_models=[])
+        params_list = [
+            params_xing_simplified,
+            {**params_xing_simplified, "mu_m": 0.035},
+        ]
+        initial_conditions_list = [
+            INITIAL_CONCENTRATIONS,
+            INITIAL_CONCENTRATIONS[:-1] + [0.5e9],
+        ]
+        result = cm.run_ensemble(
+            time=24,
+            growth_model=growthModel_xing_simplified,
+            params_list=params_list,
+            initial_conditions_list=initial_conditions_list,
+            growth_jacobian=growthJacobian_xing_simplified,
+            max_workers=2,
+        )
+        self.assertEqual(result.z.shape, (2, 25, 6, 4))
+        np.testing.assert_array_equal(result.t, np.arange(25))
+        self.assertTrue(np.all(result.success))
+
+        for i in range(2):
+            sol = cm.run_sim(
+                time=24,
+                growth_model=growthModel_xing_simplified,
+                params=params_list[i],
+                initial_concentrations=initial_conditions_list[i],
+                growth_jacobian=growthJacobian_xing_simplified,
+            )
+            np.testing.assert_allclose(result.z[i, -1], sol.z[-1], rtol=1e-6)
+
+    def test_run_ensemble_shared_memory_cleanup(self):
+        # The resource tracker runs in its own process and reports to stderr
+        script = (
+            "from of_compartments.cellgrowth.compartment_model import "
+            "CompartmentModel\n"
+            "from of_compartments.cellgrowth.growth_models import "
+            "growthModel_xing_simplified, params_xing_simplified\n"
+            "if __name__ == '__main__':\n"
+            f"    cm = CompartmentModel({CASE_DIR!r}, damage_models=[])\n"
+            "    cm.run_ensemble(2, growthModel_xing_simplified, "
+            f"[params_xing_simplified], [{INITIAL_CONCENTRATIONS!r}] * 2, "
+            "max_workers=2)\n"
+        )
+        process = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True
+        )
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertNotIn("Traceback", process.stderr)
+        self.assertNotIn("leaked", process.stderr)
+
+    def test_run_sim_output_path(self):
+        cm = CompartmentModel(CASE_DIR, damage_models=[])
+        sol = cm.run_sim(
+            time=24,
+            growth_model=growthModel_xing_simplified,
+            params=params_xing_simplified,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            t_eval=np.arange(25),
+        )
+        with tempfile.TemporaryDirectory() as output_path:
+            sol_stored = cm.run_sim(
+                time=24,
+                growth_model=growthModel_xing_simplified,
+                params=params_xing_simplified,
+                initial_concentrations=INITIAL_CONCENTRATIONS,
+                output_path=output_path,
+            )
+            self.assertIsInstance(sol_stored.z, np.memmap)
+            np.testing.assert_array_equal(sol_stored.t, np.arange(25))
+            np.testing.assert_allclose(sol_stored.z, sol.z)
+
+            store = SimulationStore(output_path)
+            np.testing.assert_allclose(store.z, sol.z)
+            np.testing.assert_allclose(store.y, sol.y)
+            np.testing.assert_allclose(store.v, sol.v)
+
+    def test_memory_output_empty(self):
+        output = MemoryOutput(6)
+        self.assertEqual(output.t.shape, (0,))
+        self.assertEqual(output.y.shape, (6, 0))
+
+    def test_run_sim_t_eval_outside_time(self):
+        cm = CompartmentModel(CASE_DIR, damage_models=[])
+        with self.assertRaises(ValueError):
+            cm.run_sim(
+                time=12,
+                growth_model=growthModel_xing_simplified,
+                params=params_xing_simplified,
+                initial_concentrations=INITIAL_CONCENTRATIONS,
+                t_eval=np.arange(25),
+            )
+
+    def test_run_sim_strang(self):
+        cm = CompartmentModel(CASE_DIR, damage_models=[])
+        kwargs = dict(
+            time=12,
+            growth_model=growthModel_xing_simplified,
+            params=params_xing_simplified,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            t_eval=np.arange(0, 13, 3),
+        )
+        sol = cm.run_sim(**kwargs, growth_jacobian=growthJacobian_xing_simplified)
+        sol_strang = cm.run_sim(**kwargs, method="strang", split_step=0.05)
+        self.assertTrue(sol_strang.success)
+        np.testing.assert_array_equal(sol_strang.t, sol.t)
+        np.testing.assert_allclose(sol_strang.z[:, 5], sol.z[:, 5], rtol=1e-4)
+        np.testing.assert_allclose(sol_strang.z[:, 4], sol.z[:, 4], atol=0.02)
+
+        # Sparse transport operator and analytic growth Jacobian
+        sol_strang_jac = cm.run_sim(
+            **kwargs,
+            method="strang",
+            split_step=0.05,
+            growth_jacobian=growthJacobian_xing_simplified,
+        )
+        cm.case.transport = CompartmentModel._get_transport_matrix(
+            cm.case.F, cm.case.compartment_data.volumes
+        )
+        sol_strang_sparse = cm.run_sim(
+            **kwargs,
+            method="strang",
+            split_step=0.05,
+            growth_jacobian=growthJacobian_xing_simplified,
+        )
+        np.testing.assert_allclose(sol_strang_jac.z, sol_strang.z, rtol=1e-6)
+        np.testing.assert_allclose(sol_strang_sparse.z, sol_strang_jac.z, rtol=1e-6)
+
+    def test_run_sim_fast_species(self):
+        cm = CompartmentModel(CASE_DIR, damage_models=[])
+        kwargs = dict(
+            time=24,
+            growth_model=growthModel_xing_simplified,
+            params=params_xing_simplified,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            t_eval=np.arange(25),
+        )
+        sol = cm.run_sim(**kwargs, growth_jacobian=growthJacobian_xing_simplified)
+        for growth_jacobian in [None, growthJacobian_xing_simplified]:
+            sol_qss = cm.run_sim(
+                **kwargs,
+                growth_jacobian=growth_jacobian,
+                fast_species=[4],
+                check_qssa=True,
+            )
+            self.assertTrue(sol_qss.success)
+            self.assertEqual(sol_qss.z.shape, sol.z.shape)
+            # Dissolved oxygen doesn't affect the other species
+            np.testing.assert_array_less(np.delete(sol_qss.qssa_error, 4), 1e-6)
+            # After the initial transient, the oxygen error is close to the
+            # estimate
+            do_error = np.max(np.abs(sol_qss.z[3:, 4] - sol.z[3:, 4]), axis=1)
+            np.testing.assert_allclose(
+                do_error, sol_qss.qssa_error_estimate[3:, 0], rtol=0.2, atol=1e-6
+            )
+
+    def test_run_sim_stats(self):
+        cm = CompartmentModel(CASE_DIR, damage_models=[])
+        reports = []
+        sol = cm.run_sim(
+            time=48,
+            growth_model=growthModel_xing_simplified,
+            params=params_xing_simplified,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            growth_jacobian=growthJacobian_xing_simplified,
+            progress=lambda t, time, rate: reports.append((t, time, rate)),
+        )
+        stats = sol.stats
+        self.assertEqual(stats.nfev, sol.nfev)
+        self.assertEqual(stats.nlu, sol.nlu)
+        self.assertEqual(stats.n_accepted, len(sol.t) - 1)
+        self.assertGreaterEqual(stats.n_rejected, 0)
+        self.assertGreater(stats.growth_time, 0)
+        self.assertGreater(stats.transport_time, 0)
+        self.assertGreater(stats.overhead_time, 0)
+        self.assertGreater(stats.peak_memory, 0)
+        # The final report is at the end time
+        self.assertEqual(reports[-1][:2], (48, 48))
+        self.assertGreater(reports[-1][2], 0)
+
+    def test_run_sim_resume(self):
+        cm = CompartmentModel(CASE_DIR, damage_models=[])
+        kwargs = dict(
+            growth_model=growthModel_xing_simplified,
+            params=params_xing_simplified,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            growth_jacobian=growthJacobian_xing_simplified,
+            t_eval=np.arange(49),
+        )
+        sol = cm.run_sim(time=48, **kwargs)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_path = os.path.join(tmp_dir, "checkpoint.npz")
+            cm.run_sim(
+                time=24,
+                checkpoint_path=checkpoint_path,
+                **{**kwargs, "t_eval": np.arange(25)},
+            )
+
+            # Extend the finished run to 48 hours
+            sol_resumed = cm.run_sim(time=48, resume_from=checkpoint_path, **kwargs)
+            self.assertTrue(sol_resumed.success)
+            np.testing.assert_array_equal(sol_resumed.t, sol.t)
+            np.testing.assert_allclose(sol_resumed.z, sol.z, rtol=1e-5, atol=1e-9)
+
+            with self.assertRaises(ValueError):
+                cm.run_sim(
+                    time=48,
+                    resume_from=checkpoint_path,
+                    **{**kwargs, "params": {**params_xing_simplified, "mu_m": 0.035}},
+                )
+
+            # An extension shorter than the saved step size
+            checkpoint_48 = os.path.join(tmp_dir, "checkpoint_48.npz")
+            cm.run_sim(time=48, checkpoint_path=checkpoint_48, **kwargs)
+            sol_short = cm.run_sim(
+                time=48.01,
+                resume_from=checkpoint_48,
+                **{**kwargs, "t_eval": [48.01]},
+            )
+            self.assertTrue(sol_short.success)
+            np.testing.assert_array_equal(sol_short.t, np.append(sol.t, 48.01))
+            np.testing.assert_allclose(sol_short.z[-1], sol.z[-1], rtol=1e-3)
+
+            with self.assertRaises(ValueError):
+                cm.run_sim(time=48, resume_from=checkpoint_48, **kwargs)
+
+
+if __name__ == "__main__":
+    unittest.main()
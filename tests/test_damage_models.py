@@ -1,7 +1,9 @@
 import unittest
+from unittest import mock
 
 import numpy as np
 import of_compartments.cellgrowth.damage_models as dm
+import scipy.integrate as si
 from of_compartments import utils
 from of_compartments.cellgrowth.compartment_model import CompartmentData
 
@@ -19,6 +21,22 @@ class TestDamageModels(unittest.TestCase):
             403.76738260,
         )
 
+    def test_eddy_energy_lakhotia_papoutsakis(self):
+        eps = np.concatenate([[0, -1], np.logspace(-2, 6, 30)])
+        for k_c, nu in [(10, 1e-6), (30, 0.0007 / 993), (300, 1e-2), (1, 0)]:
+            I = dm.eddy_energy_lakhotia_papoutsakis(eps, k_c, nu)
+            expected, _ = si.quad_vec(
+                lambda k: 1.7
+                * eps[2:] ** (2 / 3)
+                * k ** (-5 / 3)
+                * np.exp(-2.55 * nu * eps[2:] ** (-1 / 3) * k ** (4 / 3)),
+                k_c,
+                np.inf,
+                epsrel=1e-10,
+            )
+            np.testing.assert_array_equal(I[:2], 0)
+            np.testing.assert_allclose(I[2:], expected, rtol=1e-7, atol=1e-12)
+
     def test_shearDamageModel_constant(self):
         compartment_data = self.make_compartment_data(
             1, 2, high_shear_fraction=np.array([0.1, 0.8])
@@ -68,6 +86,98 @@ class TestDamageModels(unittest.TestCase):
         self.assertGreater(q3, 0)
         self.assertGreater(q4, 0)
 
+    def test_damage_rate_sweep(self):
+        compartment_data = self.make_compartment_data(
+            2,
+            2,
+            volume=np.array([0.1, 1, 1, 0.5]),
+            top_gas_flux=np.array([0.0007, 1, 0.01, 0.004]),
+            high_shear_fraction=np.array([0.1, 0.8, 0, 0.3]),
+            epsilon=np.array([1, 2, 0.5, 0]),
+        )
+        radii = np.linspace(1e-3, 5e-3, 5)
+        k_d = dm.damage_rate_sweep(
+            dm.bubbleDamageModel_cherry1992,
+            compartment_data,
+            bubble_radius=radii,
+            Psi=0.3,
+        )
+        self.assertEqual(k_d.shape, (5, 4))
+        for radius, row in zip(radii, k_d):
+            np.testing.assert_allclose(
+                row, dm.bubbleDamageModel_cherry1992(radius, Psi=0.3)(compartment_data)
+            )
+
+        thresholds = np.array(["low", "mid"])
+        death_fractions = np.array([0.2, 0.4, 1])
+        k_d = dm.damage_rate_sweep(
+            dm.bubbleDamageModel_walls2017,
+            compartment_data,
+            bubble_radius=0.002,
+            threshold=thresholds[:, np.newaxis],
+            death_fraction=death_fractions,
+        )
+        self.assertEqual(k_d.shape, (2, 3, 4))
+        for i, threshold in enumerate(thresholds):
+            for j, death_fraction in enumerate(death_fractions):
+                np.testing.assert_allclose(
+                    k_d[i, j],
+                    dm.bubbleDamageModel_walls2017(
+                        0.002, threshold, death_fraction
+                    )(compartment_data),
+                )
+
+        k_d = dm.damage_rate_sweep(
+            dm.eddyDamageModel_lakhotia_papoutsakis,
+            compartment_data,
+            B=1,
+            k_c=[10, 30],
+            E_0=0.5,
+            nu=1e-6,
+        )
+        np.testing.assert_allclose(
+            k_d[1],
+            dm.eddyDamageModel_lakhotia_papoutsakis(B=1, k_c=30, E_0=0.5, nu=1e-6)(
+                compartment_data
+            ),
+        )
+        np.testing.assert_allclose(
+            dm.damage_rate_sweep(
+                dm.shearDamageModel_constant, compartment_data, rate=[0.1, 0.2]
+            ),
+            [[0.01, 0.08, 0, 0.03], [0.02, 0.16, 0, 0.06]],
+        )
+
+        with self.assertRaises(ValueError):
+            dm.damage_rate_sweep(
+                dm.eddyDamageModel_lakhotia_papoutsakis, compartment_data, B=1
+            )
+        with self.assertRaises(ValueError):
+            dm.damage_rate_sweep(lambda rate: None, compartment_data, rate=1)
+
+    def test_damage_rate_sweep_memoized(self):
+        compartment_data = self.make_compartment_data(
+            1, 2, high_shear_fraction=np.array([0.1, 0.8])
+        )
+        rates = np.array([0.1, 0.3, 0.5])
+        k_d = dm.damage_rate_sweep(
+            dm.shearDamageModel_constant, compartment_data, rate=rates
+        )
+        with mock.patch.dict(
+            dm._VECTORIZED, {dm.shearDamageModel_constant: mock.Mock()}
+        ) as vectorized:
+            # Already computed for the same data and parameters
+            np.testing.assert_array_equal(
+                dm.shearDamageModel_constant(0.3)(compartment_data), k_d[1]
+            )
+            vectorized[dm.shearDamageModel_constant].assert_not_called()
+
+        # Different compartment data
+        compartment_data.high_shear_fraction = np.array([0.2, 0.8])
+        np.testing.assert_allclose(
+            dm.shearDamageModel_constant(0.3)(compartment_data), [0.06, 0.24]
+        )
+
     def make_compartment_data(
         self,
         n_radial,
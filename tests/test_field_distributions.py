@@ -0,0 +1,180 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import of_compartments.openfoam.compartment_data_reader as cdr
+from of_compartments.openfoam import COMPARTMENT_AVERAGE_FIELDS
+from of_compartments.openfoam.field_distributions import (
+    FieldDistributions, read_cell_data, read_field_distributions,
+    volume_weighted_quantiles)
+
+FIELD_FILE = """FoamFile
+{{
+    format      ascii;
+    class       scalarField;
+    object      {object};
+}}
+
+{size}
+(
+{values}
+)
+"""
+
+
+class TestFieldDistributions(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.case_dir = self.tmp_dir.name
+        rng = np.random.default_rng(0)
+        self.zones = ["h0r0", "h0r1"]
+        self.volumes = [rng.uniform(1e-6, 2e-6, 500), rng.uniform(1e-6, 3e-6, 200)]
+        self.values = {
+            field: [rng.lognormal(0, 1, len(v)) for v in self.volumes]
+            for field in COMPARTMENT_AVERAGE_FIELDS
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write_field(self, file_name, values):
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(file_name, "w") as f:
+            f.write(
+                FIELD_FILE.format(
+                    object=os.path.basename(file_name),
+                    size=len(values),
+                    values="\n".join(map(repr, np.asarray(values).tolist())),
+                )
+            )
+
+    def test_volume_weighted_quantiles(self):
+        values = [3.0, 1.0, 2.0, 4.0]
+        volumes = [1.0, 1.0, 2.0, 0.0]
+        np.testing.assert_array_equal(
+            volume_weighted_quantiles(values, volumes, [0, 0.25, 0.5, 0.75, 1]),
+            [1, 1, 2, 2, 3],
+        )
+        self.assertTrue(np.isnan(volume_weighted_quantiles([], [], [0.5])).all())
+
+    def test_fractions(self):
+        levels = np.linspace(0, 1, 101)
+        quantiles = {
+            "tau_s": [
+                volume_weighted_quantiles(values, volumes, levels)
+                for values, volumes in zip(self.values["tau_s"], self.volumes)
+            ]
+        }
+        distributions = FieldDistributions(self.zones, levels, quantiles)
+
+        for threshold in [0.05, 0.5, 1.0, 3.0, 100.0]:
+            exact = [
+                np.sum(volumes * (values > threshold)) / np.sum(volumes)
+                for values, volumes in zip(self.values["tau_s"], self.volumes)
+            ]
+            np.testing.assert_allclose(
+                distributions.fraction_above("tau_s", threshold), exact, atol=0.01
+            )
+        np.testing.assert_array_equal(distributions.fraction_above("tau_s", 1e3), 0)
+        np.testing.assert_array_equal(distributions.fraction_above("tau_s", 0), 1)
+        # A threshold per compartment
+        np.testing.assert_allclose(
+            distributions.fraction_above("tau_s", [0.5, 3.0]),
+            [
+                distributions.fraction_above("tau_s", 0.5)[0],
+                distributions.fraction_above("tau_s", 3.0)[1],
+            ],
+        )
+
+        median = distributions.quantile("tau_s", 0.5)
+        np.testing.assert_allclose(
+            distributions.fraction_below("tau_s", median), 0.5, atol=1e-12
+        )
+
+        # Equal quantiles (e.g., many cells without gas)
+        distributions = FieldDistributions(
+            ["h0r0"], [0, 0.5, 1], {"alphaMean.air": [[0, 0, 1]]}
+        )
+        self.assertEqual(distributions.fraction_above("alphaMean.air", 0), 0.5)
+        self.assertEqual(distributions.fraction_above("alphaMean.air", 0.5), 0.25)
+
+    def test_read_field_distributions(self):
+        for i, zone in enumerate(self.zones):
+            self._write_field(
+                cdr._CELL_VOLUME_FORMAT.format(zone=zone, t=10, case_dir=self.case_dir),
+                self.volumes[i],
+            )
+            for field, values in self.values.items():
+                self._write_field(
+                    cdr._CELL_FIELD_FORMAT.format(
+                        field=field, zone=zone, t=10, case_dir=self.case_dir
+                    ),
+                    values[i],
+                )
+
+        distributions = read_field_distributions(
+            self.zones, 10, self.case_dir, num_levels=11, max_workers=2
+        )
+        self.assertEqual(distributions.fields, COMPARTMENT_AVERAGE_FIELDS)
+        for field, values in self.values.items():
+            self.assertEqual(distributions.quantiles[field].shape, (2, 11))
+            np.testing.assert_array_equal(
+                distributions.quantile(field, 0), [np.min(v) for v in values]
+            )
+            np.testing.assert_array_equal(
+                distributions.quantile(field, 1), [np.max(v) for v in values]
+            )
+
+        file_name = os.path.join(self.case_dir, "field_distributions.csv")
+        distributions.to_csv(file_name)
+        read = FieldDistributions.from_csv(file_name)
+        self.assertEqual(read.compartments, self.zones)
+        self.assertEqual(read.fields, distributions.fields)
+        np.testing.assert_allclose(read.levels, distributions.levels)
+        for field in distributions.fields:
+            np.testing.assert_array_equal(
+                read.quantiles[field], distributions.quantiles[field]
+            )
+
+    def test_read_cell_data_without_distribution_fields(self):
+        # Cases post-processed before the distributions only have tau_s and V
+        for i, zone in enumerate(self.zones):
+            self._write_field(
+                cdr._CELL_VOLUME_FORMAT.format(zone=zone, t=10, case_dir=self.case_dir),
+                self.volumes[i],
+            )
+            self._write_field(
+                cdr._TAU_FORMAT.format(zone=zone, t=10, case_dir=self.case_dir),
+                self.values["tau_s"][i],
+            )
+
+        with self.assertWarns(UserWarning):
+            distributions, high_shear_fractions = read_cell_data(
+                self.zones, 10, self.case_dir, high_shear_threshold=1.0
+            )
+        self.assertEqual(distributions.fields, ["tau_s"])
+        np.testing.assert_allclose(
+            high_shear_fractions,
+            [
+                cdr.read_tau_threshold_fraction(zone, 10, 1.0, self.case_dir)
+                for zone in self.zones
+            ],
+        )
+        # The exact fraction agrees with the one from the distribution
+        np.testing.assert_allclose(
+            high_shear_fractions,
+            [
+                np.sum(volumes * (values > 1.0)) / np.sum(volumes)
+                for values, volumes in zip(self.values["tau_s"], self.volumes)
+            ],
+        )
+        np.testing.assert_allclose(
+            high_shear_fractions,
+            distributions.fraction_above("tau_s", 1.0),
+            atol=1 / (len(distributions.levels) - 1),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import of_compartments.openfoam.compartment_data_reader as cdr
+from of_compartments.openfoam import field_reader
+
+HEADER = """\
+/*--------------------------------*- C++ -*----------------------------------*\\
+  =========                 |
+  \\\\      /  F ield         | OpenFOAM: The Open Source CFD Toolbox
+   \\\\    /   O peration     | Website:  https://openfoam.org
+    \\\\  /    A nd           | Version:  9
+     \\\\/     M anipulation  |
+\\*---------------------------------------------------------------------------*/
+FoamFile
+{{
+    format      {format};
+    class       {cls};
+    location    "10";
+    object      {object};
+    arch        "{arch}";
+}}
+// * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * //
+
+"""
+
+FOOTER = """
+
+// ************************************************************************* //
+"""
+
+
+def _ascii_list(values):
+    return f"{len(values)}\n(\n" + "\n".join(map(str, values)) + "\n)\n"
+
+
+class TestFieldReader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.case_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, name, body, format="ascii", cls="scalarField", arch=None):
+        file_name = os.path.join(self.case_dir, name)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        header = HEADER.format(
+            format=format,
+            cls=cls,
+            object=os.path.basename(name),
+            arch=arch or "LSB;label=32;scalar=64",
+        )
+        if isinstance(body, str):
+            body = body.encode()
+        data = header.encode() + body + FOOTER.encode()
+        if name.endswith(".gz"):
+            data = gzip.compress(data)
+        with open(file_name, "wb") as f:
+            f.write(data)
+        return file_name
+
+    def test_ascii(self):
+        values = [1.5e-9, 2.0, 3.25e-10, 4]
+        file_name = self._write("scalar", _ascii_list(values))
+        np.testing.assert_array_equal(field_reader.read_field(file_name), values)
+        header = field_reader.read_field_header(file_name)
+        self.assertEqual(header["class"], "scalarField")
+        self.assertEqual(header["object"], "scalar")
+
+        vectors = [[0, 0.5, 1], [1e-3, -2, 3]]
+        file_name = self._write(
+            "vector",
+            _ascii_list([f"({' '.join(map(str, v))})" for v in vectors]),
+            cls="vectorField",
+        )
+        np.testing.assert_array_equal(field_reader.read_field(file_name), vectors)
+
+        file_name = self._write("short", "3\n(\n1\n2\n)\n")
+        with self.assertRaises(ValueError):
+            field_reader.read_field(file_name)
+
+    def test_internal_field(self):
+        body = (
+            "dimensions      [0 2 -2 0 0 0 0];\n\n"
+            "internalField   nonuniform List<scalar> \n3\n(\n0.1\n0.2\n0.3\n)\n;\n\n"
+            "boundaryField\n{\n    walls\n    {\n        type zeroGradient;\n    }\n}\n"
+        )
+        file_name = self._write("tau", body, cls="volScalarField")
+        np.testing.assert_array_equal(
+            field_reader.read_field(file_name), [0.1, 0.2, 0.3]
+        )
+
+        body = "dimensions [0 1 -1 0 0 0 0];\n\ninternalField   uniform (0 0 1);\n"
+        file_name = self._write("U", body, cls="volVectorField")
+        np.testing.assert_array_equal(field_reader.read_field(file_name), [0, 0, 1])
+        np.testing.assert_array_equal(
+            field_reader.read_field(file_name, size=2), [[0, 0, 1], [0, 0, 1]]
+        )
+
+        body = "dimensions [0 0 0 0 0 0 0];\n\ninternalField   uniform 0.5;\n"
+        file_name = self._write("alpha", body, cls="volScalarField")
+        self.assertEqual(field_reader.read_field(file_name), 0.5)
+        np.testing.assert_array_equal(
+            field_reader.read_field(file_name, size=3), [0.5, 0.5, 0.5]
+        )
+
+        file_name = self._write("uniform_list", "4{2.5}\n")
+        np.testing.assert_array_equal(field_reader.read_field(file_name), [2.5] * 4)
+
+        file_name = self._write("invalid_uniform_list", "4{2.5 1}\n")
+        with self.assertRaises(ValueError):
+            field_reader.read_field(file_name)
+
+    def test_binary(self):
+        values = np.array([1.5e-9, 2.0, 3.25e-10])
+        body = b"3\n(" + values.astype("<f8").tobytes() + b")\n"
+        file_name = self._write("little", body, format="binary")
+        np.testing.assert_array_equal(field_reader.read_field(file_name), values)
+
+        body = b"3\n(" + values.astype(">f4").tobytes() + b")\n"
+        file_name = self._write(
+            "big", body, format="binary", arch="MSB;label=32;scalar=32"
+        )
+        np.testing.assert_array_equal(
+            field_reader.read_field(file_name), values.astype(np.float32)
+        )
+
+        labels = np.array([3, -1, 7])
+        body = b"3\n(" + labels.astype("<i8").tobytes() + b")\n"
+        file_name = self._write(
+            "labels", body, format="binary", cls="labelList", arch="LSB;label=64"
+        )
+        np.testing.assert_array_equal(field_reader.read_field(file_name), labels)
+
+        # Uniform lists, e.g., the volumes of a zone of equal cells
+        value = np.array([2.5e-9])
+        body = b"4{" + value.astype("<f8").tobytes() + b"}\n"
+        file_name = self._write("uniform", body, format="binary")
+        np.testing.assert_array_equal(
+            field_reader.read_field(file_name), np.repeat(value, 4)
+        )
+
+        vector = np.array([0.0, 125.0, -1.0])
+        body = b"2{" + vector.astype("<f8").tobytes() + b"}\n"
+        file_name = self._write(
+            "uniform_vector", body, format="binary", cls="vectorField"
+        )
+        np.testing.assert_array_equal(
+            field_reader.read_field(file_name), [vector, vector]
+        )
+
+        body = b"2{" + value.astype("<f4").tobytes() + b"}\n"
+        file_name = self._write("short_uniform", body, format="binary")
+        with self.assertRaises(ValueError):
+            field_reader.read_field(file_name)
+
+    def test_gzip(self):
+        file_name = self._write("compressed.gz", _ascii_list([1, 2, 3]))
+        np.testing.assert_array_equal(field_reader.read_field(file_name), [1, 2, 3])
+        # The compressed file is found from the uncompressed name
+        np.testing.assert_array_equal(
+            field_reader.read_field(file_name[: -len(".gz")]), [1, 2, 3]
+        )
+
+    def test_read_tau_threshold_fraction(self):
+        volumes = [1e-6, 2e-6, 3e-6, 4e-6]
+        shear = [0.5, 2.0, 1.5, 0.1]
+        self._write("10/V_cellZone-h0r0_zone", _ascii_list(volumes))
+        self._write(
+            "10/tau_s_cellZone-h0r0_zone", _ascii_list(shear), cls="volScalarField"
+        )
+        np.testing.assert_array_equal(
+            cdr.read_cell_volumes("h0r0", 10, self.case_dir), volumes
+        )
+        self.assertAlmostEqual(
+            cdr.read_tau_threshold_fraction("h0r0", 10, 1.0, self.case_dir),
+            (2e-6 + 3e-6) / 10e-6,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import unittest
+
+import numpy as np
+from of_compartments.cellgrowth.compartment_model import CompartmentModel
+from of_compartments.cellgrowth.growth_models import (
+    XingSimplified, growthJacobian_xing_simplified,
+    growthModel_xing_simplified, params_xing_simplified)
+from of_compartments.cellgrowth.growth_protocol import (GrowthModel,
+                                                        LegacyGrowthModel,
+                                                        as_growth_model)
+
+
+class TestGrowthModels(unittest.TestCase):
+    def test_growthJacobian_xing_simplified(self):
+        case = CompartmentModel(
+            os.path.join("tests", "data", "compartment_case"), damage_models=[]
+        ).case
+        case.k_d = np.array([0.001, 0, 0.002, 0])
+        z = np.array(
+            [
+                [50, 20, 0.01, 80],
+                [5, 0.02, 3, 8],
+                [10, 2, 30, 1],
+                [1, 4, 0.5, 7],
+                [0.5, 0.2, 1.0, 0.1],
+                [2e9, 1e9, 5e8, 3e9],
+            ]
+        )
+        p = params_xing_simplified
+        J = growthJacobian_xing_simplified(0, z, p, case)
+
+        expected = np.zeros(J.shape)
+        for j in range(z.shape[0]):
+            h = 1e-6 * z[j, :]
+            z_pos = z.copy()
+            z_neg = z.copy()
+            z_pos[j, :] += h
+            z_neg[j, :] -= h
+            expected[:, j, :] = (
+                growthModel_xing_simplified(0, z_pos, p, case)
+                - growthModel_xing_simplified(0, z_neg, p, case)
+            ) / (2 * h)
+        np.testing.assert_allclose(J, expected, rtol=1e-5, atol=1e-20)
+
+    def test_XingSimplified(self):
+        cm = CompartmentModel(
+            os.path.join("tests", "data", "compartment_case"), damage_models=[]
+        )
+        cm.case.k_d = np.array([0.001, 0, 0.002, 0])
+        z = np.array(
+            [
+                [50, 0, 0.01, 80],
+                [5, 0.02, -1, 8],
+                [10, 2, 30, 1],
+                [1, 4, 0.5, 7],
+                [0.5, 0.2, 1.0, 0.1],
+                [2e9, 1e9, 5e8, 3e9],
+            ]
+        )
+        p = params_xing_simplified
+        model = XingSimplified()
+        out = np.full(z.shape, np.nan)
+        model.rates(0, z, model.bind(p), cm.case, out)
+        np.testing.assert_allclose(
+            out, growthModel_xing_simplified(0, z, p, cm.case), rtol=1e-12
+        )
+        # Reusing the work arrays
+        for _ in range(2):
+            J = np.full(z.shape[:1] + z.shape, np.nan)
+            model.jacobian(0, z, model.bind(p), cm.case, J)
+            np.testing.assert_allclose(
+                J, growthJacobian_xing_simplified(0, z, p, cm.case), rtol=1e-12
+            )
+
+        initial_concentrations = [100, 10, 0, 0, 1.07 / 5, 0.2e9]
+        sol = cm.run_sim(
+            time=24,
+            growth_model=model,
+            params=p,
+            initial_concentrations=initial_concentrations,
+            t_eval=np.arange(25),
+        )
+        sol_function = cm.run_sim(
+            time=24,
+            growth_model=growthModel_xing_simplified,
+            params=p,
+            initial_concentrations=initial_concentrations,
+            growth_jacobian=growthJacobian_xing_simplified,
+            t_eval=np.arange(25),
+        )
+        self.assertEqual(sol.njev, sol_function.njev)
+        np.testing.assert_allclose(sol.z, sol_function.z, rtol=1e-7)
+
+        # The legacy signature works for the methods that use it
+        sol_strang = cm.run_sim(
+            time=24,
+            growth_model=model,
+            params=p,
+            initial_concentrations=initial_concentrations,
+            t_eval=np.arange(25),
+            method="strang",
+        )
+        sol_strang_function = cm.run_sim(
+            time=24,
+            growth_model=growthModel_xing_simplified,
+            params=p,
+            initial_concentrations=initial_concentrations,
+            growth_jacobian=growthJacobian_xing_simplified,
+            t_eval=np.arange(25),
+            method="strang",
+        )
+        np.testing.assert_allclose(sol_strang.z, sol_strang_function.z, rtol=1e-7)
+
+    def test_as_growth_model(self):
+        model = XingSimplified()
+        self.assertIs(as_growth_model(model), model)
+        self.assertIs(as_growth_model(model, model.local_jacobian), model)
+
+        adapted = as_growth_model(
+            growthModel_xing_simplified, growthJacobian_xing_simplified
+        )
+        self.assertIsInstance(adapted, LegacyGrowthModel)
+        self.assertTrue(adapted.has_jacobian)
+        self.assertIs(adapted.bind(params_xing_simplified), params_xing_simplified)
+        self.assertFalse(as_growth_model(growthModel_xing_simplified).has_jacobian)
+
+        class NoRates(GrowthModel):
+            pass
+
+        with self.assertRaises(TypeError):
+            NoRates()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import pickle
+import unittest
+
+import numpy as np
+from of_compartments.cellgrowth.compartment_model import CompartmentModel
+from of_compartments.cellgrowth.growth_models import (
+    growthJacobian_xing_simplified, growthModel_xing_simplified,
+    kineticModel_xing_simplified, params_xing_simplified)
+from of_compartments.cellgrowth.kinetic_model import KineticModel
+
+CASE_DIR = os.path.join("tests", "data", "compartment_case")
+
+
+class TestKineticModel(unittest.TestCase):
+    def setUp(self):
+        self.cm = CompartmentModel(CASE_DIR, damage_models=[])
+        self.cm.case.k_d = np.array([0.001, 0, 0.002, 0])
+
+    def test_xing_simplified(self):
+        z = np.array(
+            [
+                [50, 0, 0.01, 80],
+                [5, 0.02, -1, 8],
+                [10, 2, 30, 1],
+                [1, 4, 0.5, 7],
+                [0.5, 0.2, 1.0, 0.1],
+                [2e9, 1e9, 5e8, 3e9],
+            ]
+        )
+        model = kineticModel_xing_simplified
+        p = params_xing_simplified
+        np.testing.assert_allclose(
+            model(0, z, p, self.cm.case),
+            growthModel_xing_simplified(0, z, p, self.cm.case),
+            rtol=1e-12,
+        )
+        np.testing.assert_allclose(
+            model.local_jacobian(0, z, p, self.cm.case),
+            growthJacobian_xing_simplified(0, z, p, self.cm.case),
+            rtol=1e-10,
+        )
+
+        initial_concentrations = model.initial_concentrations(
+            S=100, G=10, L=0, A=0, DO=1.07 / 5, X=0.2e9
+        )
+        sol = self.cm.run_sim(
+            time=24,
+            growth_model=model,
+            params=p,
+            initial_concentrations=initial_concentrations,
+            t_eval=np.arange(25),
+        )
+        self.assertTrue(sol.success)
+        self.assertGreater(sol.njev, 0)
+        np.testing.assert_array_equal(sol.species["X"], sol.z[:, 5, :])
+        np.testing.assert_array_equal(sol.species["DO"], sol.z[:, 4, :])
+
+        with self.assertRaises(ValueError):
+            model.initial_concentrations(S=100, G=10)
+
+    def test_jacobian(self):
+        model = KineticModel(
+            species=["A", "B", "C"],
+            parameters=["k", "n"],
+            expressions={"r": "k * exp(-A / 2) * B ** n", "s": "sqrt(r + C)"},
+            rates={
+                "A": "-r * log(1 + B) + epsilon * t",
+                "B": "s / (1 + A ** B) - kLa * B",
+                "C": "-(+C) * s + 3",
+            },
+            clip={"C": "(A > 1.5) & (B < 2)"},
+        )
+        self.cm.case.compartment_data.epsilon = np.array([0.1, 0.2, 0.3, 0.4])
+        p = {"k": 0.7, "n": 1.5}
+        z = np.array([[0.5, 1.0, 2.0, 0.2], [1.5, 0.3, 1.0, 2.5], [2.0, 1.0, 0.5, 3]])
+        rates = model(2.0, z, p, self.cm.case)
+        np.testing.assert_array_equal(rates[2, 2], 0)
+        self.assertNotEqual(rates[2, 0], 0)
+
+        J = model.local_jacobian(2.0, z, p, self.cm.case)
+        expected = np.zeros(J.shape)
+        for j in range(z.shape[0]):
+            h = 1e-6
+            z_pos = z.copy()
+            z_neg = z.copy()
+            z_pos[j, :] += h
+            z_neg[j, :] -= h
+            expected[:, j, :] = (
+                model(2.0, z_pos, p, self.cm.case) - model(2.0, z_neg, p, self.cm.case)
+            ) / (2 * h)
+        np.testing.assert_allclose(J, expected, rtol=1e-6, atol=1e-9)
+
+        copy = pickle.loads(pickle.dumps(model))
+        np.testing.assert_array_equal(copy(2.0, z, p, self.cm.case), rates)
+
+    def test_invalid_spec(self):
+        for spec in [
+            {"rates": {"X": "X * unknown"}},
+            {"rates": {"Y": "1"}},
+            {"rates": {"X": "X * (X > 1)"}},
+            {"rates": {"X": "max(X, 1)"}},
+            {"rates": {"X": "X"}, "clip": {"X": "X"}},
+            {"rates": {"X": "X"}, "expressions": {"t": "X"}},
+            {"rates": {"X": "X +"}},
+        ]:
+            with self.assertRaises(ValueError):
+                KineticModel(species=["X"], parameters=["k"], **spec)
+        with self.assertRaisesRegex(ValueError, "keyword"):
+            KineticModel(species=["X"], parameters=["lambda"], rates={"X": "X"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import unittest
+
+import numpy as np
+from of_compartments.cellgrowth.compartment_model import CompartmentModel
+from of_compartments.cellgrowth.lagrangian import track_cells
+
+CASE_DIR = os.path.join("tests", "data", "compartment_case")
+
+
+class TestLagrangian(unittest.TestCase):
+    def setUp(self):
+        self.cm = CompartmentModel(CASE_DIR, damage_models=[])
+
+    def test_exposures(self):
+        data = self.cm.case.compartment_data
+        volumes = np.asarray(data.volumes)
+        exposures = track_cells(
+            self.cm.case,
+            num_cells=20_000,
+            time=1.0,
+            seed=0,
+            batch_size=7_000,
+            epsilon_thresholds=[0.008],
+        )
+        self.assertEqual(len(exposures.epsilon), 20_000)
+        # Cells start in the stationary distribution, so the mean exposures
+        # are the volume-weighted means of the rates
+        fraction = volumes / volumes.sum()
+        is_top = np.asarray(data.is_top, dtype=float)
+        self.assertAlmostEqual(
+            np.mean(exposures.epsilon), fraction @ data.epsilon, delta=1e-4
+        )
+        self.assertAlmostEqual(np.mean(exposures.top_time), fraction @ is_top, 2)
+        self.assertAlmostEqual(
+            np.mean(exposures.epsilon_threshold_time[:, 0]),
+            fraction @ (np.asarray(data.epsilon) > 0.008),
+            2,
+        )
+        # Each cell leaves its compartment at the total outflow per volume
+        exit_rates = (self.cm.case.F.sum(axis=1) - np.diag(self.cm.case.F)) / volumes
+        self.assertAlmostEqual(
+            np.mean(exposures.num_jumps) / (fraction @ exit_rates), 1, 2
+        )
+        self.assertTrue(np.all(exposures.max_epsilon <= np.max(data.epsilon)))
+        counts, _ = exposures.distribution("epsilon", bins=10)
+        self.assertEqual(counts.sum(), 20_000)
+
+        # Reproducible for the same seed
+        repeated = track_cells(
+            self.cm.case,
+            num_cells=20_000,
+            time=1.0,
+            seed=0,
+            batch_size=7_000,
+            epsilon_thresholds=[0.008],
+        )
+        np.testing.assert_array_equal(repeated.epsilon, exposures.epsilon)
+        np.testing.assert_array_equal(
+            repeated.end_compartment, exposures.end_compartment
+        )
+
+    def test_initial_compartments(self):
+        exposures = track_cells(
+            self.cm.case,
+            num_cells=100,
+            time=0.0,
+            seed=0,
+            initial_compartments=np.full(100, 2),
+        )
+        np.testing.assert_array_equal(exposures.end_compartment, 2)
+        np.testing.assert_array_equal(exposures.num_jumps, 0)
+
+        with self.assertRaises(ValueError):
+            track_cells(self.cm.case, 10, 1.0, initial_compartments=[0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from benchmarks.synthetic_case import write_synthetic_case
+from of_compartments.cellgrowth.compartment_model import CompartmentModel
+from of_compartments.cellgrowth.growth_models import (
+    growthJacobian_xing_simplified, growthModel_xing_simplified,
+    params_xing_simplified)
+from of_compartments.cellgrowth.lumping import (_create_lumped_case,
+                                                lump_compartments,
+                                                lumping_report)
+
+CASE_DIR = os.path.join("tests", "data", "compartment_case")
+INITIAL_CONCENTRATIONS = [100, 10, 0, 0, 1.07 / 5, 0.2e9]
+
+
+class TestLumping(unittest.TestCase):
+    def setUp(self):
+        self.cm = CompartmentModel(CASE_DIR, damage_models=[])
+
+    def test_no_lumping_within_tolerance(self):
+        lumped = lump_compartments(self.cm.case)
+        np.testing.assert_array_equal(lumped.groups, np.arange(4))
+        np.testing.assert_allclose(lumped.case.F, self.cm.case.F)
+        np.testing.assert_allclose(lumped.case.transport, self.cm.case.transport)
+
+    def test_lump_compartments(self):
+        case = self.cm.case
+        data = case.compartment_data
+        rtol = {"kLa": 10, "epsilon": 10, "gas_holdup": 100, "k_d": 10}
+        lumped = lump_compartments(case, rtol=rtol)
+
+        # Top compartments are only merged with each other
+        np.testing.assert_array_equal(lumped.groups, [0, 0, 1, 1])
+        lumped_data = lumped.case.compartment_data
+        self.assertEqual(lumped_data.ids, ["h0r0+h0r1", "h1r0+h1r1"])
+        np.testing.assert_array_equal(lumped_data.is_top, [False, True])
+        np.testing.assert_allclose(lumped_data.volumes, [0.08, 0.12])
+        np.testing.assert_allclose(
+            lumped_data.kLa[0],
+            np.sum(data.kLa[:2] * data.volumes[:2]) / 0.08,
+        )
+        np.testing.assert_allclose(
+            lumped_data.top_gas_flux, np.sum(data.top_gas_flux.reshape(2, 2), axis=1)
+        )
+        np.testing.assert_allclose(lumped.case.F[0, 1], np.sum(case.F[:2, 2:]))
+        np.testing.assert_allclose(lumped.case.F[1, 0], np.sum(case.F[2:, :2]))
+        np.testing.assert_allclose(np.diag(lumped.case.F), 0)
+
+        # Transport conserves mass
+        np.testing.assert_allclose(
+            lumped_data.volumes @ lumped.case.transport, 0, atol=1e-12
+        )
+
+        report = lumping_report(
+            case,
+            lumped,
+            48,
+            growthModel_xing_simplified,
+            params_xing_simplified,
+            INITIAL_CONCENTRATIONS,
+            growth_jacobian=growthJacobian_xing_simplified,
+        )
+        self.assertEqual(report.num_lumped_compartments, 2)
+        self.assertEqual(report.mean_deviation.shape, (6,))
+        self.assertLess(report.mean_deviation[5], 0.05)
+        self.assertTrue(np.all(report.local_deviation >= report.mean_deviation))
+
+    def test_lump_lumped_case(self):
+        with tempfile.TemporaryDirectory() as case_dir:
+            write_synthetic_case(case_dir, 4, 3)
+            case = CompartmentModel(case_dir, damage_models=[], cache=False).case
+        data = case.compartment_data
+        lumped = lump_compartments(case, rtol={"epsilon": 0.3})
+        lumped_again = lump_compartments(
+            lumped.case, rtol={"kLa": 100, "epsilon": 100}
+        )
+        groups = lumped_again.groups[lumped.groups]
+        self.assertLess(len(np.unique(lumped.groups)), len(data.ids))
+
+        # Everything below the top level is one group, whose gas leaves
+        # through the top of the level below the top one
+        is_top = np.asarray(data.is_top)
+        self.assertEqual(len(np.unique(groups[~is_top])), 1)
+        below_top = np.array([id.startswith("h2") for id in data.ids])
+        lumped_data = lumped_again.case.compartment_data
+        np.testing.assert_allclose(
+            lumped_data.top_gas_flux[groups[~is_top][0]],
+            np.sum(data.top_gas_flux[below_top]),
+        )
+        np.testing.assert_allclose(
+            lumped_data.top_gas_flux,
+            _create_lumped_case(case, groups).compartment_data.top_gas_flux,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
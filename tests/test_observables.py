@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import of_compartments.cellgrowth.damage_models as dm
+from of_compartments.cellgrowth.compartment_model import CompartmentModel
+from of_compartments.cellgrowth.growth_models import (
+    growthJacobian_xing_simplified, growthModel_xing_simplified,
+    params_xing_simplified)
+from of_compartments.cellgrowth.observables import (Integral, Maximum, Minimum,
+                                                    VolumeWeightedMean,
+                                                    record_observables)
+from scipy.integrate import trapezoid
+
+CASE_DIR = os.path.join("tests", "data", "compartment_case")
+INITIAL_CONCENTRATIONS = [100, 10, 0, 0, 1.07 / 5, 0.2e9]
+
+OBSERVABLES = {
+    "vcd": VolumeWeightedMean(5, scale=1e-9),
+    "metabolites": VolumeWeightedMean([0, 1, 2, 3]),
+    "do_min": Minimum(4),
+    "do_max": Maximum(4),
+    "dead": Integral(lambda t, z, case: case.k_d * z[:, 5, :]),
+}
+
+
+class TestObservables(unittest.TestCase):
+    def setUp(self):
+        self.cm = CompartmentModel(
+            CASE_DIR, damage_models=[dm.shearDamageModel_constant(0.01)]
+        )
+
+    def run_sim(self, **kwargs):
+        return self.cm.run_sim(
+            time=24,
+            growth_model=growthModel_xing_simplified,
+            params=params_xing_simplified,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            growth_jacobian=growthJacobian_xing_simplified,
+            observables=OBSERVABLES,
+            **kwargs,
+        )
+
+    def test_observables(self):
+        sol = self.run_sim()
+        v = sol.v
+        np.testing.assert_allclose(
+            sol.observables["vcd"], 1e-9 * (sol.z[:, 5, :] @ v) / np.sum(v)
+        )
+        self.assertEqual(sol.observables["metabolites"].shape, (len(sol.t), 4))
+        np.testing.assert_allclose(
+            sol.observables["metabolites"][:, 2], (sol.z[:, 2, :] @ v) / np.sum(v)
+        )
+        np.testing.assert_allclose(
+            sol.observables["do_min"], np.min(sol.z[:, 4, :], axis=1)
+        )
+        np.testing.assert_allclose(
+            sol.observables["do_max"], np.max(sol.z[:, 4, :], axis=1)
+        )
+        dead = sol.observables["dead"]
+        self.assertEqual(dead.shape, (len(sol.t), 4))
+        np.testing.assert_allclose(dead[0], 0)
+        np.testing.assert_allclose(
+            dead[-1], trapezoid(self.cm.case.k_d * sol.z[:, 5, :], sol.t, axis=0)
+        )
+
+        recorded = record_observables(OBSERVABLES, self.cm.case, sol.t, sol.z)
+        for name, values in recorded.items():
+            np.testing.assert_allclose(sol.observables[name], values)
+
+    def test_without_states(self):
+        t_eval = np.arange(25)
+        sol = self.run_sim(t_eval=t_eval)
+        sol_observables = self.run_sim(t_eval=t_eval, store_states=False)
+        self.assertIsNone(sol_observables.z)
+        np.testing.assert_array_equal(sol_observables.t, t_eval)
+        for name, values in sol.observables.items():
+            np.testing.assert_allclose(sol_observables.observables[name], values)
+
+        # Neither states nor observables, e.g., for the solver statistics
+        sol_none = self.cm.run_sim(
+            time=24,
+            growth_model=growthModel_xing_simplified,
+            params=params_xing_simplified,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            t_eval=t_eval,
+            store_states=False,
+        )
+        self.assertTrue(sol_none.success)
+        self.assertIsNone(sol_none.z)
+        np.testing.assert_array_equal(sol_none.t, t_eval)
+
+        with self.assertRaises(ValueError):
+            self.run_sim(store_states=False, output_path="unused")
+
+    def test_resume_without_states(self):
+        kwargs = dict(
+            growth_model=growthModel_xing_simplified,
+            params=params_xing_simplified,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            growth_jacobian=growthJacobian_xing_simplified,
+            observables=OBSERVABLES,
+            t_eval=np.arange(49),
+            store_states=False,
+        )
+        sol = self.cm.run_sim(time=48, **kwargs)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_path = os.path.join(tmp_dir, "checkpoint.npz")
+            self.cm.run_sim(
+                time=24,
+                checkpoint_path=checkpoint_path,
+                **{**kwargs, "t_eval": np.arange(25)},
+            )
+            sol_resumed = self.cm.run_sim(
+                time=48, resume_from=checkpoint_path, **kwargs
+            )
+        np.testing.assert_array_equal(sol_resumed.t, sol.t)
+        for name, values in sol.observables.items():
+            np.testing.assert_allclose(
+                sol_resumed.observables[name], values, rtol=1e-5, atol=1e-9
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
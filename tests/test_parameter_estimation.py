@@ -0,0 +1,80 @@
+import os
+import unittest
+
+import numpy as np
+from of_compartments.cellgrowth.compartment_model import CompartmentModel
+from of_compartments.cellgrowth.growth_models import (
+    growthJacobian_xing_simplified, growthModel_xing_simplified,
+    params_xing_simplified)
+from of_compartments.cellgrowth.parameter_estimation import (
+    Measurements, ParameterEstimator)
+
+CASE_DIR = os.path.join("tests", "data", "compartment_case")
+INITIAL_CONCENTRATIONS = [100, 10, 0, 0, 1.07 / 5, 0.2e9]
+
+
+class TestParameterEstimator(unittest.TestCase):
+    def setUp(self):
+        self.cm = CompartmentModel(CASE_DIR, damage_models=[])
+        true_params = {**params_xing_simplified, "mu_m": 0.035}
+        t = np.arange(0, 73, 12)
+        sol = self.cm.run_sim(
+            time=72,
+            growth_model=growthModel_xing_simplified,
+            params=true_params,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            growth_jacobian=growthJacobian_xing_simplified,
+            t_eval=t,
+        )
+        species = [0, 2, 5]
+        values = np.sum(sol.z[:, species, :] * sol.v, axis=-1) / np.sum(sol.v)
+        # glucose isn't measured on the first day
+        values[:2, 0] = np.nan
+        sigma = 0.01 * np.nanmax(values, axis=0)
+        self.measurements = Measurements(t=t, species=species, values=values, sigma=sigma)
+
+    def _estimator(self, **kwargs):
+        return ParameterEstimator(
+            self.cm.case,
+            growthModel_xing_simplified,
+            params_xing_simplified,
+            ["mu_m"],
+            INITIAL_CONCENTRATIONS,
+            self.measurements,
+            growth_jacobian=growthJacobian_xing_simplified,
+            **kwargs,
+        )
+
+    def test_residuals_cached(self):
+        with self._estimator(max_workers=1) as estimator:
+            theta = estimator.to_theta(params_xing_simplified)
+            r = estimator.residuals(np.vstack([theta, theta]))
+            self.assertEqual(r.shape, (2, 19))
+            estimator.residuals(theta)
+            self.assertEqual(estimator.num_simulations, 1)
+
+    def test_least_squares(self):
+        with self._estimator(max_workers=2) as estimator:
+            result = estimator.least_squares()
+        self.assertTrue(result.success)
+        self.assertAlmostEqual(result.params["mu_m"], 0.035, delta=1e-4)
+
+    def test_mcmc(self):
+        with self._estimator(max_workers=1) as estimator:
+            theta = estimator.to_theta({"mu_m": 0.035})
+            result = estimator.mcmc(
+                num_walkers=4,
+                num_steps=3,
+                bounds=(theta - 1, theta + 1),
+                x0=theta,
+                spread=1e-3,
+                seed=0,
+            )
+        self.assertEqual(result.chain.shape, (3, 4, 1))
+        self.assertEqual(result.log_prob.shape, (3, 4))
+        self.assertTrue(np.all(np.isfinite(result.log_prob)))
+        np.testing.assert_allclose(result.chain[..., 0], theta[0], atol=0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
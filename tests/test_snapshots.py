@@ -0,0 +1,157 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from of_compartments.cellgrowth.compartment_model import CompartmentModel
+from of_compartments.cellgrowth.growth_models import (
+    growthJacobian_xing_simplified, growthModel_xing_simplified,
+    params_xing_simplified)
+from of_compartments.cellgrowth.observables import Integral, VolumeWeightedMean
+from scipy.integrate import trapezoid
+
+CASE_DIR = os.path.join("tests", "data", "compartment_case")
+INITIAL_CONCENTRATIONS = [100, 10, 0, 0, 1.07 / 5, 0.2e9]
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.case_dir = self.tmp_dir.name
+        for name in ["0", "24"]:
+            shutil.copytree(
+                CASE_DIR,
+                os.path.join(self.case_dir, name),
+                ignore=shutil.ignore_patterns(".*"),
+            )
+        # More aeration and mixing from t=24
+        compartment_path = os.path.join(self.case_dir, "24", "compartment_values.csv")
+        compartment_df = pd.read_csv(compartment_path)
+        compartment_df["kLa"] *= 2
+        compartment_df.to_csv(compartment_path, index=False)
+        interface_path = os.path.join(self.case_dir, "24", "interface_values.csv")
+        interface_df = pd.read_csv(interface_path)
+        interface_df["corrected_flow"] *= 3
+        interface_df.to_csv(interface_path, index=False)
+
+        self.cm_static = CompartmentModel(
+            os.path.join(self.case_dir, "0"), damage_models=[], cache=False
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_sim(self, cm, time, **kwargs):
+        return cm.run_sim(
+            time=time,
+            growth_model=growthModel_xing_simplified,
+            params=params_xing_simplified,
+            initial_concentrations=INITIAL_CONCENTRATIONS,
+            **kwargs,
+        )
+
+    def test_interpolated_case(self):
+        cm = CompartmentModel(self.case_dir, damage_models=[], cache=False)
+        snapshots = cm.case.snapshots
+        np.testing.assert_array_equal(snapshots.times, [0, 24])
+        kLa = self.cm_static.case.compartment_data.kLa
+        np.testing.assert_allclose(cm.case.compartment_data.kLa, kLa)
+        np.testing.assert_allclose(snapshots.at(-1).compartment_data.kLa, kLa)
+        np.testing.assert_allclose(snapshots.at(6).compartment_data.kLa, 1.25 * kLa)
+        np.testing.assert_allclose(snapshots.at(30).compartment_data.kLa, 2 * kLa)
+
+        c = np.array([1.0, 2.0, 3.0, 4.0])
+        np.testing.assert_allclose(
+            snapshots.at(12).transport @ c, 2 * (self.cm_static.case.transport @ c)
+        )
+        np.testing.assert_allclose(
+            snapshots.transport_jacobian(12, 2) @ np.tile(c, 2),
+            np.tile(2 * (self.cm_static.case.transport @ c), 2),
+        )
+
+        cm_previous = CompartmentModel(
+            self.case_dir,
+            damage_models=[],
+            cache=False,
+            snapshot_interpolation="previous",
+        )
+        np.testing.assert_allclose(
+            cm_previous.case.snapshots.at(23.9).compartment_data.kLa, kLa
+        )
+
+    def test_different_volumes(self):
+        compartment_path = os.path.join(self.case_dir, "24", "compartment_values.csv")
+        compartment_df = pd.read_csv(compartment_path)
+        compartment_df["volume"] *= 1.1
+        compartment_df.to_csv(compartment_path, index=False)
+        with self.assertRaisesRegex(ValueError, "different compartment volumes"):
+            CompartmentModel(self.case_dir, damage_models=[], cache=False)
+
+    def test_run_sim(self):
+        cm = CompartmentModel(
+            self.case_dir,
+            damage_models=[],
+            cache=False,
+            snapshot_interpolation="previous",
+        )
+        t_eval = np.arange(49)
+        sol = self.run_sim(
+            cm, 48, t_eval=t_eval, growth_jacobian=growthJacobian_xing_simplified
+        )
+        self.assertTrue(sol.success)
+        sol_static = self.run_sim(
+            self.cm_static,
+            48,
+            t_eval=t_eval,
+            growth_jacobian=growthJacobian_xing_simplified,
+        )
+        # Same until the second snapshot, with more oxygen transfer after it
+        np.testing.assert_allclose(sol.z[:24], sol_static.z[:24], rtol=1e-5)
+        self.assertTrue(np.all(sol.z[30:, 4] > sol_static.z[30:, 4]))
+
+        # The Jacobian follows the snapshots, and the estimated one covers the
+        # sparsity of all of them
+        cm.case.snapshots.interpolation = "linear"
+        sol_jac = self.run_sim(
+            cm, 48, t_eval=t_eval, growth_jacobian=growthJacobian_xing_simplified
+        )
+        sol_fd = self.run_sim(cm, 48, t_eval=t_eval)
+        np.testing.assert_allclose(sol_jac.z, sol_fd.z, rtol=1e-5, atol=1e-9)
+
+        with self.assertRaises(ValueError):
+            self.run_sim(cm, 48, method="strang")
+
+    def test_observables(self):
+        # Damage rates that double with the aeration from t=24
+        cm = CompartmentModel(
+            self.case_dir,
+            damage_models=[lambda data: 1e-3 * np.asarray(data.kLa)],
+            cache=False,
+        )
+        sol = self.run_sim(
+            cm,
+            48,
+            t_eval=np.arange(49),
+            observables={
+                "vcd": VolumeWeightedMean(5),
+                "dead": Integral(lambda t, z, case: case.k_d * z[:, 5, :]),
+            },
+        )
+        self.assertEqual(sol.v.shape, (49, 4))
+        k_d = np.array([cm.case.snapshots.at(t).k_d for t in sol.t])
+        np.testing.assert_allclose(k_d[12], 1.5 * k_d[0])
+        np.testing.assert_allclose(k_d[36], 2 * k_d[0])
+        np.testing.assert_allclose(
+            sol.observables["dead"][-1],
+            trapezoid(k_d * sol.z[:, 5, :], sol.t, axis=0),
+        )
+        np.testing.assert_allclose(
+            sol.observables["vcd"],
+            np.sum(sol.z[:, 5, :] * sol.v, axis=1) / np.sum(sol.v, axis=1),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic_case import write_synthetic_case
+from of_compartments.cellgrowth.compartment_model import CompartmentModel
+
+
+class TestSyntheticCase(unittest.TestCase):
+    def test_write_synthetic_case(self):
+        with tempfile.TemporaryDirectory() as case_dir:
+            write_synthetic_case(case_dir, 6, 4)
+            interface_df = pd.read_csv(os.path.join(case_dir, "interface_values.csv"))
+            cm = CompartmentModel(case_dir, damage_models=[])
+
+        # Only nonzero flows between neighbors are written
+        self.assertTrue(np.all(interface_df["corrected_flow"] > 0))
+        self.assertEqual(len(interface_df), 2 * (5 * 4 + 6 * 3))
+
+        F = cm.case.F
+        self.assertEqual(F.shape, (24, 24))
+        np.testing.assert_allclose(F.sum(axis=0), F.sum(axis=1), rtol=1e-10)
+        np.testing.assert_allclose(
+            np.sum(cm.case.compartment_data.volumes), np.pi * 0.28**2 * 0.86
+        )
+        np.testing.assert_array_equal(
+            np.flatnonzero(cm.case.compartment_data.is_top), np.arange(20, 24)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 
 import numpy as np
+import scipy.sparse as sp
 from of_compartments import utils
 from of_compartments.utils import Compartment
 
@@ -71,6 +72,35 @@ class TestUtils(unittest.TestCase):
         self.assertAlmostEqual(flow[0, 1], corrected_flow[0, 1], places=1)
         self.assertAlmostEqual(flow[1, 0], corrected_flow[1, 0], places=1)
 
+    def test_correct_flow_sparse(self):
+        flow = sp.csr_matrix(
+            np.array([[0, 1.02, 0.5, 0], [1, 0, 0, 0.3], [0.52, 0, 0, 1], [0, 0.3, 1, 0]])
+        )
+        corrected_flow = utils.correct_flow(flow)
+        self.assertTrue(sp.issparse(corrected_flow))
+        self.assertEqual((corrected_flow != 0).nnz, flow.nnz)
+        np.testing.assert_allclose(
+            corrected_flow.sum(axis=0), corrected_flow.sum(axis=1).T, atol=1e-12
+        )
+        np.testing.assert_allclose(
+            corrected_flow.toarray(),
+            utils.correct_flow(flow.toarray()),
+            atol=1e-12,
+        )
+
+    def test_correct_flow_bounds(self):
+        # The least squares correction would make the smaller flow negative
+        flow = np.array([[0, 1.0, 0], [0.01, 0, 0], [0, 0, 0]])
+        corrected_flow = utils.correct_flow(flow)
+        np.testing.assert_allclose(
+            corrected_flow, [[0, 0.02, 0], [0.02, 0, 0], [0, 0, 0]], atol=1e-9
+        )
+
+    def test_correct_flow_not_converged(self):
+        flow = np.array([[0, 1.01], [1.02, 0]])
+        with self.assertWarnsRegex(UserWarning, "could not balance the flows"):
+            utils.correct_flow(flow, max_iter=0)
+
     def make_compartment_id(self, id, is_top=False):
         return Compartment(
             bottom_height=0,